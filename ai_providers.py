@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI模型服务接入
+所有服务商共用进程内的HTTP连接池(见http_client)，鉴权令牌(如百度access_token)缓存到过期前，
+批量请求时不会为每次调用重新握手TLS或重新获取令牌
+"""
+
+import os
+import time
+import types
+import threading
+
+from openai import OpenAI
+
+import config
+from http_client import get_http_client
+
+
+class ProviderError(Exception):
+    """服务商返回的错误，status_code为429时限流器会退避重试"""
+
+    def __init__(self, message, status_code=None, response=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = response
+
+
+class ChatResult:
+    """一次对话请求的结果"""
+
+    def __init__(self, content, total_tokens=None):
+        self.content = content
+        self.total_tokens = total_tokens
+
+    @property
+    def usage(self):
+        """与OpenAI响应相同的用量接口，供限流器按实际Token数结算"""
+        return self
+
+    @property
+    def choices(self):
+        """与OpenAI响应相同的 choices[0].message.content 接口"""
+        return [types.SimpleNamespace(message=types.SimpleNamespace(content=self.content))]
+
+
+class OpenAICompatibleProvider:
+    """OpenAI兼容接口(通义千问、讯飞星火、智谱ChatGLM)"""
+
+    def __init__(self, api_key, base_url, model_id):
+        """
+        参数:
+            api_key: API密钥
+            base_url: 兼容接口地址
+            model_id: 接口中的模型名称
+        """
+        self.model_id = model_id
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=get_http_client(),
+            max_retries=0  # 429由限流器统一退避重试
+        )
+
+    def chat(self, messages, temperature=None):
+        """
+        发送对话请求
+
+        参数:
+            messages: [{"role": ..., "content": ...}] 消息列表
+            temperature: 生成的随机性
+
+        返回:
+            ChatResult
+        """
+        extra_args = {} if temperature is None else {"temperature": temperature}
+        completion = self.client.chat.completions.create(model=self.model_id, messages=messages, **extra_args)
+        usage = getattr(completion, 'usage', None)
+        return ChatResult(completion.choices[0].message.content, getattr(usage, 'total_tokens', None))
+
+
+# 百度文心一言接口
+BAIDU_TOKEN_URL = "https://aip.baidubce.com/oauth/2.0/token"
+BAIDU_CHAT_URL = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/"
+
+# 令牌过期前提前刷新的时间(秒)
+TOKEN_REFRESH_MARGIN = 3600
+
+# 百度接口的错误码：令牌无效或过期、请求过于频繁
+BAIDU_TOKEN_ERRORS = (110, 111)
+BAIDU_RATE_LIMIT_ERRORS = (4, 17, 18)
+
+
+class ErnieProvider:
+    """百度文心一言，access_token缓存到过期前"""
+
+    # 同一密钥在进程内共享令牌
+    _tokens = {}
+    _tokens_lock = threading.Lock()
+
+    def __init__(self, api_key, secret_key, endpoint):
+        """
+        参数:
+            api_key: 百度API Key
+            secret_key: 百度Secret Key
+            endpoint: 模型对应的接口名称，如 completions、eb-instant
+        """
+        if not secret_key:
+            raise ValueError("使用百度文心一言需要同时提供API Key和Secret Key")
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.url = BAIDU_CHAT_URL + endpoint
+        self.http = get_http_client()
+
+    def _access_token(self, refresh=False):
+        """返回缓存的access_token，过期或refresh为True时重新获取"""
+        with self._tokens_lock:
+            cached = self._tokens.get(self.api_key)
+            if cached and not refresh and cached[1] > time.time():
+                return cached[0]
+            response = self.http.post(BAIDU_TOKEN_URL, params={
+                "grant_type": "client_credentials",
+                "client_id": self.api_key,
+                "client_secret": self.secret_key,
+            })
+            data = response.json()
+            token = data.get("access_token")
+            if not token:
+                raise ProviderError(f"获取百度access_token失败: {data.get('error_description') or data}",
+                                    response.status_code, response)
+            expires_at = time.time() + max(int(data.get("expires_in", 0)) - TOKEN_REFRESH_MARGIN, 60)
+            self._tokens[self.api_key] = (token, expires_at)
+            return token
+
+    def chat(self, messages, temperature=None):
+        """发送对话请求，返回ChatResult；参数同OpenAICompatibleProvider.chat"""
+        # 文心一言的系统提示单独传入
+        body = {"messages": [m for m in messages if m["role"] != "system"]}
+        system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        if system:
+            body["system"] = system
+        if temperature is not None:
+            # 文心一言要求temperature在(0, 1]之间
+            body["temperature"] = min(max(temperature, 0.01), 1.0)
+
+        for attempt in range(2):
+            response = self.http.post(self.url, params={"access_token": self._access_token(refresh=attempt > 0)},
+                                      json=body)
+            if response.status_code != 200:
+                raise ProviderError(f"文心一言接口返回HTTP {response.status_code}", response.status_code, response)
+            data = response.json()
+            error_code = data.get("error_code")
+            if error_code in BAIDU_TOKEN_ERRORS and attempt == 0:
+                # 令牌失效，刷新后重试一次
+                continue
+            if error_code in BAIDU_RATE_LIMIT_ERRORS:
+                raise ProviderError(f"文心一言接口限流: {data.get('error_msg')}", 429, response)
+            if error_code:
+                raise ProviderError(f"文心一言接口错误({error_code}): {data.get('error_msg')}", None, response)
+            return ChatResult(data.get("result", ""), (data.get("usage") or {}).get("total_tokens"))
+        raise ProviderError("文心一言access_token无效")
+
+
+# 各模型对应的服务接入方式：(服务类型, 接口地址或接口名称, 接口中的模型名称)
+PROVIDER_SPECS = {
+    "qwen": ("openai", config.DASHSCOPE_BASE_URL, "qwen-plus"),
+    "qwen-turbo": ("openai", config.DASHSCOPE_BASE_URL, "qwen-turbo"),
+    "qwen-plus": ("openai", config.DASHSCOPE_BASE_URL, "qwen-plus"),
+    "ernie_bot": ("ernie", "completions", None),
+    "ernie_bot_turbo": ("ernie", "eb-instant", None),
+    "spark": ("openai", "https://spark-api-open.xf-yun.com/v1", "generalv3.5"),
+    "chatglm": ("openai", "https://open.bigmodel.cn/api/paas/v4", "glm-4"),
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(model, api_key, secret_key=None):
+    """
+    获取模型对应的服务接入对象，相同模型和密钥在进程内共享同一个(及其连接池)
+
+    参数:
+        model: config.AVAILABLE_MODELS中的模型名称
+        api_key: API密钥
+        secret_key: 辅助密钥(百度Secret Key；讯飞星火可传APISecret)
+
+    返回:
+        带有chat(messages, temperature)方法的对象
+    """
+    if model not in PROVIDER_SPECS:
+        raise ValueError(f"不支持的模型: {model}")
+    if not api_key:
+        raise ValueError(f"使用模型 {model} 需要提供API密钥")
+    key = (model, api_key, secret_key)
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            kind, address, model_id = PROVIDER_SPECS[model]
+            if kind == "ernie":
+                provider = ErnieProvider(api_key, secret_key, address)
+            else:
+                # 讯飞星火的HTTP接口使用 APIKey:APISecret 作为密钥
+                if model == "spark" and secret_key:
+                    api_key = f"{api_key}:{secret_key}"
+                provider = OpenAICompatibleProvider(api_key, address, model_id)
+            _providers[key] = provider
+        return provider
+
+
+class CompletionsAdapter:
+    """
+    把服务接入对象包装成OpenAI客户端的 client.chat.completions.create() 接口，
+    文件夹重命名任务切换到其他服务商的模型时使用
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, model, messages, temperature=None, **kwargs):
+        """发送对话请求；response_format等OpenAI专有参数不传给其他服务商"""
+        return self.provider.chat(messages, temperature)
+
+
+# 各模型密钥在config.py中的变量名(同名环境变量也可以)：(API密钥, 辅助密钥)
+PROVIDER_KEY_SETTINGS = {
+    "qwen": ("ALIYUN_API_KEY", None),
+    "ernie": ("BAIDU_API_KEY", "BAIDU_SECRET_KEY"),
+    "spark": ("XUNFEI_API_KEY", "XUNFEI_API_SECRET"),
+    "chatglm": ("CHATGLM_API_KEY", None),
+}
+
+
+def configured_keys(model):
+    """
+    读取config.py或环境变量中为模型配置的密钥
+
+    返回:
+        (api_key, secret_key)，未配置时为None
+    """
+    family = "ernie" if model.startswith("ernie") else "qwen" if model.startswith("qwen") else model
+    names = PROVIDER_KEY_SETTINGS.get(family, (None, None))
+    values = [(getattr(config, name, "") or os.environ.get(name)) if name else None for name in names]
+    return values[0] or None, values[1] or None
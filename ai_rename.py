@@ -1,39 +1,254 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-文件夹批量重命名工具 - 通义千问版
+AI改名器
+AIRenamer：使用多种AI模型改写视频标题；batch_rename_files：文件夹批量重命名工具 - 通义千问版
 """
 
 import os
-import time
+import re
 from openai import OpenAI
+from config import (
+    BATCH_CONCURRENCY, MAX_BATCH_FILES,
+    DEFAULT_MODEL, DEFAULT_STYLE, DEFAULT_TEMPERATURE,
+    STYLE_PRESETS, AVAILABLE_MODELS, DASHSCOPE_BASE_URL, SKIP_RENAMED_FILES
+)
+from ai_providers import get_provider
+from http_client import get_http_client, connection_stats
+from stage_metrics import stage_metrics
+from rename_engine import BatchEngine
+from rate_limiter import get_rate_limiter, call_with_rate_limit, estimate_tokens
+from scanner import DirectoryScanner
+from batch_packer import BatchPacker
+from response_parser import parse_response, ResponseStats, JSON_RESPONSE_FORMAT, MAX_ITEM_ATTEMPTS
+from name_index import NameIndex
+from checkpoint import JobCheckpoint
+from rename_journal import RenameJournal
+from rename_ledger import RenameLedger
 
-def batch_rename_files(folder_path, api_key, batch_size=3):
+# 重命名请求的系统提示
+SYSTEM_PROMPT = "你是一个专业的文件重命名助手，擅长生成简洁有吸引力的文件名。"
+
+# 标题改写的系统提示
+TITLE_SYSTEM_PROMPT = "你是一位专业的视频标题优化专家，擅长根据原标题创作新颖、吸引人的标题变体。"
+
+# 模型输出中每行标题前的编号、列表符号，以及"标题："等前缀
+_TITLE_PREFIX = re.compile(r'^\s*(?:\d+\s*[.、:：)）]|[-*•])?\s*(?:(?:新)?标题\s*\d*\s*[:：])?\s*')
+
+# 标题两端常见的引号和书名号
+_TITLE_QUOTES = '"\'“”‘’「」《》【】'
+
+
+def parse_titles(content):
+    """从模型输出中逐行提取标题，去掉编号、前缀和两端引号"""
+    titles = []
+    for line in (content or "").split('\n'):
+        title = _TITLE_PREFIX.sub('', line).strip().strip(_TITLE_QUOTES).strip()
+        if title:
+            titles.append(title)
+    return titles
+
+
+class AIRenamer:
+    """
+    AI视频标题改名器
+    
+    根据原标题生成意思相近但表达不同的新标题。支持config.AVAILABLE_MODELS中的全部模型，
+    同一模型和密钥的连接池与鉴权令牌在进程内共享，请求速率由限流器控制。
+    """
+    
+    def __init__(self, api_key=None, secret_key=None, model=DEFAULT_MODEL):
+        """
+        初始化改名器
+        
+        参数:
+            api_key: 模型服务商的API密钥
+            secret_key: 辅助密钥(百度文心一言的Secret Key等)
+            model: 模型名称，见config.AVAILABLE_MODELS
+        """
+        if model not in AVAILABLE_MODELS:
+            raise ValueError(f"不支持的模型: {model}，可选: {', '.join(AVAILABLE_MODELS)}")
+        self.model = model
+        self.provider = get_provider(model, api_key, secret_key)
+        self.limiter = get_rate_limiter(model)
+    
+    def build_prompt(self, title, target_length=None, style=DEFAULT_STYLE, num_variants=1):
+        """构建标题改写的提示词"""
+        requirements = ["保持原标题的核心信息和意思"]
+        if style and style != DEFAULT_STYLE:
+            requirements.append(f"风格：{STYLE_PRESETS.get(style, style)}")
+        if target_length:
+            requirements.append(f"字数控制在{target_length}个字左右")
+        requirement_text = "\n".join(f"- {item}" for item in requirements)
+        
+        if num_variants > 1:
+            output_text = f"请生成{num_variants}个不同的新标题，每行一个，只返回标题本身，不要包含其他说明文字。"
+        else:
+            output_text = "请只返回一个新标题，不要包含其他说明文字。"
+        return f"""请改写以下视频标题，生成一个更吸引人的新标题。
+要求：
+{requirement_text}
+
+原标题：{title}
+
+{output_text}"""
+    
+    def rename(self, title, target_length=None, style=DEFAULT_STYLE, temperature=DEFAULT_TEMPERATURE, num_variants=1):
+        """
+        改写单个标题
+        
+        参数:
+            title: 原始标题
+            target_length: 目标字数，为None时不限制
+            style: 风格，STYLE_PRESETS中的名称或自定义描述
+            temperature: 生成的随机性(0.0-1.0)
+            num_variants: 生成的变体数量
+            
+        返回:
+            num_variants为1时返回新标题字符串，否则返回新标题列表
+        """
+        num_variants = max(1, int(num_variants or 1))
+        prompt = self.build_prompt(title, target_length, style, num_variants)
+        messages = [
+            {"role": "system", "content": TITLE_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        # 预计的Token数：输入加上每个变体约两倍原标题长度的输出
+        result = call_with_rate_limit(
+            self.limiter,
+            lambda: self.provider.chat(messages, temperature),
+            tokens=estimate_tokens(TITLE_SYSTEM_PROMPT + prompt) + estimate_tokens(title) * 2 * num_variants,
+        )
+        titles = parse_titles(result.content)
+        if not titles:
+            raise ValueError(f"未能从AI返回内容中解析出新标题: {result.content!r}")
+        if num_variants == 1:
+            return titles[0]
+        return titles[:num_variants]
+    
+    def batch_rename(self, titles, target_length=None, style=DEFAULT_STYLE, temperature=DEFAULT_TEMPERATURE,
+                     num_variants=1, concurrency=BATCH_CONCURRENCY):
+        """
+        并发改写多个标题
+        
+        参数:
+            titles: 原始标题列表
+            concurrency: 同时请求的数量
+            其余参数同rename()
+            
+        返回:
+            与titles一一对应的结果列表，失败的标题对应None
+        """
+        results = [None] * len(titles)
+        
+        def on_result(item, result):
+            results[item[0]] = result
+        
+        def on_error(item, e):
+            print(f"生成标题失败: {item[1]} - {e}")
+        
+        engine = BatchEngine(
+            lambda item: self.rename(item[1], target_length, style, temperature, num_variants),
+            concurrency=concurrency,
+        )
+        engine.run(enumerate(titles), on_result, on_error)
+        return results
+
+def batch_rename_files(folder_path, api_key, batch_size=MAX_BATCH_FILES, concurrency=BATCH_CONCURRENCY,
+                       json_mode=True, resume=None):
     """批量重命名文件夹中的文件
     
     参数:
         folder_path: 文件夹路径
         api_key: 通义千问API密钥
-        batch_size: 每批处理的文件数量
+        batch_size: 每批最多处理的文件数量，实际按模型的Token预算打包
+        concurrency: 同时请求的批次数量
+        json_mode: 是否要求模型以JSON格式返回结果
+        resume: 存在上次中断的检查点时是否继续，为None时询问用户
     """
     # 初始化OpenAI客户端(通义千问兼容模式)
     client = OpenAI(
         api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+        base_url=DASHSCOPE_BASE_URL,
+        http_client=get_http_client(concurrency),
+        max_retries=0  # 429由限流器统一退避重试
     )
+    model = "qwen-turbo"  # 使用turbo版本处理速度更快
+    limiter = get_rate_limiter(model)
     
-    # 获取文件夹中的所有文件
-    files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-    print(f"找到{len(files)}个文件")
+    # 检查点：中断后再次运行可以从最后完成的批次继续
+    checkpoint = JobCheckpoint(folder_path)
+    if checkpoint.exists() and resume is None:
+        resume = input("该文件夹有未完成的任务，是否从中断处继续? (y/n): ").lower() == 'y'
+    state = checkpoint.load() if resume else None
+    checkpoint.start({"model": model, "json_mode": json_mode}, resume=state is not None)
+    skip_paths = set()
+    name_index = NameIndex()
+    journal = RenameJournal(folder_path)
     
-    # 批量处理文件
-    for i in range(0, len(files), batch_size):
-        batch_files = files[i:i+batch_size]
-        print(f"\n处理批次 {i//batch_size + 1}/{(len(files)-1)//batch_size + 1}，共{len(batch_files)}个文件:")
+    def confirm_and_rename(batch_files, new_filenames):
+        """确认并重命名文件，返回已处理文件的 (原路径, 新路径) 列表"""
+        renames = []
+        print("\n以下文件将被重命名:")
+        for idx, new_name in new_filenames:
+            old_name = batch_files[idx]
+            # 保留原扩展名
+            _, ext = os.path.splitext(old_name)
+            if not new_name.endswith(ext):
+                new_name = new_name + ext
+            renames.append((old_name, new_name))
+            print(f"{old_name} -> {new_name}")
         
-        # 构建提示
+        handled = []
+        confirm = input("\n确认重命名这些文件? (y/n): ").lower()
+        for old_name, new_name in renames:
+            old_path = os.path.join(folder_path, old_name)
+            new_path = None
+            if confirm == 'y':
+                try:
+                    # 同名冲突在内存索引中解决(追加 _1、_2... 后缀)，不会覆盖已有文件
+                    final_name = name_index.rename(old_path, new_name)
+                    if final_name:
+                        print(f"已重命名: {old_name} -> {final_name}")
+                        new_path = os.path.join(folder_path, final_name)
+                        journal.record(old_path, new_path)
+                except Exception as e:
+                    print(f"重命名失败: {old_name} - {e}")
+            handled.append((old_path, new_path))
+        journal.sync()
+        return handled
+    
+    if state:
+        print(f"从检查点继续：上次已完成 {state.completed_batches} 个批次、{state.done_count} 个文件")
+        skip_paths = state.done_paths
+        skip_paths.update(state.pending)
+        # 上次已收到但未确认的结果不再请求API
+        pending = [(os.path.basename(path), name) for path, name in state.pending.items() if os.path.exists(path)]
+        if pending:
+            handled = confirm_and_rename([old_name for old_name, _ in pending],
+                                         [(idx, name) for idx, (_, name) in enumerate(pending)])
+            skip_paths.update(new_path for _, new_path in handled if new_path)
+            checkpoint.record_batch(handled)
+    
+    # 在后台扫描文件夹中的文件，边扫描边请求API；之前已由本工具重命名的文件不再处理
+    metrics_before = stage_metrics.snapshot()
+    ledger = RenameLedger() if SKIP_RENAMED_FILES else None
+    scanner = DirectoryScanner(folder_path, include_subdirs=False, on_directory=name_index.add_directory,
+                               ledger=ledger).start()
+    
+    def build_prompt(batch_files):
+        """构建单个批次的提示词"""
         file_list_text = "\n".join([f"{idx+1}. {file}" for idx, file in enumerate(batch_files)])
-        prompt = f"""请帮我优化以下{len(batch_files)}个文件名，生成更加简洁、清晰的新文件名。
+        if json_mode:
+            return f"""请帮我优化以下{len(batch_files)}个文件名，生成更加简洁、清晰的新文件名。
+保留原文件名的扩展名(.jpg/.mp4等)，保持原意但让文件名更有吸引力。
+请只返回一个JSON对象，键为文件编号，值为新文件名，例如：
+{{"1": "新文件名1", "2": "新文件名2"}}
+
+原文件列表:
+{file_list_text}
+"""
+        return f"""请帮我优化以下{len(batch_files)}个文件名，生成更加简洁、清晰的新文件名。
 保留原文件名的扩展名(.jpg/.mp4等)，保持原意但让文件名更有吸引力。
 请按照以下格式返回结果，只需返回编号和新文件名：
 
@@ -45,70 +260,125 @@ def batch_rename_files(folder_path, api_key, batch_size=3):
 2. [新文件名2]
 3. [新文件名3]
 """
+    
+    # 按模型的Token预算打包批次，每批文件数不超过batch_size
+    packer = BatchPacker(
+        model,
+        max_files=batch_size,
+        overhead_tokens=estimate_tokens(SYSTEM_PROMPT + build_prompt([])),
+    )
+    
+    def iter_batches():
+        """把扫描结果打包为批次，每个批次记录批次号和文件名列表"""
+        batch_num = 0
+        for chunk in scanner.chunks():
+            if chunk is None:
+                yield None
+                continue
+            for info in chunk:
+                if info[0] in skip_paths:
+                    continue
+                for batch_files in packer.add(info[1]):
+                    batch_num += 1
+                    yield (batch_num, batch_files, 1)
+        print(f"找到{scanner.count}个文件")
+        batch_files = packer.flush()
+        if batch_files:
+            yield (batch_num + 1, batch_files, 1)
+    
+    def request_batch(batch):
+        """在工作线程中调用API，返回模型输出的文本"""
+        _, batch_files, _ = batch
+        with stage_metrics.timer("prompt", len(batch_files)):
+            prompt = build_prompt(batch_files)
+        # JSON模式下要求接口直接返回JSON对象
+        extra_args = {"response_format": JSON_RESPONSE_FORMAT} if json_mode else {}
         
-        try:
-            # 调用通义千问API
-            response = client.chat.completions.create(
-                model="qwen-turbo",  # 使用turbo版本处理速度更快
+        # 调用通义千问API，由限流器控制请求速率
+        response = call_with_rate_limit(
+            limiter,
+            lambda: client.chat.completions.create(
+                model=model,
                 messages=[
-                    {"role": "system", "content": "你是一个专业的文件重命名助手，擅长生成简洁有吸引力的文件名。"},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # 提取生成的文件名
-            content = response.choices[0].message.content
-            print("API返回内容:")
-            print(content)
-            
-            # 解析返回的文件名
-            new_filenames = []
-            lines = content.split('\n')
-            for line in lines:
-                if line.strip() and line[0].isdigit() and '. ' in line:
-                    parts = line.split('. ', 1)
-                    if len(parts) == 2 and parts[0].isdigit():
-                        idx = int(parts[0]) - 1
-                        if 0 <= idx < len(batch_files):
-                            new_name = parts[1].strip().strip('[]')
-                            if new_name:
-                                new_filenames.append((idx, new_name))
-            
-            # 确认并重命名文件
-            if new_filenames:
-                print("\n以下文件将被重命名:")
-                for idx, new_name in new_filenames:
-                    if idx < len(batch_files):
-                        old_name = batch_files[idx]
-                        # 保留原扩展名
-                        _, ext = os.path.splitext(old_name)
-                        if not new_name.endswith(ext):
-                            new_name = new_name + ext
-                        
-                        print(f"{old_name} -> {new_name}")
-                
-                confirm = input("\n确认重命名这些文件? (y/n): ").lower()
-                if confirm == 'y':
-                    for idx, new_name in new_filenames:
-                        if idx < len(batch_files):
-                            old_path = os.path.join(folder_path, batch_files[idx])
-                            new_path = os.path.join(folder_path, new_name)
-                            try:
-                                os.rename(old_path, new_path)
-                                print(f"已重命名: {batch_files[idx]} -> {new_name}")
-                            except Exception as e:
-                                print(f"重命名失败: {batch_files[idx]} - {e}")
+                ],
+                **extra_args
+            ),
+            tokens=estimate_tokens(prompt) * 2,
+            log=print,
+        )
+        return response.choices[0].message.content
+    
+    def on_batch_done(batch, content):
+        """按完成顺序确认并重命名文件"""
+        batch_num, batch_files, attempt = batch
+        print(f"\n处理批次 {batch_num}，共{len(batch_files)}个文件:")
+        print("API返回内容:")
+        print(content)
+        
+        # 解析返回的文件名
+        with stage_metrics.timer("parse", len(batch_files)):
+            new_filenames, missing = parse_response(content, len(batch_files), json_mode)
+        stats.record(len(batch_files), len(new_filenames))
+        
+        # 先记录收到的结果，确认前中断时下次可以直接使用
+        checkpoint.record_results([(os.path.join(folder_path, batch_files[idx]), name) for idx, name in new_filenames])
+        dropped = []
+        
+        # 缺失或无效的条目单独重新请求，不影响本批次其他文件
+        if missing:
+            if attempt < MAX_ITEM_ATTEMPTS:
+                print(f"{len(missing)} 个文件未返回有效的新文件名，将单独重新请求")
+                for idx in missing:
+                    engine.requeue((f"{batch_num}-{idx+1}", [batch_files[idx]], attempt + 1))
+                stats.items_requeued += len(missing)
             else:
-                print("无法从API响应中提取有效的文件名")
-                
-        except Exception as e:
-            print(f"处理批次时出错: {e}")
+                print(f"多次请求仍未得到有效的新文件名，跳过: {', '.join(batch_files[idx] for idx in missing)}")
+                stats.items_dropped += len(missing)
+                dropped = [(os.path.join(folder_path, batch_files[idx]), None) for idx in missing]
         
-        # 避免API限流，添加延迟
-        if i + batch_size < len(files):
-            delay = 2  # 2秒延迟，避免触发限流
-            print(f"\n等待{delay}秒，避免API限流...")
-            time.sleep(delay)
+        # 确认并重命名文件
+        handled = []
+        if new_filenames:
+            handled = confirm_and_rename(batch_files, new_filenames)
+        else:
+            print("无法从API响应中提取有效的文件名")
+        checkpoint.record_batch(handled + dropped, scanned=scanner.count)
+    
+    failed_batches = 0
+    
+    def on_batch_error(batch, e):
+        nonlocal failed_batches
+        failed_batches += 1
+        print(f"处理批次 {batch[0]} 时出错: {e}")
+    
+    # 多个批次并发请求，结果按完成顺序依次确认
+    stats = ResponseStats()
+    connections_before = connection_stats.snapshot()
+    engine = BatchEngine(request_batch, concurrency=concurrency)
+    try:
+        engine.run(iter_batches(), on_batch_done, on_batch_error)
+    finally:
+        # 有批次失败或中途退出时保留检查点
+        checkpoint.close()
+        journal.close()
+        if ledger:
+            ledger.close()
+        if journal.count:
+            print(f"重命名日志已保存到 {journal.path}，可使用 python cli.py undo 撤销")
+    if not failed_batches:
+        checkpoint.finish()
+    else:
+        print("部分批次失败，已保存检查点，再次运行时可以从中断处继续")
+    if stats.requests:
+        print(f"\n请求统计: {stats.summary()}")
+        print(f"连接统计: {connection_stats.summary(since=connections_before)}")
+        print("各阶段耗时(并发执行的阶段为各线程累计):")
+        for line in stage_metrics.summary_lines(since=metrics_before):
+            print(f"  {line}")
+    if ledger and ledger.skipped:
+        print(f"跳过 {ledger.skipped} 个之前已由本工具重命名的文件")
 
 if __name__ == "__main__":
     # 用户输入
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按Token预算打包批次
+估算每个文件名在提示词和模型输出中占用的Token数，把每个请求填充到模型的Token预算为止，
+代替固定的每批文件数
+"""
+
+from config import BATCH_TOKEN_BUDGETS, DEFAULT_BATCH_TOKEN_BUDGET, MAX_BATCH_FILES
+from rate_limiter import estimate_tokens
+
+# 每个文件在输出中的最少Token数：原名很短(如IMG_0001.jpg)时，生成的新名称通常仍有十几个汉字
+MIN_COMPLETION_TOKENS = 24
+
+# 每行编号、分隔符和换行等格式开销
+LINE_OVERHEAD_TOKENS = 4
+
+
+def estimate_item_tokens(name):
+    """
+    估算单个文件名的Token占用
+
+    参数:
+        name: 文件名
+
+    返回:
+        (提示词Token数, 输出Token数)
+    """
+    name_tokens = estimate_tokens(name)
+    return (name_tokens + LINE_OVERHEAD_TOKENS,
+            max(name_tokens, MIN_COMPLETION_TOKENS) + LINE_OVERHEAD_TOKENS)
+
+
+def estimate_batch_tokens(names, overhead_tokens=0):
+    """
+    估算一个批次的Token占用
+
+    参数:
+        names: 批次中的文件名
+        overhead_tokens: 每个请求固定的提示词开销
+
+    返回:
+        (提示词Token数, 输出Token数)
+    """
+    prompt_tokens = overhead_tokens
+    completion_tokens = 0
+    for name in names:
+        item_prompt, item_completion = estimate_item_tokens(name)
+        prompt_tokens += item_prompt
+        completion_tokens += item_completion
+    return prompt_tokens, completion_tokens
+
+
+class BatchPacker:
+    """
+    批次打包器
+
+    逐个加入文件，当前批次再加入下一个文件就会超出提示词或输出的Token预算(或达到文件数上限)时
+    交出当前批次。单个文件就超出预算时单独成批。
+    """
+
+    def __init__(self, model, max_files=MAX_BATCH_FILES, overhead_tokens=0, key=None):
+        """
+        初始化打包器
+
+        参数:
+            model: 模型名称，用于查找Token预算
+            max_files: 每批最多文件数
+            overhead_tokens: 每个请求固定的提示词开销(系统提示和说明文字)
+            key: 从批次元素中取出文件名的函数，默认元素本身就是文件名
+        """
+        budget = BATCH_TOKEN_BUDGETS.get(model, DEFAULT_BATCH_TOKEN_BUDGET)
+        self.prompt_budget = max(1, budget["prompt"] - overhead_tokens)
+        self.completion_budget = budget["completion"]
+        self.max_files = max(1, int(max_files))
+        self.key = key or (lambda item: item)
+        self._items = []
+        self._prompt_tokens = 0
+        self._completion_tokens = 0
+
+    def _take(self):
+        batch = self._items
+        self._items = []
+        self._prompt_tokens = 0
+        self._completion_tokens = 0
+        return batch
+
+    def add(self, item):
+        """
+        加入一个元素
+
+        参数:
+            item: 批次元素
+
+        返回:
+            因此而完成的批次列表(可能为空)
+        """
+        prompt_tokens, completion_tokens = estimate_item_tokens(self.key(item))
+        ready = []
+
+        # 超大文件名单独成批
+        if prompt_tokens > self.prompt_budget or completion_tokens > self.completion_budget:
+            if self._items:
+                ready.append(self._take())
+            ready.append([item])
+            return ready
+
+        if self._items and (len(self._items) >= self.max_files
+                            or self._prompt_tokens + prompt_tokens > self.prompt_budget
+                            or self._completion_tokens + completion_tokens > self.completion_budget):
+            ready.append(self._take())
+
+        self._items.append(item)
+        self._prompt_tokens += prompt_tokens
+        self._completion_tokens += completion_tokens
+        if len(self._items) >= self.max_files:
+            ready.append(self._take())
+        return ready
+
+    def flush(self):
+        """交出剩余未满的批次，没有剩余时返回None"""
+        return self._take() if self._items else None
+
+
+def pack_batches(items, model, max_files=MAX_BATCH_FILES, overhead_tokens=0, key=None):
+    """
+    把元素序列打包成批次
+
+    参数:
+        items: 批次元素的可迭代对象
+        model: 模型名称
+        max_files: 每批最多文件数
+        overhead_tokens: 每个请求固定的提示词开销
+        key: 从批次元素中取出文件名的函数
+
+    生成:
+        批次(元素列表)
+    """
+    packer = BatchPacker(model, max_files=max_files, overhead_tokens=overhead_tokens, key=key)
+    for item in items:
+        yield from packer.add(item)
+    batch = packer.flush()
+    if batch:
+        yield batch
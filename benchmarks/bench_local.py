@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地处理阶段的规模压测(不调用API)
+生成1万/10万/100万个文件的合成目录树(平铺或多层嵌套)，用预先生成的模型输出代替API，
+分别统计扫描、打包和构建提示词、解析返回内容、文件名冲突处理、重命名各阶段的耗时和峰值内存，
+发布前对比基准结果即可发现本地处理路径的性能退化。
+
+每个场景在单独的子进程中运行，峰值内存互不影响。
+
+示例:
+    python benchmarks/bench_local.py --sizes 10k,100k --layouts flat,nested
+    python benchmarks/bench_local.py --sizes 100k --json baseline.json
+    python benchmarks/bench_local.py --sizes 100k --baseline baseline.json --tolerance 0.3
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+# 各阶段名称，按执行顺序
+STAGES = ("scan", "prompt", "parse", "collision", "rename")
+
+# 嵌套目录树的层数和每层子目录数
+NESTED_DEPTH = 3
+NESTED_FANOUT = 10
+
+
+def parse_size(text):
+    """解析 10k、1m 这样的文件数"""
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存(MB)，平台不支持时返回0"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def canned_response(batch_names, json_mode, distinct):
+    """
+    生成模拟的模型输出：新文件名只有distinct种，同一目录中大量文件会得到相同的新文件名
+    """
+    new_names = []
+    for name in batch_names:
+        base, ext = os.path.splitext(name)
+        number = int(base.split("_")[1]) if "_" in base else len(new_names)
+        new_names.append(f"重命名_{number % distinct}{ext}")
+    if json_mode:
+        return json.dumps({str(i + 1): new_name for i, new_name in enumerate(new_names)}, ensure_ascii=False)
+    return "\n".join(f"{i + 1}. {new_name}" for i, new_name in enumerate(new_names))
+
+
+def run_scenario(files, layout, json_mode, batch_size, distinct, work_dir):
+    """
+    运行一个场景的全部阶段
+
+    返回:
+        结果字典，stages中为各阶段的耗时(秒)和阶段结束时的峰值内存(MB)
+    """
+    from bench_pipeline import make_tree
+    from scanner import DirectoryScanner
+    from batch_packer import BatchPacker
+    from folder_renamer import build_prompt, system_prompt
+    from rate_limiter import estimate_tokens
+    from response_parser import parse_response
+    from name_index import NameIndex, rename_noreplace
+
+    folder = os.path.join(work_dir, "tree")
+    depth = NESTED_DEPTH if layout == "nested" else 0
+    started = time.perf_counter()
+    make_tree(folder, files, depth, NESTED_FANOUT)
+    result = {"files": files, "layout": layout, "json_mode": json_mode,
+              "generate_seconds": round(time.perf_counter() - started, 3), "stages": {}}
+
+    def record(stage, started, items):
+        elapsed = time.perf_counter() - started
+        result["stages"][stage] = {
+            "seconds": round(elapsed, 3),
+            "per_sec": round(items / elapsed, 1) if elapsed else 0.0,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+    # 扫描：后台线程列目录，同时登记每个目录的现有名称
+    name_index = NameIndex()
+    started = time.perf_counter()
+    scanner = DirectoryScanner(folder, include_subdirs=True, on_directory=name_index.add_directory).start()
+    file_info = []
+    for chunk in scanner.chunks():
+        if chunk:
+            file_info.extend(chunk)
+    record("scan", started, len(file_info))
+
+    # 按Token预算打包并构建提示词
+    started = time.perf_counter()
+    packer = BatchPacker("qwen-plus", max_files=batch_size,
+                         overhead_tokens=estimate_tokens(system_prompt(json_mode) + build_prompt([], "")),
+                         key=lambda info: info[1])
+    batches = []
+    prompt_chars = 0
+    for info in file_info:
+        for batch in packer.add(info):
+            batches.append(batch)
+            prompt_chars += len(build_prompt([item[1] for item in batch], ""))
+    batch = packer.flush()
+    if batch:
+        batches.append(batch)
+        prompt_chars += len(build_prompt([item[1] for item in batch], ""))
+    record("prompt", started, len(file_info))
+    result["batches"] = len(batches)
+
+    # 解析：模型输出预先生成，只统计解析耗时
+    responses = [canned_response([item[1] for item in batch], json_mode, distinct) for batch in batches]
+    started = time.perf_counter()
+    parsed = []
+    for batch, content in zip(batches, responses):
+        new_filenames, _ = parse_response(content, len(batch), json_mode)
+        parsed.extend((batch[idx], new_name) for idx, new_name in new_filenames)
+    record("parse", started, len(parsed))
+    del responses
+
+    # 冲突处理：在名称索引中为每个文件预留不冲突的新名称
+    started = time.perf_counter()
+    targets = []
+    for (old_path, old_name, _), new_name in parsed:
+        dir_path = os.path.dirname(old_path)
+        final_name = name_index.resolve(dir_path, new_name, old_name)
+        if final_name:
+            targets.append((dir_path, old_name, final_name))
+    record("collision", started, len(parsed))
+
+    # 重命名
+    started = time.perf_counter()
+    for dir_path, old_name, final_name in targets:
+        rename_noreplace(os.path.join(dir_path, old_name), os.path.join(dir_path, final_name))
+        name_index.commit(dir_path, old_name, final_name)
+    record("rename", started, len(targets))
+    result["renamed"] = len(targets)
+    return result
+
+
+def run_in_subprocess(files, layout, args):
+    """在子进程中运行场景，返回结果字典"""
+    work_dir = tempfile.mkdtemp(prefix="bench_local_", dir=args.work_dir)
+    command = [sys.executable, os.path.abspath(__file__), "--run-one", str(files), layout,
+               "--batch-size", str(args.batch_size), "--distinct", str(args.distinct), "--work-dir", work_dir]
+    if args.line_mode:
+        command.append("--line-mode")
+    try:
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, cwd=work_dir).stdout
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def print_results(results):
+    """打印每个场景各阶段的耗时、吞吐量和峰值内存"""
+    print(f"{'场景':<18}{'阶段':<12}{'耗时(秒)':>10}{'每秒文件数':>14}{'峰值内存(MB)':>14}")
+    for result in results:
+        name = f"{result['files']}/{result['layout']}"
+        for stage in STAGES:
+            values = result["stages"][stage]
+            print(f"{name:<18}{stage:<12}{values['seconds']:>10.3f}{values['per_sec']:>14.0f}{values['peak_rss_mb']:>14.1f}")
+            name = ""
+        print(f"{'':<18}{'(批次数 ' + str(result['batches']) + '，重命名 ' + str(result['renamed']) + ')':<12}")
+
+
+def compare_baseline(results, baseline_path, tolerance):
+    """
+    与基准结果对比
+
+    返回:
+        退化的 (场景, 阶段, 基准耗时, 本次耗时) 列表
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(item["files"], item["layout"]): item for item in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        base = baseline.get((result["files"], result["layout"]))
+        if not base:
+            continue
+        for stage in STAGES:
+            before = base["stages"][stage]["seconds"]
+            after = result["stages"][stage]["seconds"]
+            # 耗时太短的阶段波动大，不参与比较
+            if before >= 0.05 and after > before * (1 + tolerance):
+                regressions.append((f"{result['files']}/{result['layout']}", stage, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地处理阶段(扫描、提示词、解析、冲突处理、重命名)的规模压测')
+    parser.add_argument('--sizes', default='10k', help='文件数，逗号分隔，如 10k,100k,1m')
+    parser.add_argument('--layouts', default='flat,nested', help='目录结构: flat(平铺)、nested(多层嵌套)')
+    parser.add_argument('-b', '--batch-size', type=int, default=50, help='每批最多文件数')
+    parser.add_argument('--distinct', type=int, default=20, help='模拟输出中不同新文件名的数量，越小冲突越多')
+    parser.add_argument('--line-mode', action='store_true', help='使用按行返回的输出格式，而不是JSON')
+    parser.add_argument('--work-dir', help='生成目录树的位置，默认使用系统临时目录')
+    parser.add_argument('--json', help='把结果写入JSON文件，可作为之后比较的基准')
+    parser.add_argument('--baseline', help='基准结果JSON文件，有阶段明显变慢时返回非零退出码')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='与基准比较时允许变慢的比例')
+    parser.add_argument('--run-one', nargs=2, metavar=('FILES', 'LAYOUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_scenario(int(args.run_one[0]), args.run_one[1], not args.line_mode,
+                              args.batch_size, args.distinct, args.work_dir)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    layouts = [layout.strip() for layout in args.layouts.split(",") if layout.strip()]
+    if any(layout not in ("flat", "nested") for layout in layouts):
+        parser.error("目录结构只能是 flat 或 nested")
+    results = []
+    for files in (parse_size(size) for size in args.sizes.split(",") if size.strip()):
+        for layout in layouts:
+            print(f"正在压测 {files} 个文件({layout}) ...", flush=True)
+            results.append(run_in_subprocess(files, layout, args))
+
+    print()
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"options": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+    if args.baseline:
+        regressions = compare_baseline(results, args.baseline, args.tolerance)
+        for name, stage, before, after in regressions:
+            print(f"性能退化: {name} {stage} 阶段 {before:.3f}秒 -> {after:.3f}秒")
+        if regressions:
+            sys.exit(1)
+        print(f"与基准 {args.baseline} 相比没有超过 {args.tolerance:.0%} 的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+重命名流程压测
+在合成的目录树上，分别用文件夹重命名任务(图形界面process_files所用的FolderRenameJob)、
+ai_rename.batch_rename_files和命令行rename-folder对接本地模拟服务，
+统计每秒处理文件数、批次延迟的p50/p95/p99以及浪费的请求数。不需要网络和API密钥。
+
+示例:
+    python benchmarks/bench_pipeline.py --files 2000 --concurrency 8
+    python benchmarks/bench_pipeline.py --files 5000 --depth 3 --rate-429 0.02 --rate-5xx 0.01 --malformed 0.05 --json result.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_dashscope import add_mock_arguments, mock_from_args
+
+# 可选的压测对象
+TARGETS = ("job", "batch_rename_files", "cli")
+
+# 合成文件使用的扩展名
+EXTENSIONS = (".mp4", ".jpg", ".png", ".mov", ".txt")
+
+
+def make_tree(root, files, depth=0, fanout=8):
+    """
+    生成合成目录树
+
+    参数:
+        root: 根目录
+        files: 文件总数
+        depth: 子目录层数，0为全部放在根目录
+        fanout: 每层的子目录数
+
+    返回:
+        生成的文件数
+    """
+    for i in range(files):
+        parts = [f"目录{(i // fanout ** level) % fanout}" for level in range(depth)]
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        name = f"素材_{i:07d}_原始文件名{EXTENSIONS[i % len(EXTENSIONS)]}"
+        open(os.path.join(directory, name), "w").close()
+    return files
+
+
+def count_renamed(root):
+    """统计已重命名(模拟服务返回的新文件名以"新_"开头)的文件数"""
+    return sum(1 for _, _, names in os.walk(root) for name in names if name.startswith("新_"))
+
+
+def percentile(values, fraction):
+    """返回已排序列表的分位数"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
+
+
+class LatencyRecorder:
+    """通过httpx事件钩子记录客户端看到的每个请求的延迟"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}
+        self.latencies = []
+
+    def install(self, client):
+        client.event_hooks["request"].append(self.on_request)
+        client.event_hooks["response"].append(self.on_response)
+
+    def on_request(self, request):
+        with self._lock:
+            self._started[id(request)] = time.perf_counter()
+
+    def on_response(self, response):
+        with self._lock:
+            started = self._started.pop(id(response.request), None)
+            if started is not None:
+                self.latencies.append(time.perf_counter() - started)
+
+    def take(self):
+        """取出并清空已记录的延迟"""
+        with self._lock:
+            latencies, self.latencies = sorted(self.latencies), []
+            return latencies
+
+
+def reset_shared_state():
+    """清空进程内共享的限流器和熔断器，各压测对象互不影响"""
+    import rate_limiter
+    import model_failover
+    rate_limiter._limiters.clear()
+    model_failover._breakers.clear()
+
+
+def run_job(folder, args):
+    """图形界面process_files使用的FolderRenameJob"""
+    from folder_renamer import FolderRenameJob, create_key_pool
+    job = FolderRenameJob(
+        create_key_pool(["mock-key"], args.model, args.concurrency),
+        folder,
+        model=args.model,
+        include_subdirs=True,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        use_cache=False,
+        json_mode=not args.line_mode,
+        log=lambda message, level=None: None,
+    )
+    job.run()
+
+
+def run_batch_rename_files(folder, args):
+    """ai_rename.batch_rename_files，只处理根目录，每批确认时自动回答y"""
+    from ai_rename import batch_rename_files
+    answers = io.StringIO("y\n" * (args.files + 1000))
+    with contextlib.redirect_stdout(io.StringIO()), _replace_stdin(answers):
+        batch_rename_files(folder, "mock-key", batch_size=args.batch_size, concurrency=args.concurrency,
+                           json_mode=not args.line_mode, resume=False)
+
+
+def run_cli(folder, args):
+    """命令行 python cli.py rename-folder"""
+    import cli
+    argv = ["cli.py", "rename-folder", folder, "-r", "-q", "--no-cache", "--restart",
+            "--api-key", "mock-key", "-m", args.model, "-c", str(args.concurrency), "-b", str(args.batch_size),
+            "--fallback", ""]
+    if args.line_mode:
+        argv.append("--line-mode")
+    saved_argv = sys.argv
+    sys.argv = argv
+    try:
+        cli.main()
+    except SystemExit:
+        pass
+    finally:
+        sys.argv = saved_argv
+
+
+@contextlib.contextmanager
+def _replace_stdin(stream):
+    saved = sys.stdin
+    sys.stdin = stream
+    try:
+        yield
+    finally:
+        sys.stdin = saved
+
+
+RUNNERS = {"job": run_job, "batch_rename_files": run_batch_rename_files, "cli": run_cli}
+
+
+def run_target(target, work_dir, mock, recorder, args):
+    """在新生成的目录树上运行一个压测对象，返回结果字典"""
+    folder = os.path.join(work_dir, f"tree_{target}")
+    # batch_rename_files只处理根目录
+    depth = 0 if target == "batch_rename_files" else args.depth
+    total = make_tree(folder, args.files, depth)
+    reset_shared_state()
+    recorder.take()
+    before = mock.stats.as_dict()
+
+    started = time.perf_counter()
+    RUNNERS[target](folder, args)
+    elapsed = time.perf_counter() - started
+
+    after = mock.stats.as_dict()
+    server = {key: after[key] - before[key] for key in after}
+    wasted = server["throttled"] + server["server_errors"] + server["malformed"]
+    latencies = recorder.take()
+    renamed = count_renamed(folder)
+    shutil.rmtree(folder, ignore_errors=True)
+    return {
+        "target": target,
+        "files": total,
+        "renamed": renamed,
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(renamed / elapsed, 1) if elapsed else 0.0,
+        "requests": server["requests"],
+        "wasted_requests": wasted,
+        "wasted_rate": round(wasted / server["requests"], 4) if server["requests"] else 0.0,
+        "throttled": server["throttled"],
+        "server_errors": server["server_errors"],
+        "malformed": server["malformed"],
+        "latency_p50": round(percentile(latencies, 0.50), 3),
+        "latency_p95": round(percentile(latencies, 0.95), 3),
+        "latency_p99": round(percentile(latencies, 0.99), 3),
+    }
+
+
+def print_results(results):
+    """打印结果表格"""
+    header = f"{'对象':<20}{'文件':>8}{'已重命名':>10}{'耗时(秒)':>10}{'文件/秒':>10}{'请求':>8}{'浪费':>8}{'p50':>8}{'p95':>8}{'p99':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(f"{result['target']:<20}{result['files']:>8}{result['renamed']:>10}{result['seconds']:>10.2f}"
+              f"{result['files_per_sec']:>10.1f}{result['requests']:>8}{result['wasted_requests']:>8}"
+              f"{result['latency_p50']:>8.3f}{result['latency_p95']:>8.3f}{result['latency_p99']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重命名流程压测(使用本地模拟服务)')
+    parser.add_argument('--files', type=int, default=1000, help='每个压测对象处理的文件数')
+    parser.add_argument('--depth', type=int, default=0, help='合成目录树的子目录层数')
+    parser.add_argument('--targets', default=",".join(TARGETS), help=f'压测对象，逗号分隔: {", ".join(TARGETS)}')
+    parser.add_argument('-m', '--model', default='qwen-plus', help='请求中使用的模型名称')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='同时请求的批次数')
+    parser.add_argument('-b', '--batch-size', type=int, default=50, help='每批最多文件数')
+    parser.add_argument('--line-mode', action='store_true', help='要求模型按行返回结果，而不是JSON')
+    parser.add_argument('--rpm', type=int, default=100000, help='压测时使用的每分钟请求数上限')
+    parser.add_argument('--tpm', type=int, default=100000000, help='压测时使用的每分钟Token数上限')
+    parser.add_argument('--json', help='把结果写入JSON文件')
+    parser.add_argument('--check', action='store_true', help='有文件未被重命名时返回非零退出码(用于CI)')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    unknown = [target for target in targets if target not in RUNNERS]
+    if unknown:
+        parser.error(f"未知的压测对象: {', '.join(unknown)}")
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    original_dir = os.getcwd()
+    mock = mock_from_args(args).start()
+    # 导入项目模块前设置接口地址，所有请求都发往模拟服务
+    os.environ["DASHSCOPE_BASE_URL"] = mock.base_url
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    # 检查点、重命名日志等写入临时目录，不影响项目目录
+    os.chdir(work_dir)
+
+    import config
+    config.RATE_LIMITS[args.model] = {"rpm": args.rpm, "tpm": args.tpm}
+    config.FALLBACK_MODELS.pop(args.model, None)
+    from http_client import get_http_client
+    recorder = LatencyRecorder()
+    recorder.install(get_http_client(args.concurrency))
+
+    print(f"模拟服务: {mock.base_url}，延迟 {args.latency}，429 {args.rate_429:.0%}，"
+          f"5xx {args.rate_5xx:.0%}，格式错误 {args.malformed:.0%}")
+    results = []
+    try:
+        for target in targets:
+            print(f"正在压测 {target} ...", flush=True)
+            results.append(run_target(target, work_dir, mock, recorder, args))
+    finally:
+        mock.stop()
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"options": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+    if args.check and any(result["renamed"] < result["files"] for result in results):
+        print("存在未被重命名的文件")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地模拟的通义千问(OpenAI兼容)接口
+不消耗API额度即可测试重命名流程的吞吐量：按配置的延迟分布返回结果，
+并可按比例注入429限流、5xx错误和格式错误的输出
+
+单独运行:
+    python benchmarks/mock_dashscope.py --port 8000 --latency lognormal:0.8,0.5 --rate-429 0.05
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8000/v1 python cli.py rename-folder 测试文件夹 --api-key test
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 提示词中的文件列表行：编号. 文件名
+_FILE_LINE = re.compile(r'^(\d+)\. (.+)$', re.M)
+
+
+def parse_latency(spec):
+    """
+    解析延迟分布
+
+    参数:
+        spec: "fixed:秒"、"uniform:最小,最大" 或 "lognormal:中位数,sigma"
+
+    返回:
+        无参函数，每次调用返回一个延迟(秒)
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda: random.lognormvariate(0, sigma) * median
+    raise ValueError(f"无法解析的延迟分布: {spec}")
+
+
+class MockStats:
+    """模拟服务收到的请求统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0  # 返回429的请求数
+        self.server_errors = 0  # 返回5xx的请求数
+        self.malformed = 0  # 返回格式错误内容的请求数
+        self.latencies = []  # 每个请求在服务端的处理耗时(秒)
+
+    def add(self, field, latency):
+        with self._lock:
+            self.requests += 1
+            if field:
+                setattr(self, field, getattr(self, field) + 1)
+            self.latencies.append(latency)
+
+    def as_dict(self):
+        with self._lock:
+            return {"requests": self.requests, "throttled": self.throttled,
+                    "server_errors": self.server_errors, "malformed": self.malformed}
+
+
+class MockDashScope:
+    """
+    模拟服务
+
+    在后台线程中监听本地端口，base_url属性可直接作为DASHSCOPE_BASE_URL使用。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency="fixed:0", rate_429=0.0, rate_5xx=0.0,
+                 malformed=0.0, retry_after=0.5, seed=None):
+        """
+        参数:
+            host, port: 监听地址，port为0时自动选择空闲端口
+            latency: 成功响应的延迟分布，见parse_latency
+            rate_429: 返回429的比例
+            rate_5xx: 返回503的比例
+            malformed: 返回格式错误内容(截断的JSON、缺少条目或无关文字)的比例
+            retry_after: 429响应的Retry-After秒数
+            seed: 随机数种子，固定后每次运行注入的错误相同
+        """
+        self.latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.malformed = malformed
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats = MockStats()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        """在当前线程中运行服务，直到被中断"""
+        self._server.serve_forever()
+
+    def completion(self, body):
+        """
+        根据请求生成响应
+
+        返回:
+            (HTTP状态码, 响应头, 响应体字典, 统计字段)
+        """
+        roll = self.random.random()
+        if roll < self.rate_429:
+            return 429, {"Retry-After": str(self.retry_after)}, {
+                "error": {"message": "Requests rate limit exceeded", "type": "limit_requests", "code": "limit_requests"}
+            }, "throttled"
+        if roll < self.rate_429 + self.rate_5xx:
+            return 503, {}, {"error": {"message": "Service unavailable", "type": "server_error"}}, "server_errors"
+
+        prompt = body["messages"][-1]["content"]
+        names = [(number, name) for number, name in _FILE_LINE.findall(prompt) if not name.startswith("[")]
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        field = None
+        if self.random.random() < self.malformed:
+            field = "malformed"
+            content = self._malformed_content(names, json_mode)
+        elif json_mode:
+            content = json.dumps({number: f"新_{name}" for number, name in names}, ensure_ascii=False)
+        else:
+            content = "\n".join(f"{number}. 新_{name}" for number, name in names)
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 2
+        completion_tokens = len(content) // 2
+        return 200, {}, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, field
+
+    def _malformed_content(self, names, json_mode):
+        """生成三种常见的错误输出之一"""
+        kind = self.random.randrange(3)
+        if kind == 0:
+            return "好的，以下是为您优化后的文件名，希望对您有帮助！"
+        kept = names[::2]  # 缺少一半条目
+        if json_mode:
+            text = json.dumps({number: f"新_{name}" for number, name in kept}, ensure_ascii=False)
+            return text[:len(text) // 2] if kind == 1 else text
+        return "\n".join(f"{number}. 新_{name}" for number, name in kept)
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                started = time.perf_counter()
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._send(400, {}, {"error": {"message": "invalid json"}})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {}, {"error": {"message": "not found"}})
+                    return
+                status, headers, payload, field = mock.completion(body)
+                if status == 200:
+                    time.sleep(mock.latency())
+                self._send(status, headers, payload)
+                mock.stats.add(field, time.perf_counter() - started)
+
+            def _send(self, status, headers, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def add_mock_arguments(parser):
+    """添加模拟服务的命令行参数，压测脚本共用"""
+    parser.add_argument('--latency', default='lognormal:0.5,0.4',
+                        help='成功响应的延迟分布: fixed:秒 / uniform:最小,最大 / lognormal:中位数,sigma')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='返回429的比例')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='返回503的比例')
+    parser.add_argument('--malformed', type=float, default=0.0, help='返回格式错误内容的比例')
+    parser.add_argument('--retry-after', type=float, default=0.5, help='429响应的Retry-After秒数')
+    parser.add_argument('--seed', type=int, help='随机数种子')
+
+
+def mock_from_args(args, port=0):
+    """按命令行参数创建模拟服务"""
+    return MockDashScope(port=port, latency=args.latency, rate_429=args.rate_429, rate_5xx=args.rate_5xx,
+                         malformed=args.malformed, retry_after=args.retry_after, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的通义千问(OpenAI兼容)接口')
+    parser.add_argument('--port', type=int, default=8000, help='监听端口')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    mock = mock_from_args(args, args.port)
+    print(f"模拟服务已启动: {mock.base_url}")
+    print(f"使用方法: DASHSCOPE_BASE_URL={mock.base_url} python cli.py rename-folder 文件夹 --api-key test")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n已停止，请求统计: {mock.stats.as_dict()}")
+
+
+if __name__ == "__main__":
+    main()
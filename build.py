@@ -24,7 +24,7 @@ def check_pyinstaller():
 
 def check_dependencies():
     """检查并安装所需依赖"""
-    dependencies = ["openai", "httpx", "requests"]
+    dependencies = ["openai", "httpx", "h2", "certifi", "requests"]
     for dep in dependencies:
         try:
             __import__(dep)
@@ -149,6 +149,7 @@ def build_app(one_file=True, debug=False, icon=None):
     cmd.extend([
         "--hidden-import", "datetime",
         "--hidden-import", "httpx",
+        "--hidden-import", "h2",
         "--hidden-import", "openai",
     ])
     
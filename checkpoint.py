@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+重命名任务检查点
+任务运行时把扫描进度、已收到的AI结果、每次重命名和已完成的批次逐条追加到检查点文件中，
+程序意外退出后再次处理同一文件夹时可以从最后完成的批次继续，不会重复调用API
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from config import CHECKPOINT_DIR
+
+
+class ResumeState:
+    """从检查点文件恢复出的任务状态"""
+
+    def __init__(self):
+        self.options = {}  # 上次任务的选项
+        self.done_paths = set()  # 已处理完成的原路径和重命名后的新路径，重新扫描时跳过
+        self.pending = {}  # 已收到AI结果但尚未完成重命名的 {原路径: 新文件名}
+        self.done_count = 0  # 已处理完成的文件数
+        self.completed_batches = 0  # 已完成的批次数
+        self.scanned = 0  # 上次记录的扫描文件数
+
+
+class JobCheckpoint:
+    """
+    单个文件夹的任务检查点
+
+    检查点是追加写入的JSONL文件，每条记录写入后立即flush，每个批次完成时fsync，
+    因此任何时刻中断，最多只会丢失正在写入的那一条记录。
+    """
+
+    def __init__(self, folder_path, directory=CHECKPOINT_DIR):
+        """
+        参数:
+            folder_path: 任务处理的文件夹
+            directory: 检查点文件所在目录
+        """
+        self.folder_path = os.path.abspath(folder_path)
+        job_id = hashlib.sha1(self.folder_path.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory, f"{job_id}.jsonl")
+        self._file = None
+
+    def exists(self):
+        """是否存在未完成任务的检查点"""
+        return os.path.exists(self.path)
+
+    def load(self):
+        """
+        读取检查点
+
+        返回:
+            ResumeState；检查点不存在时返回None
+        """
+        if not self.exists():
+            return None
+        state = ResumeState()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 中断时写了一半的最后一行
+                    continue
+                kind = record.get("t")
+                if kind == "job":
+                    state.options = record.get("options", {})
+                elif kind == "results":
+                    for old_path, name in record.get("items", []):
+                        if old_path not in state.done_paths:
+                            state.pending[old_path] = name
+                elif kind == "renamed":
+                    # 批次完成前中断时，已重命名的文件靠这些记录跳过，不会再次请求API和重命名
+                    old_path, new_path = record.get("old"), record.get("new")
+                    state.pending.pop(old_path, None)
+                    if old_path not in state.done_paths:
+                        state.done_count += 1
+                    state.done_paths.update((old_path, new_path))
+                elif kind == "batch":
+                    state.completed_batches += 1
+                    state.scanned = max(state.scanned, record.get("scanned", 0))
+                    for old_path, new_path in record.get("items", []):
+                        state.pending.pop(old_path, None)
+                        if old_path not in state.done_paths:
+                            state.done_count += 1
+                        state.done_paths.add(old_path)
+                        if new_path:
+                            state.done_paths.add(new_path)
+        return state
+
+    def start(self, options, resume=False):
+        """
+        开始记录
+
+        参数:
+            options: 任务选项(模型、关键字等)，仅用于记录
+            resume: 为True时在原检查点后继续追加，否则覆盖旧检查点
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        self._write({"t": "job", "folder": self.folder_path, "options": options, "time": time.time()}, sync=True)
+
+    def _write(self, record, sync=False):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def record_results(self, items):
+        """
+        记录收到的AI结果(尚未重命名)
+
+        参数:
+            items: (原路径, 新文件名) 列表
+        """
+        if items:
+            self._write({"t": "results", "items": list(items)})
+
+    def record_renamed(self, old_path, new_path):
+        """记录一次成功的重命名(批次完成前中断时，下次据此跳过新文件)"""
+        self._write({"t": "renamed", "old": old_path, "new": new_path})
+
+    def record_batch(self, items, scanned=None):
+        """
+        记录一个批次处理完成
+
+        参数:
+            items: (原路径, 新路径) 列表，未重命名的文件新路径为None
+            scanned: 当前已扫描的文件数
+        """
+        record = {"t": "batch", "items": list(items)}
+        if scanned is not None:
+            record["scanned"] = scanned
+        self._write(record, sync=True)
+
+    def close(self):
+        """关闭检查点文件并保留，供下次继续"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """任务完成，删除检查点"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -7,15 +7,29 @@ AI视频标题改名器命令行界面
 
 import os
 import sys
+import json
+import signal
 import argparse
+import threading
 from ai_rename import AIRenamer
+from response_cache import ResponseCache
+from rename_journal import RenameJournal, list_journals, latest_journal, read_journal, undo_journal
+from rename_plan import apply_plan, plan_folder
+from folder_renamer import FolderRenameJob, create_key_pool
+from folder_watcher import watch_and_rename
+from stage_metrics import MetricsExporter
+from cost_tracker import format_cost
+from key_pool import parse_api_keys
+from log_sink import DEBUG, INFO, WARNING
 from config import (
     BAIDU_API_KEY, BAIDU_SECRET_KEY, 
     ALIYUN_API_KEY, ALIYUN_SECRET_KEY,
     XUNFEI_APP_ID, XUNFEI_API_KEY, XUNFEI_API_SECRET,
     CHATGLM_API_KEY, 
     STYLE_PRESETS, DEFAULT_TEMPERATURE, DEFAULT_MODEL,
-    AVAILABLE_MODELS
+    AVAILABLE_MODELS, BATCH_CONCURRENCY, MAX_BATCH_FILES,
+    DEDUPE_NAMES, DEDUPE_BY_CONTENT, INCREMENTAL_SCAN, SKIP_RENAMED_FILES,
+    METRICS_PORT, METRICS_JSON_PATH, METRICS_JSON_INTERVAL, COST_BUDGET
 )
 
 def parse_args():
@@ -37,6 +51,7 @@ def parse_args():
     parser.add_argument('-s', '--style', default='default', help='生成标题的风格，如"幽默"、"正式"等')
     parser.add_argument('-t', '--temperature', type=float, default=DEFAULT_TEMPERATURE, help='生成的随机性(0.0-1.0)')
     parser.add_argument('-n', '--num', type=int, default=1, help='每个原始标题生成的变体数量')
+    parser.add_argument('--no-cache', action='store_true', help='不使用AI结果缓存，所有标题都重新请求API')
     
     # 模型相关参数
     parser.add_argument('-m', '--model', default=DEFAULT_MODEL, choices=list(AVAILABLE_MODELS.keys()), 
@@ -97,17 +112,24 @@ def process_single_title(renamer, title, args):
         num_variants=args.num
     )
     
-    # 打印结果
+    print_result(title, result, args)
+    
+    return result
+
+def print_result(title, result, args, cached=False):
+    """打印单个标题的生成结果"""
     print(f"原标题: {title}")
     if args.num == 1:
-        print(f"新标题: {result}")
+        print(f"新标题: {result}" + (" (缓存)" if cached else ""))
     else:
-        print("生成的变体:")
+        print("生成的变体:" + (" (缓存)" if cached else ""))
         for i, variant in enumerate(result, 1):
             print(f"  {i}. {variant}")
     print()
-    
-    return result
+
+def cache_style(args):
+    """返回影响生成结果的提示参数组合，作为缓存键的一部分"""
+    return f"{args.style}|{args.length or ''}|{args.num}"
 
 def process_file(renamer, file_path, args):
     """
@@ -122,6 +144,7 @@ def process_file(renamer, file_path, args):
         原始标题和生成标题的列表对
     """
     results = []
+    cache = None if args.no_cache else ResponseCache()
     
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -129,14 +152,48 @@ def process_file(renamer, file_path, args):
         
         print(f"从文件 {file_path} 中读取了 {len(titles)} 个标题")
         
+        # 先查询缓存，重复或之前处理过的标题不再请求API
+        hits = {}
+        if cache:
+            hits = {title: json.loads(result) for title, result in
+                    cache.get_many(args.model, cache_style(args), args.temperature, titles).items()}
+            if hits:
+                print(f"缓存命中 {len(hits)} 个标题，无需请求API")
+        
+        # 未命中的标题去重后并发请求
+        misses = list(dict.fromkeys(title for title in titles if title not in hits))
+        generated = {}
+        if misses:
+            print(f"正在为 {len(misses)} 个标题生成新标题...")
+            for title, new_title in zip(misses, renamer.batch_rename(
+                    misses, target_length=args.length, style=args.style,
+                    temperature=args.temperature, num_variants=args.num)):
+                if new_title is None:
+                    continue
+                generated[title] = new_title
+                if cache:
+                    cache.put(args.model, cache_style(args), args.temperature, title,
+                              json.dumps(new_title, ensure_ascii=False))
+        
         for i, title in enumerate(titles, 1):
             print(f"\n处理标题 {i}/{len(titles)}")
-            new_title = process_single_title(renamer, title, args)
+            if title in hits:
+                new_title = hits[title]
+                print_result(title, new_title, args, cached=True)
+            elif title in generated:
+                new_title = generated[title]
+                print_result(title, new_title, args)
+            else:
+                print(f"原标题: {title}\n生成失败，已跳过\n")
+                continue
             results.append((title, new_title))
             
     except Exception as e:
         print(f"处理文件时出错: {e}")
         sys.exit(1)
+    finally:
+        if cache:
+            cache.close()
         
     return results
 
@@ -198,7 +255,8 @@ def get_api_keys(args):
             sys.exit(1)
             
     elif model in ["qwen", "qwen-turbo", "qwen-plus"]:
-        api_key = args.aliyun_api_key or ALIYUN_API_KEY or os.environ.get("ALIYUN_API_KEY")
+        # 配置了多个密钥时标题改写只使用第一个
+        api_key = (parse_api_keys(args.aliyun_api_key or ALIYUN_API_KEY or os.environ.get("ALIYUN_API_KEY")) or [None])[0]
         secret_key = args.aliyun_secret_key or ALIYUN_SECRET_KEY or os.environ.get("ALIYUN_SECRET_KEY")
         
         if not api_key:
@@ -222,8 +280,224 @@ def get_api_keys(args):
     
     return api_key, secret_key
 
+def undo_command(argv):
+    """
+    撤销批量重命名: python cli.py undo [日志文件] [--folder 文件夹] [--list]
+    
+    参数:
+        argv: undo之后的命令行参数
+    """
+    parser = argparse.ArgumentParser(prog='cli.py undo', description='按重命名日志把文件恢复为原名称')
+    parser.add_argument('journal', nargs='?', help='重命名日志文件，默认使用最近一次的日志')
+    parser.add_argument('--folder', help='只撤销处理该文件夹的最近一次重命名')
+    parser.add_argument('--list', action='store_true', help='列出可撤销的重命名日志')
+    parser.add_argument('-y', '--yes', action='store_true', help='不询问，直接撤销')
+    args = parser.parse_args(argv)
+    
+    if args.list:
+        for path in list_journals(folder_path=args.folder):
+            folder, entries = read_journal(path)
+            print(f"{path}  {folder}  {len(entries)} 个文件")
+        return
+    
+    journal_path = args.journal or latest_journal(folder_path=args.folder)
+    if not journal_path or not os.path.isfile(journal_path):
+        print("错误: 没有找到可撤销的重命名日志")
+        sys.exit(1)
+    folder, entries = read_journal(journal_path)
+    print(f"日志: {journal_path}")
+    print(f"将把 {folder} 中的 {len(entries)} 个文件恢复为原名称")
+    if not args.yes and input("确认撤销? (y/n): ").lower() != 'y':
+        return
+    result = undo_journal(journal_path, log=print)
+    print(f"撤销完成: {result.summary()}")
+
+def apply_command(argv):
+    """
+    执行重命名计划: python cli.py apply 计划文件 [-y]
+    
+    参数:
+        argv: apply之后的命令行参数
+    """
+    parser = argparse.ArgumentParser(prog='cli.py apply', description='按重命名计划批量重命名文件，不调用API')
+    parser.add_argument('plan', help='重命名计划文件(.jsonl或.csv)')
+    parser.add_argument('-y', '--yes', action='store_true', help='不询问，直接执行')
+    args = parser.parse_args(argv)
+    
+    if not os.path.isfile(args.plan):
+        print(f"错误: 计划文件不存在: {args.plan}")
+        sys.exit(1)
+    if not args.yes and input(f"确认按计划 {args.plan} 重命名文件? (y/n): ").lower() != 'y':
+        return
+    
+    def progress(done, total):
+        print(f"\r进度: {done}/{total}", end='', flush=True)
+    
+    journal = RenameJournal(plan_folder(args.plan) or os.path.dirname(os.path.abspath(args.plan)))
+    try:
+        result = apply_plan(args.plan, journal=journal, log=print, progress=progress)
+    finally:
+        journal.close()
+    print(f"\n执行完成: {result.summary()}")
+    if journal.count:
+        print(f"重命名日志: {journal.path}，可使用 python cli.py undo 撤销")
+
+def rename_folder_command(argv):
+    """
+    批量重命名文件夹中的文件(无交互，适合定时任务):
+    python cli.py rename-folder 文件夹 [-r] [-k 关键字] [-m 模型] [--dry-run] ...
+    
+    参数:
+        argv: rename-folder之后的命令行参数
+    """
+    parser = argparse.ArgumentParser(prog='cli.py rename-folder', description='使用通义千问批量重命名文件夹中的文件，不需要任何交互')
+    parser.add_argument('folder', help='要处理的文件夹')
+    parser.add_argument('-r', '--recursive', action='store_true', help='递归处理所有子目录')
+    parser.add_argument('-k', '--keyword', default='', help='按关键字为文件命名，不指定时只优化原文件名')
+    parser.add_argument('-m', '--model', default='qwen-plus', help='通义千问模型，如 qwen-turbo、qwen-plus')
+    parser.add_argument('-c', '--concurrency', type=int, default=BATCH_CONCURRENCY, help='同时请求的批次数')
+    parser.add_argument('-b', '--batch-size', type=int, default=MAX_BATCH_FILES, help='每批最多文件数，实际按Token预算打包')
+    parser.add_argument('--dry-run', action='store_true', help='只生成重命名计划，不修改文件')
+    parser.add_argument('-o', '--output', help='重命名计划文件路径(.jsonl或.csv)，指定时只生成计划')
+    parser.add_argument('--no-cache', action='store_true', help='不使用AI结果缓存')
+    parser.add_argument('--line-mode', action='store_true', help='要求模型按行返回结果，而不是JSON')
+    parser.add_argument('--restart', action='store_true', help='忽略上次中断的检查点，重新开始')
+    parser.add_argument('-w', '--watch', action='store_true', help='处理完现有文件后继续监视文件夹，新文件写完后自动重命名，按Ctrl+C结束')
+    parser.add_argument('--incremental', action='store_true', help='增量扫描：跳过上次处理后没有变化的目录和文件，适合每晚定时处理')
+    parser.add_argument('--force', action='store_true', help='重新处理之前已由本工具重命名的文件')
+    parser.add_argument('--no-dedupe', action='store_true', help='不合并同名文件，每个文件单独请求API')
+    parser.add_argument('--dedupe-content', action='store_true', help='只合并文件名和内容都相同的文件(需要读取文件内容)')
+    parser.add_argument('--fallback', help='首选模型出错或熔断时依次改用的模型，用逗号分隔，如 qwen-turbo,ernie_bot_turbo；'
+                        '传入空字符串时不切换，默认使用config.py中的FALLBACK_MODELS')
+    parser.add_argument('--api-key', action='append', help='阿里云通义千问API密钥，可重复指定或用逗号分隔多个密钥以提高吞吐量；'
+                        '默认读取config.py或环境变量ALIYUN_API_KEY')
+    parser.add_argument('--budget', type=float, default=COST_BUDGET,
+                        help='本次运行的费用上限(元，按config.py中MODEL_PRICES的价格计算)，达到后停止发出新批次并保存检查点')
+    parser.add_argument('--estimate', action='store_true', help='只扫描并估算请求数、Token数和费用，不调用API')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='在本机此端口提供运行指标，Prometheus格式(/metrics)和JSON(/metrics.json)，适合长时间运行的任务')
+    parser.add_argument('--metrics-json', default=METRICS_JSON_PATH, help=f'每{METRICS_JSON_INTERVAL}秒把运行指标写入此JSON文件')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出发送的提示词和API返回的完整内容')
+    parser.add_argument('-q', '--quiet', action='store_true', help='只输出警告和错误')
+    args = parser.parse_args(argv)
+    
+    if not os.path.isdir(args.folder):
+        print(f"错误: 无效的文件夹路径: {args.folder}")
+        sys.exit(1)
+    if args.watch and (args.dry_run or args.output):
+        print("错误: 监视模式会直接重命名新文件，不能与 --dry-run 或 --output 同时使用")
+        sys.exit(1)
+    api_keys = parse_api_keys(args.api_key or ALIYUN_API_KEY or os.environ.get("ALIYUN_API_KEY"))
+    if not api_keys and not args.estimate:
+        print("错误: 需要提供阿里云通义千问API密钥")
+        print("请通过--api-key参数提供，或在config.py中设置，或设置环境变量ALIYUN_API_KEY")
+        sys.exit(1)
+    
+    level = DEBUG if args.verbose else WARNING if args.quiet else INFO
+    
+    def log(message, message_level=INFO):
+        if message_level >= level:
+            print(message, flush=True)
+    
+    # Ctrl+C或SIGTERM时停止发送新请求，保留检查点，下次运行时自动继续
+    stop_event = threading.Event()
+    
+    def on_signal(signum, frame):
+        if stop_event.is_set():
+            raise KeyboardInterrupt
+        print("\n收到停止信号，正在结束当前批次...", flush=True)
+        stop_event.set()
+    
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, on_signal)
+    
+    exporter = None
+    if args.metrics_port is not None or args.metrics_json:
+        try:
+            exporter = MetricsExporter(port=args.metrics_port, json_path=args.metrics_json).start()
+        except OSError as e:
+            print(f"错误: 无法在端口 {args.metrics_port} 提供运行指标: {e}")
+            sys.exit(1)
+        if exporter.port is not None:
+            log(f"运行指标: http://{exporter.host}:{exporter.port}/metrics")
+        if exporter.json_path:
+            log(f"运行指标每{exporter.interval}秒写入 {exporter.json_path}")
+    try:
+        _run_folder_job(args, api_keys, log, stop_event)
+    finally:
+        if exporter:
+            exporter.stop()
+
+def _run_folder_job(args, api_keys, log, stop_event):
+    """执行rename-folder的首次处理和监视模式"""
+    client = create_key_pool(api_keys, args.model, args.concurrency) if api_keys else None
+    # 首次处理和监视模式共用的任务参数
+    options = dict(
+        model=args.model,
+        keyword=args.keyword,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        use_cache=not args.no_cache,
+        json_mode=not args.line_mode,
+        fallback_models=None if args.fallback is None else [m.strip() for m in args.fallback.split(",") if m.strip()],
+        dedupe=DEDUPE_NAMES and not args.no_dedupe,
+        dedupe_content=args.dedupe_content or DEDUPE_BY_CONTENT,
+        skip_renamed=SKIP_RENAMED_FILES and not args.force,
+        budget=args.budget,
+    )
+    job = FolderRenameJob(
+        client,
+        args.folder,
+        include_subdirs=args.recursive,
+        plan_only=args.dry_run or bool(args.output),
+        plan_path=args.output,
+        resume=not args.restart,
+        log=log,
+        should_stop=stop_event.is_set,
+        incremental=args.incremental or INCREMENTAL_SCAN,
+        **options
+    )
+    # 设置了费用预算时先估算本次任务的费用
+    if args.estimate or args.budget is not None:
+        log("正在估算费用...")
+        estimate = job.estimate()
+        log(f"费用估算: {estimate.summary()}")
+        if args.estimate:
+            return
+        if estimate.cost > args.budget:
+            log(f"预计费用超过预算 {format_cost(args.budget)}，达到预算后将停止发出新批次并保存检查点", WARNING)
+    job.run()
+    if job.journal_path:
+        print("可使用 python cli.py undo 撤销本次重命名")
+    if job.plan_only:
+        print(f"可使用 python cli.py apply {job.plan_path} 执行重命名计划")
+    if args.watch and not stop_event.is_set() and not job.completed:
+        log("首次处理没有全部完成，不进入监视模式；再次运行可从检查点继续", WARNING)
+    elif args.watch and job.completed:
+        journal_path = watch_and_rename(client, args.folder, include_subdirs=args.recursive, log=log,
+                                        should_stop=stop_event.is_set, costs=job.costs, **options)
+        if journal_path:
+            print(f"监视期间的重命名日志: {journal_path}，可使用 python cli.py undo 撤销")
+        return
+    if job.budget_exhausted:
+        print("提高 --budget 后再次运行可从中断处继续")
+    if not job.completed:
+        sys.exit(1)
+
 def main():
     """主函数"""
+    # 子命令单独解析，避免与标题位置参数冲突
+    if len(sys.argv) > 1 and sys.argv[1] == 'undo':
+        undo_command(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'apply':
+        apply_command(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'rename-folder':
+        rename_folder_command(sys.argv[2:])
+        return
+    
     args = parse_args()
     
     # 显示预设风格列表后退出
@@ -5,6 +5,8 @@ AI视频标题改名器配置文件
 在此文件中配置API密钥和其他设置
 """
 
+import os
+
 # API密钥配置
 # 直接在此设置API密钥（不推荐在生产环境中这样做）
 
@@ -13,7 +15,7 @@ BAIDU_API_KEY = ""  # 替换为你的百度API密钥
 BAIDU_SECRET_KEY = ""  # 替换为你的百度Secret密钥
 
 # 阿里云通义千问API配置
-ALIYUN_API_KEY = ""  # 替换为你的阿里云API密钥
+ALIYUN_API_KEY = ""  # 替换为你的阿里云API密钥，文件夹批量重命名可填写多个密钥(用逗号分隔)，按各密钥剩余额度分配请求
 ALIYUN_SECRET_KEY = ""  # 替换为你的阿里云Secret密钥
 
 # 讯飞星火API配置
@@ -24,6 +26,9 @@ XUNFEI_API_SECRET = ""  # 替换为你的讯飞API Secret
 # 智谱AI ChatGLM API配置
 CHATGLM_API_KEY = ""  # 替换为你的智谱API密钥
 
+# 通义千问OpenAI兼容接口地址，可通过环境变量DASHSCOPE_BASE_URL改为代理或本地模拟服务(见benchmarks/mock_dashscope.py)
+DASHSCOPE_BASE_URL = os.environ.get("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+
 # 默认AI模型设置
 DEFAULT_MODEL = "qwen"  # 使用的模型名称："ernie_bot", "ernie_bot_turbo", "qwen", "qwen-turbo", "qwen-plus", "spark", "chatglm"
 
@@ -32,7 +37,97 @@ DEFAULT_TEMPERATURE = 0.7  # 生成的随机性(0.0-1.0)，越高结果越多样
 DEFAULT_STYLE = "default"  # 默认标题风格
 
 # 批处理设置
-BATCH_DELAY = 0.5  # 批量处理时的延迟秒数，避免API限流
+BATCH_CONCURRENCY = 4  # 文件批量重命名时同时请求的批次数
+MAX_BATCH_FILES = 50  # 每个请求最多包含的文件数
+DEDUPE_NAMES = True  # 不同目录中的同名文件(不含扩展名)只请求一次API，结果分发给所有同名文件
+DEDUPE_BY_CONTENT = False  # 合并同名文件时是否还要求文件内容相同(需要读取每个文件，较慢)
+
+# 每个请求的Token预算：按文件名估算的提示词(prompt)和输出(completion)Token数填满为止
+BATCH_TOKEN_BUDGETS = {
+    "qwen-turbo": {"prompt": 2000, "completion": 1200},
+    "qwen-plus": {"prompt": 4000, "completion": 2000},
+}
+DEFAULT_BATCH_TOKEN_BUDGET = {"prompt": 2000, "completion": 1200}  # 未单独配置的模型使用此预算
+
+# API限流设置：每个模型每分钟的请求数(rpm)和Token数(tpm)上限
+# 被限流(429)时会自动降速退避，请按账号实际配额调整
+RATE_LIMITS = {
+    "qwen": {"rpm": 60, "tpm": 100000},
+    "qwen-turbo": {"rpm": 300, "tpm": 300000},
+    "qwen-plus": {"rpm": 120, "tpm": 200000},
+}
+DEFAULT_RATE_LIMIT = {"rpm": 60, "tpm": 100000}  # 未单独配置的模型使用此限额
+
+# 各模型每千Token的价格(元)，用于统计费用和预算控制
+# 以下为示例价格，请按各平台控制台的实际价格修改
+MODEL_PRICES = {
+    "ernie_bot": {"prompt": 0.0008, "completion": 0.002},
+    "ernie_bot_turbo": {"prompt": 0.0003, "completion": 0.0006},
+    "qwen": {"prompt": 0.0024, "completion": 0.0096},
+    "qwen-turbo": {"prompt": 0.0003, "completion": 0.0006},
+    "qwen-plus": {"prompt": 0.0008, "completion": 0.002},
+    "spark": {"prompt": 0.002, "completion": 0.002},
+    "chatglm": {"prompt": 0.005, "completion": 0.005},
+}
+DEFAULT_MODEL_PRICE = {"prompt": 0.0024, "completion": 0.0096}  # 未单独配置的模型按此价格估算
+COST_BUDGET = None  # 每次运行的费用上限(元)，达到后不再发出新批次并保存检查点；为None时不限制
+
+# 模型故障切换：首选模型出错或明显变慢时，批次自动改用后面的模型(需要配置相应模型的API密钥)
+FALLBACK_MODELS = {
+    "qwen": ["qwen-turbo", "ernie_bot_turbo"],
+    "qwen-turbo": ["qwen-plus", "ernie_bot_turbo"],
+    "qwen-plus": ["qwen-turbo", "ernie_bot_turbo"],
+}
+CIRCUIT_WINDOW = 20  # 按最近多少次请求判断模型是否健康
+CIRCUIT_MIN_REQUESTS = 5  # 至少有多少次请求后才会熔断
+CIRCUIT_ERROR_RATE = 0.5  # 失败比例达到此值时熔断(只统计网络错误、超时、429和5xx)
+CIRCUIT_SLOW_SECONDS = 60  # 成功请求的平均耗时超过此秒数时熔断
+CIRCUIT_COOLDOWN = 30  # 熔断后多少秒内不再使用该模型，之后放行一个试探请求
+
+# HTTP连接设置：进程内的AI请求共用一个长连接池
+HTTP2_ENABLED = True  # 使用HTTP/2，需要安装h2(pip install httpx[http2])，未安装时自动使用HTTP/1.1
+HTTP_POOL_SIZE = None  # 连接池最大连接数，为None时与并发批次数一致
+HTTP_KEEPALIVE_EXPIRY = 120  # 空闲连接保持的秒数
+HTTP_TIMEOUTS = {"connect": 10, "read": 120, "write": 30, "pool": 60}  # 各阶段超时(秒)，pool为等待空闲连接的时间
+CA_BUNDLE = None  # TLS验证使用的CA证书文件，为None时使用certifi附带的证书(公司代理等自签证书环境可在此指定)
+
+# AI结果缓存设置：重新处理相同的文件名/标题时直接使用缓存结果，不再调用API
+RESPONSE_CACHE_PATH = "config/response_cache.db"  # 缓存数据库路径
+RESPONSE_CACHE_MAX_ENTRIES = 200000  # 最多缓存的记录数
+RESPONSE_CACHE_MAX_AGE_DAYS = 30  # 超过此天数未使用的缓存将被删除
+
+# 增量扫描索引：记录每个目录的修改时间和已处理文件的大小/修改时间，再次处理时跳过没有变化的目录
+INCREMENTAL_SCAN = False  # 是否默认使用增量扫描(命令行可用--incremental开启)
+SCAN_INDEX_PATH = "config/scan_index.db"  # 索引数据库路径
+
+# 监视模式：新文件写完后自动重命名(Linux使用inotify，其他系统定时轮询)
+WATCH_SETTLE_SECONDS = 1.0  # 文件多少秒没有变化(大小和修改时间不变)后认为已写完
+WATCH_BATCH_WINDOW = 2.0  # 第一个文件写完后再等待多少秒，同时到达的文件合并为一个请求
+WATCH_POLL_INTERVAL = 5.0  # 不支持inotify时的轮询间隔(秒)
+WATCH_IGNORE_SUFFIXES = (".part", ".crdownload", ".download", ".tmp", ".partial", "~")  # 传输中的临时文件不处理
+
+# 任务检查点目录：处理中断后可从最后完成的批次继续
+CHECKPOINT_DIR = "logs/checkpoints"
+
+# 重命名日志目录：每次运行记录 原路径 -> 新路径，可用于批量撤销
+JOURNAL_DIR = "logs/journals"
+JOURNAL_SYNC_EVERY = 256  # 每记录多少条强制写入磁盘一次
+
+# 已改名文件记录：记录本工具重命名产生的文件(设备号+inode、大小、修改时间)，再次处理时跳过，避免重复改名
+TRACK_RENAMED_FILES = True  # 重命名时是否记录产生的文件
+SKIP_RENAMED_FILES = True  # 扫描时是否跳过已改名的文件(命令行可用--force重新处理)
+RENAMED_LEDGER_PATH = "config/renamed_ledger.db"  # 记录数据库路径
+RENAMED_XATTR = False  # 是否同时在文件上写入扩展属性标记 user.ali_ai.renamed(仅Linux等支持xattr的系统)
+
+# 运行指标：统计扫描、构建提示词、限流等待、API请求、解析、冲突处理、重命名各阶段的耗时
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # 耗时分布的分桶上限(秒)
+METRICS_HOST = "127.0.0.1"  # 指标HTTP服务监听的地址
+METRICS_PORT = None  # 在此端口提供Prometheus格式的指标(/metrics)和JSON(/metrics.json)，为None时不开启
+METRICS_JSON_PATH = None  # 定时把指标写入此JSON文件，为None时不写入
+METRICS_JSON_INTERVAL = 10  # 写入JSON文件的间隔(秒)
+
+# 重命名计划目录：计划模式下只生成 原路径 -> 新文件名 的计划文件，之后再单独执行
+PLAN_DIR = "logs/plans"
 
 # 可用模型列表
 AVAILABLE_MODELS = {
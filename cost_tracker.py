@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Token费用统计与预算上限
+按config.py中的MODEL_PRICES(每千Token价格)把每次请求的Token用量换算为费用，按模型分别统计；
+设置预算后，每个批次发出前先按估算的Token数预留费用(按已完成请求的实际用量与估算之比校正)，
+已花费加已预留的费用将超过预算时不再发出新批次，由任务保存检查点，提高预算后可以从中断处继续
+"""
+
+import threading
+
+from config import MODEL_PRICES, DEFAULT_MODEL_PRICE
+from stage_metrics import stage_metrics
+
+
+def model_price(model):
+    """返回模型每千Token的价格 {"prompt": 输入价格, "completion": 输出价格}"""
+    return MODEL_PRICES.get(model, DEFAULT_MODEL_PRICE)
+
+
+def token_cost(model, prompt_tokens, completion_tokens):
+    """按价格表计算费用(元)"""
+    price = model_price(model)
+    return (prompt_tokens * price["prompt"] + completion_tokens * price["completion"]) / 1000
+
+
+def format_cost(cost):
+    """费用文本，金额很小时多保留几位小数"""
+    return f"{cost:.4f}元" if cost < 1 else f"{cost:.2f}元"
+
+
+class ModelUsage:
+    """单个模型的用量"""
+
+    __slots__ = ("requests", "prompt_tokens", "completion_tokens", "estimated", "cost")
+
+    def __init__(self):
+        self.requests = 0  # 完成的请求数
+        self.prompt_tokens = 0  # 输入Token数
+        self.completion_tokens = 0  # 输出Token数
+        self.estimated = 0  # 响应中没有用量、按估算计费的请求数
+        self.cost = 0.0  # 费用(元)
+
+
+class CostTracker:
+    """
+    按模型统计Token用量和费用，并执行费用预算，线程安全
+
+    用法：发出请求前调用reserve预留预计费用，请求完成后调用record按实际用量记账，
+    失败或放弃时调用release释放预留。
+    """
+
+    def __init__(self, budget=None):
+        """
+        参数:
+            budget: 费用上限(元)，为None时不限制
+        """
+        self.budget = budget
+        self._lock = threading.Lock()
+        self.models = {}  # 模型名称 -> ModelUsage
+        self.spent = 0.0  # 已花费(元)
+        self.reserved = 0.0  # 进行中的请求预留的费用(元)
+        self.exhausted = False  # 是否已因预算不足拒绝过请求
+        self._estimated_cost = 0.0  # 有实际用量的请求按估算应花费的金额
+        self._actual_cost = 0.0  # 这些请求实际花费的金额
+
+    @property
+    def calibration(self):
+        """实际费用与估算费用之比，还没有完成的请求时为1"""
+        return self._actual_cost / self._estimated_cost if self._estimated_cost else 1.0
+
+    def reserve(self, model, prompt_tokens, completion_tokens):
+        """
+        为即将发出的请求预留预计费用
+
+        返回:
+            预留的金额；加上后会超过预算时返回None，并把exhausted设为True
+        """
+        cost = token_cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            # 批次的Token数按偏多估算，按已完成请求的实际情况校正，避免过早停止
+            cost *= self.calibration
+            if self.budget is not None and self.spent + self.reserved + cost > self.budget:
+                self.exhausted = True
+                return None
+            self.reserved += cost
+        return cost
+
+    def release(self, amount):
+        """释放预留的费用"""
+        with self._lock:
+            self.reserved = max(self.reserved - amount, 0.0)
+
+    def record(self, model, usage, estimate=(0, 0), estimate_model=None):
+        """
+        记录一次完成的请求
+
+        参数:
+            model: 实际使用的模型(故障切换后可能不是首选模型)
+            usage: 响应中的Token用量(response.usage)，没有时为None
+            estimate: 发出请求时估算的(输入Token数, 输出Token数)，用于校正之后的预留，没有用量时按此计费
+            estimate_model: 估算时使用的模型，默认与model相同
+
+        返回:
+            本次请求的费用(元)
+        """
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) if usage is not None else None
+        completion_tokens = getattr(usage, 'completion_tokens', None) if usage is not None else None
+        estimated = prompt_tokens is None and completion_tokens is None
+        if estimated:
+            prompt_tokens, completion_tokens = estimate
+        prompt_tokens = prompt_tokens or 0
+        completion_tokens = completion_tokens or 0
+        cost = token_cost(model, prompt_tokens, completion_tokens)
+        estimated_cost = token_cost(estimate_model or model, *estimate)
+        with self._lock:
+            if not estimated and estimated_cost:
+                self._estimated_cost += estimated_cost
+                self._actual_cost += cost
+            item = self.models.get(model)
+            if item is None:
+                item = self.models[model] = ModelUsage()
+            item.requests += 1
+            item.prompt_tokens += prompt_tokens
+            item.completion_tokens += completion_tokens
+            item.estimated += estimated
+            item.cost += cost
+            self.spent += cost
+        stage_metrics.incr("cost_yuan", cost)
+        return cost
+
+    def summary_lines(self):
+        """返回每个模型的用量和费用摘要"""
+        lines = []
+        for model, item in sorted(self.models.items()):
+            text = (f"{model}: 请求 {item.requests} 次，Token 输入 {item.prompt_tokens} / 输出 {item.completion_tokens}，"
+                    f"约 {format_cost(item.cost)}")
+            if item.estimated:
+                text += f"(其中 {item.estimated} 次响应没有用量，按估算计费)"
+            lines.append(text)
+        return lines
+
+    def summary(self):
+        """返回总费用文本"""
+        text = f"共约 {format_cost(self.spent)}"
+        if self.budget is not None:
+            text += f"，预算 {format_cost(self.budget)}"
+        return text
+
+
+class CostEstimate:
+    """任务开始前按扫描和打包结果估算的请求数、Token数和费用"""
+
+    def __init__(self, model):
+        self.model = model
+        self.files = 0  # 需要处理的文件数
+        self.cached = 0  # 命中缓存、不需要请求的文件数
+        self.shared = 0  # 使用同名文件结果、不需要单独请求的文件数
+        self.batches = 0  # 预计的请求数
+        self.prompt_tokens = 0  # 预计的输入Token数
+        self.completion_tokens = 0  # 预计的输出Token数(按偏多估算)
+
+    def add_batch(self, prompt_tokens, completion_tokens):
+        """记录一个批次的预计Token数"""
+        self.batches += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    @property
+    def cost(self):
+        """预计费用(元)"""
+        return token_cost(self.model, self.prompt_tokens, self.completion_tokens)
+
+    def summary(self):
+        """返回估算摘要文本"""
+        text = f"共 {self.files} 个文件"
+        if self.cached or self.shared:
+            text += f"(命中缓存 {self.cached} 个，使用同名文件结果 {self.shared} 个)"
+        return (text + f"，预计请求 {self.batches} 次，Token 输入约 {self.prompt_tokens} / 输出约 {self.completion_tokens}，"
+                       f"按 {self.model} 的价格约 {format_cost(self.cost)}(Token数按偏多估算)")
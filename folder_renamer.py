@@ -0,0 +1,862 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文件夹批量重命名任务
+扫描、按Token预算打包、并发请求、解析、重命名(或写入计划)的完整流程，
+图形界面和命令行共用，不依赖Tk，也不会等待用户输入
+"""
+
+import os
+import re
+import traceback
+
+from openai import OpenAI
+
+from config import (
+    BATCH_CONCURRENCY, MAX_BATCH_FILES, FALLBACK_MODELS, DASHSCOPE_BASE_URL,
+    DEDUPE_NAMES, DEDUPE_BY_CONTENT, INCREMENTAL_SCAN, SKIP_RENAMED_FILES, COST_BUDGET
+)
+from rename_engine import BatchEngine
+from rate_limiter import estimate_tokens
+from response_cache import ResponseCache
+from scanner import DirectoryScanner, PathListScanner
+from scan_index import ScanIndex
+from batch_packer import BatchPacker, estimate_batch_tokens
+from response_parser import parse_response, ResponseStats, JSON_RESPONSE_FORMAT, MAX_ITEM_ATTEMPTS
+from name_index import NameIndex
+from name_dedupe import NameDeduper
+from checkpoint import JobCheckpoint
+from rename_journal import RenameJournal
+from rename_ledger import RenameLedger
+from rename_plan import PlanWriter, default_plan_path
+from log_sink import DEBUG, INFO, WARNING, ERROR
+from http_client import get_http_client, connection_stats
+from stage_metrics import stage_metrics
+from cost_tracker import CostTracker, CostEstimate, format_cost
+from key_pool import KeyPool
+from model_failover import Route, FailoverRouter
+from ai_providers import get_provider, configured_keys, CompletionsAdapter
+
+# 重命名请求的系统提示
+SYSTEM_PROMPT = "你是一个专业的文件重命名助手，擅长根据用户需求生成文件名。"
+
+# 命名规则，所有批次相同
+PROMPT_RULES = """用户会给出关键字和编号的原文件列表，文件名不含扩展名，不要在新文件名中添加扩展名。
+有关键字时，新文件名应关于此关键字，并保持简洁、吸引人，可以很大程度上忽略原文件名。
+关键字为"无"时，优化原文件名，生成更加简洁、清晰的新文件名，每个文件名需要花哨一些，不要过于简单。
+如果给出了"共同前缀"或"共同后缀"，每个原文件名是 共同前缀 + 列表中的内容 + 共同后缀。"""
+
+JSON_OUTPUT_FORMAT = """请只返回一个JSON对象，键为文件编号，值为新文件名，不要包含其他任何说明文字或注释，例如：
+{"1": "新文件名1", "2": "新文件名2"}"""
+
+LINE_OUTPUT_FORMAT = """请严格按照以下格式返回结果，每行一个编号和新文件名，不要包含其他任何说明文字或注释：
+1. 新文件名1
+2. 新文件名2"""
+
+# 共同前缀/后缀至少有这么多个字符时才单独列出
+AFFIX_MIN_LENGTH = 4
+
+# 看起来像扩展名的结尾(点后1到5个字母或数字，至少含一个字母)
+_EXTENSION_PATTERN = re.compile(r'\.(?=[0-9]*[A-Za-z])[A-Za-z0-9]{1,5}$')
+
+# 常见的媒体和文档扩展名：AI生成的文件名以这些结尾时才视为多加的扩展名并替换，
+# 其他结尾(如"Dr.Who"、"v1.2a")属于标题本身，保留不动
+_KNOWN_EXTENSIONS = frozenset((
+    # 图片
+    ".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff", ".heic", ".heif", ".svg", ".raw",
+    ".cr2", ".nef", ".arw", ".dng", ".psd",
+    # 视频
+    ".mp4", ".mkv", ".mov", ".avi", ".wmv", ".flv", ".webm", ".m4v", ".ts", ".rmvb", ".rm", ".3gp", ".mpg", ".mpeg",
+    # 音频
+    ".mp3", ".wav", ".flac", ".aac", ".m4a", ".ogg", ".wma", ".ape", ".opus",
+    # 文档
+    ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".txt", ".md", ".rtf", ".csv", ".epub", ".mobi",
+    ".azw3", ".odt", ".ods", ".odp", ".wps", ".html", ".htm", ".json", ".xml",
+    # 压缩包
+    ".zip", ".rar", ".7z", ".tar", ".gz",
+    # 字幕
+    ".srt", ".ass", ".ssa", ".vtt", ".sub",
+))
+
+
+def create_client(api_key, concurrency=BATCH_CONCURRENCY):
+    """创建通义千问(OpenAI兼容模式)客户端，使用进程内共享的连接池"""
+    return OpenAI(
+        api_key=api_key,
+        base_url=DASHSCOPE_BASE_URL,
+        http_client=get_http_client(concurrency),
+        max_retries=0  # 429由限流器统一退避重试
+    )
+
+
+def create_key_pool(api_keys, model, concurrency=BATCH_CONCURRENCY):
+    """
+    为多个API密钥创建客户端池，只有一个密钥时等同于使用单个客户端
+
+    参数:
+        api_keys: 密钥列表
+        model: 模型名称，每个密钥按该模型的配额单独限流
+        concurrency: 同时请求的批次数
+
+    返回:
+        KeyPool，可直接传给FolderRenameJob
+    """
+    if len(api_keys) == 1:
+        return KeyPool(model, [(None, create_client(api_keys[0], concurrency))])
+    return KeyPool(model, [(api_key, create_client(api_key, concurrency)) for api_key in api_keys])
+
+
+def create_fallback_client(model, pool):
+    """
+    为故障切换链中的模型创建客户端
+
+    参数:
+        model: 切换到的模型
+        pool: 首选模型的KeyPool，通义千问的其他模型沿用其中的密钥
+
+    返回:
+        KeyPool；其他服务商的模型未配置密钥时返回None
+    """
+    if model.startswith("qwen"):
+        return pool.for_model(model)
+    api_key, secret_key = configured_keys(model)
+    if not api_key:
+        return None
+    return KeyPool(model, [(None, CompletionsAdapter(get_provider(model, api_key, secret_key)))])
+
+
+def system_prompt(json_mode=True):
+    """
+    返回重命名请求的系统提示词
+
+    规则和输出格式全部放在系统提示词中，与关键字和文件列表无关，
+    同一任务的所有批次发送完全相同的前缀，服务商的前缀缓存可以命中
+    """
+    return SYSTEM_PROMPT + "\n" + PROMPT_RULES + "\n" + (JSON_OUTPUT_FORMAT if json_mode else LINE_OUTPUT_FORMAT)
+
+
+def common_affixes(stems, min_length=AFFIX_MIN_LENGTH):
+    """
+    找出一批文件名共同的前缀和后缀
+
+    参数:
+        stems: 不含扩展名的文件名列表
+        min_length: 前缀或后缀至少有这么多个字符才提取，太短的不值得单独列出
+
+    返回:
+        (前缀, 后缀)，没有时为空字符串；提取后每个文件名至少还剩一个字符
+    """
+    if len(stems) < 2:
+        return "", ""
+    shortest = min(len(stem) for stem in stems)
+    prefix = os.path.commonprefix(stems)[:shortest - 1]
+    if len(prefix) < min_length:
+        prefix = ""
+    reversed_suffix = os.path.commonprefix([stem[len(prefix):][::-1] for stem in stems])
+    suffix = reversed_suffix[:shortest - len(prefix) - 1][::-1]
+    if len(suffix) < min_length:
+        suffix = ""
+    return prefix, suffix
+
+
+def build_prompt(batch_files, keyword):
+    """
+    构建单个批次的用户消息
+
+    只发送不含扩展名的文件名(扩展名在本地重新加上)，
+    一批文件共同的前缀和后缀只列出一次，列表中是去掉前后缀后剩下的部分
+    """
+    stems = [os.path.splitext(name)[0] for name in batch_files]
+    prefix, suffix = common_affixes(stems)
+    lines = [f"关键字: {keyword}" if keyword else "关键字: 无"]
+    if prefix:
+        lines.append(f"共同前缀: {prefix}")
+    if suffix:
+        lines.append(f"共同后缀: {suffix}")
+    lines.append("原文件列表:")
+    end = -len(suffix) if suffix else None
+    lines.extend(f"{idx+1}. {stem[len(prefix):end]}" for idx, stem in enumerate(stems))
+    return "\n".join(lines)
+
+
+def build_messages(batch_files, keyword, json_mode=True):
+    """构建单个批次的完整请求消息"""
+    return [
+        {"role": "system", "content": system_prompt(json_mode)},
+        {"role": "user", "content": build_prompt(batch_files, keyword)}
+    ]
+
+
+def _print_log(message, level=INFO):
+    if level >= INFO:
+        print(message)
+
+
+class FolderRenameJob:
+    """
+    单个文件夹的批量重命名任务
+
+    创建后调用run()执行；所有输出通过log回调，停止由should_stop回调控制。
+    """
+
+    def __init__(self, client, folder_path, model="qwen-plus", keyword="", include_subdirs=True,
+                 batch_size=MAX_BATCH_FILES, concurrency=BATCH_CONCURRENCY, use_cache=True, json_mode=True,
+                 plan_only=False, plan_path=None, resume=False, log=None, should_stop=None, on_progress=None,
+                 fallback_models=None, dedupe=DEDUPE_NAMES, dedupe_content=DEDUPE_BY_CONTENT,
+                 incremental=INCREMENTAL_SCAN, skip_renamed=SKIP_RENAMED_FILES, paths=None, journal=None,
+                 on_renamed=None, budget=COST_BUDGET, costs=None, use_checkpoint=True):
+        """
+        初始化任务
+
+        参数:
+            client: OpenAI兼容客户端，或create_key_pool()创建的多密钥池
+            folder_path: 要处理的文件夹
+            model: 模型名称
+            keyword: 关键字，为空时只优化原文件名
+            include_subdirs: 是否递归处理子目录
+            batch_size: 每批最多文件数，实际按模型的Token预算打包
+            concurrency: 同时请求的批次数
+            use_cache: 是否使用AI结果缓存
+            json_mode: 是否要求模型以JSON格式返回结果
+            plan_only: 为True时只生成重命名计划，不修改文件
+            plan_path: 计划文件路径，为None时自动生成(继续上次任务时沿用上次的计划)
+            resume: 存在检查点时是否从中断处继续
+            log: 日志函数 log(message, level)
+            should_stop: 无参函数，返回True时停止任务
+            on_progress: 进度回调 on_progress(已完成批次数, 已知总批次数)
+            fallback_models: 首选模型出错或熔断时依次改用的模型，为None时使用config.FALLBACK_MODELS
+            dedupe: 是否合并同名文件(不含扩展名)，每组只请求一次API
+            dedupe_content: 合并时是否还要求文件内容相同
+            incremental: 是否使用增量扫描索引，跳过上次处理后没有变化的目录和文件(计划模式下不使用)
+            skip_renamed: 是否跳过本工具之前重命名产生的文件，为False时强制重新处理
+            paths: 只处理这些文件而不扫描文件夹(监视模式)，为None时扫描整个文件夹
+            journal: 共用的重命名日志(监视模式下整个监视期间共用一个)，为None时本次任务单独创建
+            on_renamed: 每重命名一个文件后的回调 on_renamed(原路径, 新路径)
+            budget: 本次运行的费用上限(元)，达到后不再发出新批次并保留检查点；为None时不限制
+            costs: 共用的CostTracker(监视模式下整个监视期间共用一个预算)，提供时忽略budget
+            use_checkpoint: 是否记录检查点；监视模式下为False，不覆盖同一文件夹上次任务留下的检查点
+        """
+        self.client = client
+        self.folder_path = folder_path
+        self.model = model
+        self.keyword = keyword
+        self.include_subdirs = include_subdirs
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.use_cache = use_cache
+        self.json_mode = json_mode
+        self.plan_only = plan_only
+        self.plan_path = plan_path
+        self.resume = resume
+        self.log = log or _print_log
+        self.should_stop = should_stop or (lambda: False)
+        self.on_progress = on_progress
+        self.fallback_models = FALLBACK_MODELS.get(model, []) if fallback_models is None else fallback_models
+        self.dedupe = dedupe
+        self.dedupe_content = dedupe_content
+        self.incremental = incremental
+        self.skip_renamed = skip_renamed
+        self.paths = paths
+        self.journal = journal
+        self.on_renamed = on_renamed
+        self.use_checkpoint = use_checkpoint
+
+        # 运行结果
+        self.stats = ResponseStats()
+        self.cache_hits = 0
+        self.shared_count = 0  # 使用同名文件结果、没有单独请求API的文件数
+        self.skipped_renamed = 0  # 扫描时跳过的已改名文件数
+        self.failed_batches = 0
+        self.renamed_count = 0  # 重命名的文件数
+        self.planned_count = 0  # 写入计划的文件数
+        self.journal_path = None
+        self.completed = False  # 是否全部完成(未停止、没有失败的批次且未达到费用预算)
+        self.costs = costs or CostTracker(budget)  # 各模型的Token用量和费用
+        self.budget_exhausted = False  # 是否因达到费用预算而提前结束
+
+    def final_filename(self, old_name, new_name):
+        """把AI生成的文件名整理为最终文件名(去除非法字符、保留原扩展名)，无效时返回None"""
+        # 保留原扩展名
+        name_part, ext = os.path.splitext(old_name)
+        # 确保新文件名不为空且不包含非法字符 (简单检查)
+        new_name = "".join(c for c in new_name if c not in '/\\:*?"<>|')
+        if not new_name:
+            self.log(f"警告：生成的新文件名无效或为空，跳过: {old_name}", WARNING)
+            return None
+
+        # 提示词中不含扩展名，正常情况下直接加上原扩展名
+        if ext and new_name.lower().endswith(ext.lower()):
+            return new_name[:-len(ext)] + ext
+        match = _EXTENSION_PATTERN.search(new_name)
+        if match and match.start() > 0 and match.group().lower() in _KNOWN_EXTENSIONS:
+            self.log(f"警告：AI生成的扩展名 '{match.group()}' 与原扩展名 '{ext}' 不符，将使用原扩展名。", WARNING)
+            return new_name[:match.start()] + ext
+        return new_name + ext
+
+    def plan_batch(self, batch_file_info, new_filenames, plan):
+        """
+        计划模式：把本批次的新文件名写入重命名计划，不修改文件
+
+        返回已处理文件的 [原路径, None] 列表
+        """
+        handled = []
+        planned_count = 0
+        for idx, new_name in new_filenames:
+            old_path, old_name, rel_dir = batch_file_info[idx]
+            handled.append([old_path, None])
+            final_new_name = self.final_filename(old_name, new_name)
+            if final_new_name and final_new_name != old_name:
+                plan.add(old_path, final_new_name)
+                path_info = f"[{rel_dir}]" if rel_dir else ""
+                self.log(f"计划重命名: {path_info}{old_name} -> {final_new_name}", DEBUG)
+                planned_count += 1
+        plan.flush()
+        self.planned_count += planned_count
+        self.log(f"本批次写入计划 {planned_count} 个文件。")
+        return handled
+
+    def rename_batch(self, batch_file_info, new_filenames, name_index, journal=None, checkpoint=None):
+        """
+        按解析出的新文件名重命名本批次的文件，name_index为各目录的现有名称索引，
+        journal不为None时把每次重命名记入重命名日志，checkpoint不为None时同时记入检查点
+
+        返回已处理文件的 [原路径, 新路径] 列表，未重命名的文件新路径为None
+        """
+        handled = []
+        if new_filenames and not self.should_stop():
+            self.log("\n开始执行重命名操作:")
+            renamed_count = 0 # 记录成功重命名的数量
+            for idx, new_name in new_filenames:
+                if self.should_stop():
+                    break
+
+                # 获取完整信息
+                old_path, old_name, rel_dir = batch_file_info[idx]
+                handled.append([old_path, None])
+
+                final_new_name = self.final_filename(old_name, new_name)
+                if not final_new_name:
+                    continue
+
+                # 避免重命名为同名文件
+                if final_new_name == old_name:
+                    self.log(f"跳过重命名，新旧文件名相同: {old_name}")
+                    continue
+
+                # 显示包含相对路径的日志
+                path_info = f"[{rel_dir}]" if rel_dir else ""
+
+                try:
+                    # 通过目录名称索引在内存中解决冲突(自动追加 _1、_2... 后缀)，并以不覆盖方式重命名
+                    desired_name = final_new_name
+                    final_new_name = name_index.rename(old_path, desired_name)
+                    if final_new_name is None:
+                        self.log(f"跳过重命名，新旧文件名相同: {old_name}")
+                        continue
+                    if final_new_name != desired_name:
+                        self.log(f"警告：目标文件 '{desired_name}' 已存在，改用 '{final_new_name}'", WARNING)
+                    self.log(f"已重命名: {path_info}{old_name} -> {final_new_name}")
+                    handled[-1][1] = os.path.join(os.path.dirname(old_path), final_new_name)
+                    if checkpoint:
+                        checkpoint.record_renamed(old_path, handled[-1][1])
+                    if journal:
+                        journal.record(old_path, handled[-1][1])
+                    if self.on_renamed:
+                        self.on_renamed(old_path, handled[-1][1])
+                    renamed_count += 1
+                except OSError as e: # 更具体的异常捕获
+                    stage_metrics.incr("rename_errors")
+                    self.log(f"重命名失败: {path_info}{old_name} -> {desired_name} - 错误: {e}", ERROR)
+                except Exception as e:
+                    stage_metrics.incr("rename_errors")
+                    self.log(f"重命名时发生未知错误: {path_info}{old_name} - {e}")
+                    self.log(traceback.format_exc(), ERROR) # 记录完整堆栈
+
+            if journal:
+                journal.sync()
+            self.renamed_count += renamed_count
+            stage_metrics.incr("files_renamed", renamed_count)
+            if renamed_count > 0:
+                 self.log(f"本批次成功重命名 {renamed_count} 个文件。")
+            else:
+                 self.log("本批次未能成功重命名任何文件。")
+
+        elif not new_filenames and not self.should_stop():
+            self.log("无法从API响应中提取有效的文件名或格式不符")
+        elif self.should_stop():
+            self.log("处理已停止，未执行重命名。")
+        return handled
+
+    def create_router(self, pool):
+        """按故障切换链创建FailoverRouter，第一个为首选模型"""
+        routes = [Route(self.model, pool)]
+        for model in self.fallback_models:
+            if model == self.model or any(route.model == model for route in routes):
+                continue
+            client = create_fallback_client(model, pool)
+            if client is None:
+                self.log(f"未配置模型 {model} 的API密钥，故障切换时跳过该模型", WARNING)
+                continue
+            routes.append(Route(model, client))
+        if len(routes) > 1:
+            self.log(f"故障切换顺序: {' -> '.join(route.model for route in routes)}")
+        return FailoverRouter(routes, lambda message: self.log(message, WARNING))
+
+    def estimate(self):
+        """
+        任务开始前估算请求数、Token数和费用：扫描文件夹，跳过检查点中已完成的文件、已改名的文件、
+        命中缓存的文件和同名文件，再按Token预算打包。不调用API，也不修改任何文件和索引
+        (增量扫描不参与估算，估算结果偏多)
+
+        返回:
+            CostEstimate
+        """
+        estimate = CostEstimate(self.model)
+        state = JobCheckpoint(self.folder_path).load() if self.resume and self.use_checkpoint else None
+        skip_paths = state.done_paths | set(state.pending) if state else set()
+        ledger = RenameLedger() if self.skip_renamed else None
+        cache = ResponseCache() if self.use_cache else None
+        deduper = NameDeduper(by_content=self.dedupe_content) if self.dedupe else None
+        overhead_tokens = estimate_tokens(system_prompt(self.json_mode) + build_prompt([], self.keyword))
+        packer = BatchPacker(self.model, max_files=self.batch_size, overhead_tokens=overhead_tokens,
+                             key=lambda info: info[1])
+
+        def add_batch(batch_file_info):
+            estimate.add_batch(*estimate_batch_tokens([info[1] for info in batch_file_info], overhead_tokens))
+
+        try:
+            scanner = DirectoryScanner(
+                self.folder_path,
+                include_subdirs=self.include_subdirs,
+                should_stop=self.should_stop,
+                on_error=lambda path, e: self.log(f"警告：无法读取目录 {path}: {e}", WARNING),
+                ledger=ledger,
+            ).start()
+            for chunk in scanner.chunks():
+                if not chunk:
+                    continue
+                if skip_paths:
+                    chunk = [info for info in chunk if info[0] not in skip_paths]
+                estimate.files += len(chunk)
+                if cache and chunk:
+                    hits = cache.get_many(self.model, self.keyword, None, [info[1] for info in chunk])
+                    if hits:
+                        count = len(chunk)
+                        chunk = [info for info in chunk if info[1] not in hits]
+                        estimate.cached += count - len(chunk)
+                if deduper and chunk:
+                    # 同名文件只有第一个需要请求
+                    count = len(chunk)
+                    chunk = [info for info in chunk if deduper.add(info)[0]]
+                    estimate.shared += count - len(chunk)
+                for info in chunk:
+                    for batch_file_info in packer.add(info):
+                        add_batch(batch_file_info)
+            batch_file_info = packer.flush()
+            if batch_file_info:
+                add_batch(batch_file_info)
+        finally:
+            if ledger:
+                ledger.close()
+            if cache:
+                cache.close()
+        return estimate
+
+    def run(self):
+        """执行任务，出错时抛出异常；中途停止或有批次失败时保留检查点"""
+        folder_path = self.folder_path
+        model = self.model
+        keyword = self.keyword
+        json_mode = self.json_mode
+        pool = self.client if isinstance(self.client, KeyPool) else KeyPool(model, [(None, self.client)])
+        router = self.create_router(pool)
+        checkpoint = None
+        journal = None
+        plan = None
+        cache = None
+        scan_index = None
+        ledger = None
+        # 本次运行开始前的指标，结束时只汇总本次的部分
+        metrics_before = stage_metrics.snapshot()
+        try:
+            # 检查点：记录收到的结果和完成的批次，中断后可以继续
+            checkpoint = JobCheckpoint(folder_path) if self.use_checkpoint else None
+            state = checkpoint.load() if checkpoint and self.resume else None
+            if state and state.options.get("plan_only", False) != self.plan_only:
+                self.log("上次任务与本次的计划模式设置不同，将重新开始", WARNING)
+                state = None
+            options = {"model": model, "keyword": keyword, "include_subdirs": self.include_subdirs,
+                       "json_mode": json_mode, "plan_only": self.plan_only}
+
+            # 计划模式：把新文件名写入计划文件，继续上次任务时追加到原计划
+            if self.plan_only:
+                plan_path = self.plan_path or (state.options.get("plan_path") if state else None)
+                plan = PlanWriter(plan_path or default_plan_path(), folder_path,
+                                  append=state is not None and plan_path == state.options.get("plan_path"))
+                self.plan_path = options["plan_path"] = plan.path
+                self.log(f"计划模式：不修改文件，重命名计划写入 {plan.path}")
+            if checkpoint:
+                checkpoint.start(options, resume=state is not None)
+            skip_paths = set()  # 上次已处理的文件，扫描时跳过
+            # 重命名日志：记录每次重命名，可以一键撤销
+            journal = self.journal or RenameJournal(folder_path)
+            self.journal_path = journal.path
+            name_index = NameIndex()
+            # 增量扫描：只处理上次之后新增或修改过的文件；计划模式不修改文件，不更新索引
+            if self.incremental and not self.plan_only and self.paths is None:
+                scan_index = ScanIndex()
+                self.log("增量扫描：跳过上次处理后没有变化的目录和文件")
+            # 本工具之前重命名产生的文件不再处理，避免重复改名
+            if self.skip_renamed:
+                ledger = RenameLedger()
+
+            def record_batch(handled, scanned=None):
+                """把处理完的文件记入检查点和增量扫描索引"""
+                if checkpoint:
+                    checkpoint.record_batch(handled, scanned=scanned)
+                if scan_index:
+                    for old_path, new_path in handled:
+                        scan_index.mark_done(old_path, new_path)
+
+            def apply_names(batch_file_info, new_filenames):
+                """按新文件名重命名，计划模式下写入计划文件"""
+                if plan:
+                    return self.plan_batch(batch_file_info, new_filenames, plan)
+                return self.rename_batch(batch_file_info, new_filenames, name_index, journal, checkpoint)
+
+            if state:
+                self.log(f"从检查点继续：上次已完成 {state.completed_batches} 个批次、{state.done_count} 个文件")
+                if state.options.get("keyword", keyword) != keyword or state.options.get("model", model) != model:
+                    self.log("注意：本次的模型或关键字与上次不同，只影响尚未处理的文件")
+                skip_paths = state.done_paths
+                skip_paths.update(state.pending)
+                # 上次已收到AI结果但未来得及重命名的文件，直接按保存的结果重命名，不再请求API
+                pending_info = []
+                for path in state.pending:
+                    if os.path.exists(path):
+                        rel_dir = os.path.relpath(os.path.dirname(path), folder_path)
+                        pending_info.append((path, os.path.basename(path), "" if rel_dir == "." else rel_dir))
+                if pending_info:
+                    self.log(f"按上次保存的结果重命名 {len(pending_info)} 个文件")
+                    handled = apply_names(pending_info, [(idx, state.pending[info[0]]) for idx, info in enumerate(pending_info)])
+                    skip_paths.update(new_path for _, new_path in handled if new_path)
+                    record_batch(handled)
+                state = None
+
+            costs = self.costs
+
+            def stop_scanning():
+                """停止或达到费用预算后不再扫描"""
+                return self.should_stop() or costs.exhausted
+
+            # 在后台线程中流式扫描文件（支持递归扫描子目录），边扫描边请求API
+            if self.paths is not None:
+                # 监视模式：只处理新到达的文件
+                scanner = PathListScanner(
+                    folder_path,
+                    self.paths,
+                    should_stop=stop_scanning,
+                    on_error=lambda path, e: self.log(f"警告：无法读取目录 {path}: {e}", WARNING),
+                    on_directory=name_index.add_directory,
+                    ledger=ledger,
+                ).start()
+            else:
+                if self.include_subdirs:
+                    self.log("正在递归扫描所有子目录中的文件...")
+                else:
+                    self.log("仅扫描当前目录中的文件...")
+                # 扫描时顺便记录每个目录的现有名称，重命名冲突在内存中解决
+                scanner = DirectoryScanner(
+                    folder_path,
+                    include_subdirs=self.include_subdirs,
+                    should_stop=stop_scanning,
+                    on_error=lambda path, e: self.log(f"警告：无法读取目录 {path}: {e}", WARNING),
+                    on_directory=name_index.add_directory,
+                    scan_index=scan_index,
+                    ledger=ledger,
+                ).start()
+
+            # 命中缓存的文件直接重命名，只有未命中的文件才请求API
+            cache = ResponseCache() if self.use_cache else None
+            # 同名文件只请求一次，结果分发给同组的其他文件
+            deduper = NameDeduper(
+                by_content=self.dedupe_content,
+                on_error=lambda path, e: self.log(f"警告：无法读取文件内容 {path}: {e}", WARNING),
+            ) if self.dedupe else None
+            total_batches = 0  # 已生成的批次数，扫描完成后即为总批次数
+            finished_batches = 0
+
+            def report_progress():
+                if self.on_progress:
+                    self.on_progress(finished_batches, total_batches)
+
+            # 按模型的Token预算打包批次，每批文件数不超过设置的上限
+            overhead_tokens = estimate_tokens(system_prompt(json_mode) + build_prompt([], keyword))
+            packer = BatchPacker(
+                model,
+                max_files=self.batch_size,
+                overhead_tokens=overhead_tokens,
+                key=lambda info: info[1],
+            )
+            reservations = {}  # 批次号 -> (预留的费用, 预计输入Token数, 预计输出Token数)
+
+            def reserve(batch_num, batch_file_info):
+                """发出批次前按预计Token数预留费用，超过预算时返回False"""
+                tokens = estimate_batch_tokens([info[1] for info in batch_file_info], overhead_tokens)
+                was_exhausted = costs.exhausted
+                amount = costs.reserve(model, *tokens)
+                if amount is None:
+                    if not was_exhausted:
+                        self.log(f"已达到费用预算 {format_cost(costs.budget)}(已花费约 {format_cost(costs.spent)})，"
+                                 f"不再发出新的批次，等待进行中的批次完成", WARNING)
+                    return False
+                reservations[batch_num] = (amount,) + tokens
+                return True
+
+            def batch_total():
+                """返回总批次数，扫描未完成时显示为已知批次数加问号"""
+                return f"{total_batches}" if scanner.finished else f"{total_batches}+?"
+
+            def iter_batches():
+                """把扫描分块打包为批次，每个批次记录批次号和文件信息"""
+                nonlocal total_batches
+                for chunk in scanner.chunks():
+                    if chunk is None:
+                        yield None
+                        continue
+                    if skip_paths:
+                        chunk = [info for info in chunk if info[0] not in skip_paths]
+                    if cache and chunk:
+                        hits = cache.get_many(model, keyword, None, [info[1] for info in chunk])
+                        if hits:
+                            self.cache_hits += len(hits)
+                            stage_metrics.incr("cache_hits", len(hits))
+                            self.log(f"缓存命中 {len(hits)} 个文件，无需请求API")
+                            hit_info_list = [info for info in chunk if info[1] in hits]
+                            handled = apply_names(hit_info_list, [(idx, hits[info[1]]) for idx, info in enumerate(hit_info_list)])
+                            record_batch(handled, scanned=scanner.count)
+                            chunk = [info for info in chunk if info[1] not in hits]
+                    if deduper and chunk:
+                        to_send = []
+                        shared_info_list = []
+                        shared_names = []
+                        for info in chunk:
+                            send, new_name = deduper.add(info)
+                            if send:
+                                to_send.append(info)
+                            elif new_name is not None:
+                                shared_info_list.append(info)
+                                shared_names.append(new_name)
+                        if shared_info_list:
+                            handled = apply_names(shared_info_list, list(enumerate(shared_names)))
+                            record_batch(handled, scanned=scanner.count)
+                        chunk = to_send
+                    for info in chunk:
+                        for batch_file_info in packer.add(info):
+                            # 达到费用预算：不再发出新批次，未处理的文件留给下次继续
+                            if not reserve(total_batches + 1, batch_file_info):
+                                return
+                            total_batches += 1
+                            report_progress()
+                            yield (total_batches, batch_file_info, 1)
+                if not self.should_stop():
+                    if ledger and ledger.skipped:
+                        self.skipped_renamed = ledger.skipped
+                        self.log(f"跳过 {ledger.skipped} 个之前已由本工具重命名的文件(需要重新处理时使用 --force 或勾选“强制重新命名”)")
+                    if scan_index:
+                        self.log(f"扫描完成，共找到{scanner.count}个新增或修改过的文件"
+                                 f"(跳过 {scan_index.skipped_dirs} 个没有变化的目录、{scan_index.skipped_files} 个已处理的文件)")
+                    else:
+                        self.log(f"扫描完成，共找到{scanner.count}个文件")
+                batch_file_info = packer.flush()
+                if batch_file_info and not self.should_stop() and reserve(total_batches + 1, batch_file_info):
+                    total_batches += 1
+                    report_progress()
+                    yield (total_batches, batch_file_info, 1)
+
+            stats = self.stats
+            connections_before = connection_stats.snapshot()
+
+            def request_batch(batch):
+                """在工作线程中请求API，返回 (模型输出的文本, Token用量, 实际使用的模型)"""
+                batch_num, batch_file_info, _ = batch
+                batch_files = [info[1] for info in batch_file_info]
+                with stage_metrics.timer("prompt", len(batch_files)):
+                    messages = build_messages(batch_files, keyword, json_mode)
+                    # 预计的Token数：输入加上大致等长的输出
+                    prompt_tokens = estimate_tokens(messages[0]['content'] + messages[1]['content'])
+                # JSON模式下要求接口直接返回JSON对象
+                extra_args = {"response_format": JSON_RESPONSE_FORMAT} if json_mode else {}
+
+                self.log(f"\n请求批次 {batch_num}/{batch_total()}，共{len(batch_files)}个文件...")
+                self.log(f"发送的Prompt:\n{messages[1]['content']}", DEBUG)
+                used_models = []  # 依次尝试的模型，最后一个为返回结果的模型
+
+                def call(route):
+                    used_models.append(route.model)
+                    return route.client.call(
+                        lambda client: client.chat.completions.create(
+                            model=route.model,
+                            messages=messages,
+                            **extra_args
+                        ),
+                        tokens=prompt_tokens * 2,
+                        should_stop=self.should_stop,
+                        log=self.log,
+                    )
+
+                # 首选模型失败或已熔断时依次改用故障切换链中的模型
+                response = router.call(call)
+                if response is None:
+                    return None
+                return response.choices[0].message.content, getattr(response, 'usage', None), used_models[-1]
+
+            def on_batch_done(batch, result):
+                """在处理线程中按完成顺序执行重命名"""
+                nonlocal finished_batches
+                batch_num, batch_file_info, attempt = batch
+                if attempt == 1:
+                    finished_batches += 1
+                    report_progress()
+
+                content, usage, used_model = result
+                amount, *estimate = reservations.pop(batch_num, (0.0, 0, 0))
+                costs.release(amount)
+                cost = costs.record(used_model, usage, estimate, estimate_model=model)
+                self.log(f"\n批次 {batch_num}/{batch_total()} API返回内容:", DEBUG)
+                self.log(content, DEBUG)
+                batch_files = [info[1] for info in batch_file_info]
+                with stage_metrics.timer("parse", len(batch_files)):
+                    new_filenames, missing = parse_response(content, len(batch_files), json_mode)
+                stats.record(len(batch_files), len(new_filenames), usage)
+                if usage is not None:
+                    self.log(f"批次 {batch_num} Token用量: 输入 {getattr(usage, 'prompt_tokens', None)}，"
+                             f"输出 {getattr(usage, 'completion_tokens', None)}，约 {format_cost(cost)}({used_model})", DEBUG)
+
+                # 等待同一结果的同名文件一起重命名
+                shared_info_list = []
+                shared_names = []
+                if deduper:
+                    for idx, name in new_filenames:
+                        followers = deduper.resolve(batch_file_info[idx][0], name)
+                        shared_info_list.extend(followers)
+                        shared_names.extend([name] * len(followers))
+
+                # 先记录收到的结果，重命名中途中断时下次可以直接使用
+                if checkpoint:
+                    checkpoint.record_results([(batch_file_info[idx][0], name) for idx, name in new_filenames] +
+                                              list(zip((info[0] for info in shared_info_list), shared_names)))
+                dropped = []
+
+                # 缺失或无效的条目单独重新请求，不影响本批次其他文件
+                if missing:
+                    if attempt < MAX_ITEM_ATTEMPTS:
+                        self.log(f"警告：{len(missing)} 个文件未返回有效的新文件名，将单独重新请求", WARNING)
+                        for idx in missing:
+                            retry_num = f"{batch_num}-{idx+1}"
+                            # 达到费用预算时不再重新请求，这些文件留给下次继续
+                            if reserve(retry_num, [batch_file_info[idx]]):
+                                engine.requeue((retry_num, [batch_file_info[idx]], attempt + 1))
+                                stats.items_requeued += 1
+                    else:
+                        self.log(f"错误：多次请求仍未得到有效的新文件名，跳过: {', '.join(batch_files[idx] for idx in missing)}", ERROR)
+                        stats.items_dropped += len(missing)
+                        dropped = [(batch_file_info[idx][0], None) for idx in missing]
+                        if deduper:
+                            # 同名文件也没有结果，一并放弃
+                            for idx in missing:
+                                dropped.extend((info[0], None) for info in deduper.drop(batch_file_info[idx][0]))
+                if cache:
+                    cache.put_many(model, keyword, None, [(batch_files[idx], name) for idx, name in new_filenames] +
+                                   list(zip((info[1] for info in shared_info_list), shared_names)))
+                handled = apply_names(batch_file_info, new_filenames)
+                if shared_info_list:
+                    self.log(f"同名文件 {len(shared_info_list)} 个使用本批次的结果")
+                    handled += apply_names(shared_info_list, list(enumerate(shared_names)))
+                record_batch(handled + dropped, scanned=scanner.count)
+
+            def on_batch_error(batch, e):
+                nonlocal finished_batches
+                self.failed_batches += 1
+                batch_num, batch_file_info, attempt = batch
+                costs.release(reservations.pop(batch_num, (0.0,))[0])
+                if attempt == 1:
+                    finished_batches += 1
+                    report_progress()
+                self.log(f"处理批次 {batch_num} 时出错: {str(e)}", ERROR)
+                if deduper:
+                    # 等待本批次结果的同名文件本次不处理(下次继续时重新请求)，之后扫描到的同名文件单独请求
+                    waiting = sum(len(deduper.drop(info[0])) for info in batch_file_info)
+                    if waiting:
+                        self.log(f"{waiting} 个同名文件因本批次失败未处理", WARNING)
+                self.log("".join(traceback.format_exception(type(e), e, e.__traceback__)), DEBUG)  # 添加错误堆栈以便调试
+
+            # 多个批次并发请求，由限流器按模型的RPM/TPM配额控制请求速率(多个密钥时配额相加)
+            key_text = f", 密钥: {len(pool)}个" if len(pool) > 1 else ""
+            self.log(f"并发批次数: {self.concurrency}{key_text}, 限流: {pool.rpm}次/分钟, {pool.tpm} Token/分钟")
+            engine = BatchEngine(
+                request_batch,
+                concurrency=self.concurrency,
+                should_stop=self.should_stop,
+            )
+            engine.run(iter_batches(), on_batch_done, on_batch_error)
+            if stats.requests:
+                self.log(f"请求统计: {stats.summary()}")
+                self.log(f"连接统计: {connection_stats.summary(since=connections_before)}")
+            stage_lines = stage_metrics.summary_lines(since=metrics_before)
+            if stage_lines:
+                self.log("各阶段耗时(并发执行的阶段为各线程累计):")
+                for line in stage_lines:
+                    self.log(f"  {line}")
+            if costs.models:
+                self.log(f"费用统计: {costs.summary()}(按config.py中MODEL_PRICES的价格计算)")
+                for line in costs.summary_lines():
+                    self.log(f"  {line}")
+            if self.cache_hits:
+                self.log(f"本次运行缓存命中 {self.cache_hits} 个文件")
+            if deduper:
+                self.shared_count = deduper.shared_count
+                if self.shared_count:
+                    self.log(f"本次运行 {self.shared_count} 个同名文件使用了已有结果，没有单独请求API")
+            if pool.throttled_count:
+                self.log(f"本次运行共触发API限流 {pool.throttled_count} 次")
+            if router.failovers or any(route.failures for route in router.routes):
+                self.log(f"本次运行切换模型 {router.failovers} 次，各模型请求情况:")
+                for line in router.summary_lines():
+                    self.log(f"  {line}")
+            if len(pool) > 1:
+                self.log("各密钥用量:")
+                for line in pool.summary_lines():
+                    self.log(f"  {line}")
+            if self.renamed_count:
+                self.log(f"本次共重命名 {self.renamed_count} 个文件，重命名日志: {journal.path}")
+            if plan:
+                self.log(f"已生成重命名计划，本次写入 {self.planned_count} 个文件: {plan.path}")
+
+            # 正常完成时删除检查点；停止、有批次失败或达到费用预算时保留，下次可以继续
+            self.budget_exhausted = costs.exhausted
+            self.completed = not self.should_stop() and not self.failed_batches and not self.budget_exhausted
+            if self.completed:
+                if checkpoint:
+                    checkpoint.finish()
+            else:
+                if self.budget_exhausted:
+                    self.log(f"因达到费用预算 {format_cost(costs.budget)} 提前结束，部分文件尚未处理", WARNING)
+                if checkpoint:
+                    checkpoint.close()
+                    self.log("已保存检查点，再次处理该文件夹时可以从中断处继续")
+        finally:
+            if scan_index:
+                scan_index.close()
+            if ledger:
+                ledger.close()
+            if cache:
+                cache.close()
+            if checkpoint:
+                checkpoint.close()
+            if journal and journal is not self.journal:
+                journal.close()
+                if not journal.count:
+                    self.journal_path = None
+            if plan:
+                plan.close()
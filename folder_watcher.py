@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+监视模式
+订阅文件夹的文件系统事件(Linux上通过ctypes使用inotify，其他系统定时轮询)，
+新文件停止增长后在一个短时间窗口内攒成一批，交给重命名任务处理，
+上传完成几秒后文件即改为最终名称
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+
+from config import (
+    WATCH_SETTLE_SECONDS, WATCH_BATCH_WINDOW, WATCH_POLL_INTERVAL, WATCH_IGNORE_SUFFIXES, MAX_BATCH_FILES, COST_BUDGET
+)
+from cost_tracker import CostTracker
+
+# inotify事件掩码(见 /usr/include/sys/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# 需要关注的事件：新建、写入、写完关闭、移入
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event 的固定部分: wd, mask, cookie, len
+_EVENT_HEADER = struct.Struct("iIII")
+
+# 每次读取事件的缓冲区大小
+_READ_SIZE = 64 * 1024
+
+
+def _load_inotify():
+    """加载libc中的inotify函数，不可用时返回None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        init1 = libc.inotify_init1
+        add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    init1.argtypes = [ctypes.c_int]
+    init1.restype = ctypes.c_int
+    add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    add_watch.restype = ctypes.c_int
+    return init1, add_watch
+
+
+_inotify = _load_inotify()
+
+
+def is_ignored(name):
+    """隐藏文件和上传、下载中的临时文件不处理"""
+    return name.startswith(".") or name.endswith(WATCH_IGNORE_SUFFIXES)
+
+
+def _walk_files(dir_path, recursive):
+    """列出目录(及子目录)中的文件路径"""
+    stack = [dir_path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            yield entry.path
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+class InotifyWatcher:
+    """
+    基于inotify的目录监视(仅Linux)
+
+    递归监视时为每个子目录添加监视，新建或移入的子目录也会自动加入，
+    其中已有的文件作为新文件报告(添加监视之前写入的文件不会产生事件)。
+    """
+
+    def __init__(self, folder_path, recursive=True, on_error=None):
+        """
+        参数:
+            folder_path: 要监视的文件夹
+            recursive: 是否监视子目录
+            on_error: 函数on_error(path, exception)，无法监视某个目录时调用
+        """
+        init1, self._add_watch_func = _inotify
+        self.folder_path = folder_path
+        self.recursive = recursive
+        self.on_error = on_error
+        self._fd = init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._dirs = {}  # 监视描述符 -> 目录路径
+        self._limit_reported = False
+        self._add_tree(folder_path)
+
+    def _add_watch(self, dir_path):
+        """为单个目录添加监视，返回是否成功"""
+        wd = self._add_watch_func(self._fd, os.fsencode(dir_path), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                # 达到 fs.inotify.max_user_watches 上限
+                if not self._limit_reported and self.on_error:
+                    self.on_error(dir_path, OSError(err, "监视的目录数已达到系统上限(可调大 fs.inotify.max_user_watches)"))
+                self._limit_reported = True
+            elif err != errno.ENOENT and self.on_error:
+                self.on_error(dir_path, OSError(err, os.strerror(err)))
+            return False
+        self._dirs[wd] = dir_path
+        return True
+
+    def _add_tree(self, dir_path):
+        """为目录及其所有子目录添加监视"""
+        stack = [dir_path]
+        while stack:
+            current = stack.pop()
+            if not self._add_watch(current) or not self.recursive:
+                continue
+            try:
+                with os.scandir(current) as it:
+                    stack.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def read(self, timeout):
+        """
+        等待并读取事件
+
+        参数:
+            timeout: 最长等待秒数
+
+        返回:
+            (有变化的文件路径集合, 是否丢失了事件)；丢失事件(内核队列溢出)时调用方应重新检查整个目录
+        """
+        changed = set()
+        overflow = False
+        ready, _, _ = select.select([self._fd], [], [], max(timeout, 0))
+        if not ready:
+            return changed, overflow
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                dir_path = self._dirs.get(wd)
+                if dir_path is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._dirs[wd]
+                    continue
+                if not name:
+                    continue
+                path = os.path.join(dir_path, name)
+                if mask & IN_ISDIR:
+                    if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                        # 新子目录：添加监视，并报告其中已有的文件
+                        self._add_tree(path)
+                        changed.update(_walk_files(path, True))
+                    continue
+                changed.add(path)
+        return changed, overflow
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """
+    定时轮询的目录监视，用于不支持inotify的系统(Windows、macOS)或网络共享
+
+    每次比较所有文件的大小和修改时间，报告新增或变化的文件。
+    """
+
+    def __init__(self, folder_path, recursive=True, on_error=None, interval=WATCH_POLL_INTERVAL):
+        self.folder_path = folder_path
+        self.recursive = recursive
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+        self._next_poll = time.monotonic() + interval
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for path in _walk_files(self.folder_path, self.recursive):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout):
+        """等待到下次轮询(最长timeout秒)，返回 (有变化的文件路径集合, False)"""
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(timeout, 0))
+            return set(), False
+        time.sleep(max(wait, 0))
+        self._next_poll = time.monotonic() + self.interval
+        snapshot = self._take_snapshot()
+        changed = {path for path, stat in snapshot.items() if self._snapshot.get(path) != stat}
+        self._snapshot = snapshot
+        return changed, False
+
+    def close(self):
+        pass
+
+
+def create_watcher(folder_path, recursive=True, on_error=None):
+    """创建监视器：Linux上使用inotify，不可用时改为定时轮询"""
+    if _inotify is not None:
+        try:
+            return InotifyWatcher(folder_path, recursive, on_error)
+        except OSError as e:
+            if on_error:
+                on_error(folder_path, e)
+    return PollingWatcher(folder_path, recursive, on_error)
+
+
+class ArrivalBatcher:
+    """
+    把新到达的文件攒成批次
+
+    文件在settle_seconds内没有新事件、且前后两次检查的大小和修改时间相同，才认为已写完；
+    第一个写完的文件出现后再等待batch_window秒，期间写完的文件合并为一批(达到max_batch时立即交出)。
+    """
+
+    def __init__(self, settle_seconds=WATCH_SETTLE_SECONDS, batch_window=WATCH_BATCH_WINDOW,
+                 max_batch=MAX_BATCH_FILES):
+        self.settle_seconds = settle_seconds
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self._pending = {}  # 路径 -> [最后一次事件的时间, 上次检查时的(大小, 修改时间)]
+        self._ready = []
+        self._ready_set = set()
+        self._deadline = None
+        self._produced = set()  # 本工具重命名产生的文件，其移入事件不再处理
+
+    def add(self, path, now):
+        """记录文件的新事件(新建、写入、移入)"""
+        if path in self._produced:
+            self._produced.discard(path)
+            return
+        if is_ignored(os.path.basename(path)) or path in self._ready_set:
+            return
+        entry = self._pending.get(path)
+        if entry is None:
+            self._pending[path] = [now, None]
+        else:
+            entry[0] = now
+
+    def ignore_produced(self, paths):
+        """登记刚重命名产生的文件，随后收到的一次事件(重命名本身的移入事件)将被忽略"""
+        self._produced.update(paths)
+        for path in paths:
+            self._pending.pop(path, None)
+
+    def __len__(self):
+        return len(self._pending) + len(self._ready)
+
+    def next_check(self, now):
+        """距离下次需要检查还有多少秒"""
+        times = [entry[0] + self.settle_seconds for entry in self._pending.values()]
+        if self._deadline is not None:
+            times.append(self._deadline)
+        return max(0.0, min(times) - now) if times else None
+
+    def collect(self, now):
+        """
+        检查等待中的文件
+
+        返回:
+            可以处理的文件路径列表，批次未攒满且窗口未到时返回空列表
+        """
+        for path, entry in list(self._pending.items()):
+            if now - entry[0] < self.settle_seconds:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                # 已被删除或移走
+                del self._pending[path]
+                continue
+            stat = (st.st_size, st.st_mtime_ns)
+            if entry[1] != stat:
+                # 第一次检查或仍在增长，再等一个周期
+                entry[0] = now
+                entry[1] = stat
+                continue
+            del self._pending[path]
+            self._ready.append(path)
+            self._ready_set.add(path)
+            if self._deadline is None:
+                self._deadline = now + self.batch_window
+        if self._ready and (len(self._ready) >= self.max_batch or now >= self._deadline):
+            batch, self._ready = self._ready, []
+            self._ready_set.clear()
+            self._deadline = None
+            return batch
+        return []
+
+
+def watch_folder(folder_path, process, recursive=True, settle_seconds=WATCH_SETTLE_SECONDS,
+                 batch_window=WATCH_BATCH_WINDOW, max_batch=MAX_BATCH_FILES, should_stop=None, log=None):
+    """
+    监视文件夹，新文件写完后分批交给process处理，直到should_stop返回True
+
+    参数:
+        folder_path: 要监视的文件夹
+        process: 函数process(paths)，处理一批新文件(例如用FolderRenameJob重命名)，
+                 返回重命名产生的新路径列表，这些路径随后的移入事件不会当作新文件
+        recursive: 是否监视子目录
+        settle_seconds: 文件多少秒没有变化后认为已写完
+        batch_window: 第一个文件写完后再等待多少秒，合并同时到达的文件
+        max_batch: 每批最多文件数
+        should_stop: 无参函数，返回True时停止监视
+        log: 日志函数
+    """
+    should_stop = should_stop or (lambda: False)
+    log = log or (lambda message: None)
+    watcher = create_watcher(folder_path, recursive,
+                             on_error=lambda path, e: log(f"警告：无法监视目录 {path}: {e}"))
+    kind = "inotify" if isinstance(watcher, InotifyWatcher) else f"每{WATCH_POLL_INTERVAL}秒轮询"
+    log(f"开始监视 {folder_path} ({kind})，新文件写完后自动重命名，点击停止或按Ctrl+C结束")
+    batcher = ArrivalBatcher(settle_seconds, batch_window, max_batch)
+    try:
+        while not should_stop():
+            wait = batcher.next_check(time.monotonic())
+            changed, overflow = watcher.read(min(wait, 0.5) if wait is not None else 0.5)
+            now = time.monotonic()
+            if overflow:
+                log("警告：文件事件过多，部分事件丢失，重新检查整个文件夹")
+                changed.update(_walk_files(folder_path, recursive))
+            for path in changed:
+                batcher.add(path, now)
+            batch = batcher.collect(now)
+            if batch and not should_stop():
+                log(f"\n检测到 {len(batch)} 个新文件，开始处理")
+                batcher.ignore_produced(process(batch) or ())
+    finally:
+        watcher.close()
+        log("已停止监视")
+
+
+def watch_and_rename(client, folder_path, include_subdirs=True, log=None, should_stop=None, **job_options):
+    """
+    监视文件夹，用FolderRenameJob重命名写完的新文件，图形界面和命令行共用
+
+    参数:
+        client: OpenAI兼容客户端或create_key_pool()创建的多密钥池
+        folder_path: 要监视的文件夹
+        include_subdirs: 是否监视子目录
+        log: 日志函数 log(message, level)
+        should_stop: 无参函数，返回True时停止监视
+        job_options: 传给FolderRenameJob的其他参数(模型、关键字、并发数等)；
+                     costs为之前任务的CostTracker时，费用预算接着之前的花费计算
+
+    返回:
+        整个监视期间共用的重命名日志路径，没有重命名任何文件时为None
+    """
+    from folder_renamer import FolderRenameJob
+    from rename_journal import RenameJournal
+
+    # 整个监视期间共用一个重命名日志，可以一次撤销；费用预算也按整个监视期间计算
+    journal = RenameJournal(folder_path)
+    budget = job_options.pop("budget", COST_BUDGET)
+    costs = job_options.pop("costs", None) or CostTracker(budget)
+    should_stop = should_stop or (lambda: False)
+
+    def process(paths):
+        produced = []
+        job = FolderRenameJob(
+            client, folder_path, include_subdirs=include_subdirs, paths=paths, journal=journal,
+            resume=False, incremental=False, use_checkpoint=False, log=log, should_stop=should_stop, costs=costs,
+            on_renamed=lambda old_path, new_path: produced.append(new_path), **job_options
+        )
+        job.run()
+        return produced
+
+    try:
+        # 达到费用预算后结束监视
+        watch_folder(folder_path, process, recursive=include_subdirs,
+                     max_batch=job_options.get("batch_size", MAX_BATCH_FILES),
+                     should_stop=lambda: should_stop() or costs.exhausted, log=log)
+    finally:
+        journal.close()
+    return journal.path if journal.count else None
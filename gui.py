@@ -5,13 +5,10 @@
 """
 
 import os
-import time
 import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext, messagebox
-from openai import OpenAI
 import traceback  # 添加这一行到文件顶部的导入部分
-import httpx  # 添加httpx导入
 import datetime  # 导入日期模块
 import sys  # 添加sys模块导入
 import json  # 添加json模块导入
@@ -22,6 +19,20 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
+from config import (
+    BATCH_CONCURRENCY, MAX_BATCH_FILES, PLAN_DIR, INCREMENTAL_SCAN, SKIP_RENAMED_FILES,
+    METRICS_PORT, METRICS_JSON_PATH, COST_BUDGET
+)
+from checkpoint import JobCheckpoint
+from rename_journal import RenameJournal, latest_journal, read_journal, undo_journal
+from rename_plan import apply_plan, plan_folder
+from folder_renamer import FolderRenameJob, create_key_pool
+from folder_watcher import watch_and_rename
+from stage_metrics import MetricsExporter
+from cost_tracker import format_cost
+from key_pool import parse_api_keys, mask_key
+from log_sink import LogSink, LOG_LEVELS, DEFAULT_LOG_LEVEL, INFO, WARNING, ERROR
+
 # 导入密钥验证模块
 try:
     from key_verifier import verify_key
@@ -166,18 +177,31 @@ class BatchRenameGUI:
         # 创建变量
         self.folder_path_var = tk.StringVar()
         self.api_key_var = tk.StringVar()
-        self.batch_size_var = tk.IntVar(value=3)
+        self.batch_size_var = tk.IntVar(value=MAX_BATCH_FILES)  # 每批最多文件数，实际按Token预算打包
+        self.concurrency_var = tk.IntVar(value=BATCH_CONCURRENCY)  # 同时请求的批次数
         self.show_key_var = tk.BooleanVar(value=False)
         self.remember_key_var = tk.BooleanVar(value=True)  # 记住API密钥变量
         self.model_var = tk.StringVar(value="qwen-plus")
         self.keyword_var = tk.StringVar() # 新增：关键字变量
         self.include_subdirs_var = tk.BooleanVar(value=True)  # 新增：包含子目录选项
+        self.use_cache_var = tk.BooleanVar(value=True)  # 使用AI结果缓存
+        self.json_mode_var = tk.BooleanVar(value=True)  # 要求模型以JSON格式返回结果
+        self.incremental_var = tk.BooleanVar(value=INCREMENTAL_SCAN)  # 跳过上次处理后没有变化的目录
+        self.force_var = tk.BooleanVar(value=not SKIP_RENAMED_FILES)  # 重新处理之前已改名的文件
+        self.watch_var = tk.BooleanVar(value=False)  # 处理完后继续监视文件夹中的新文件
+        self.budget_var = tk.StringVar(value="" if COST_BUDGET is None else str(COST_BUDGET))  # 费用上限(元)，留空不限制
+        self.log_level_var = tk.StringVar(value=DEFAULT_LOG_LEVEL)  # 日志详细程度
+        self.plan_only_var = tk.BooleanVar(value=False)  # 只生成重命名计划，不修改文件
+        
+        # 日志先放入队列，由界面线程定时批量显示
+        self.log_sink = LogSink(level=LOG_LEVELS[DEFAULT_LOG_LEVEL])
         
         # 加载保存的API密钥
         self.load_api_key()
         
         # 创建界面
         self.create_widgets()
+        self.log_sink.attach(self.root, self.log_text)
         
         # 初始化标志
         self.is_processing = False
@@ -189,7 +213,8 @@ class BatchRenameGUI:
             if key_file.exists():
                 with open(key_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    saved_key = data.get('api_key', '')
+                    # 保存了多个密钥时用逗号连接显示
+                    saved_key = ", ".join(data.get('api_keys') or []) or data.get('api_key', '')
                     if saved_key:
                         self.api_key_var.set(saved_key)
                         print("已加载保存的API密钥")
@@ -218,8 +243,9 @@ class BatchRenameGUI:
             os.makedirs('config', exist_ok=True)
             
             key_file = Path('config/api_key.json')
+            api_keys = parse_api_keys(api_key)
             with open(key_file, 'w', encoding='utf-8') as f:
-                json.dump({'api_key': api_key}, f)
+                json.dump({'api_key': api_keys[0], 'api_keys': api_keys}, f)
                 
             print("API密钥已保存")
         except Exception as e:
@@ -269,7 +295,7 @@ class BatchRenameGUI:
         ttk.Checkbutton(input_frame, text="包含子目录", variable=self.include_subdirs_var).grid(row=0, column=3, padx=5, pady=5)
         
         # API密钥
-        ttk.Label(input_frame, text="API密钥:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Label(input_frame, text="API密钥:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)  # 多个密钥用逗号分隔
         self.api_key_entry = ttk.Entry(input_frame, textvariable=self.api_key_var, width=50, show="*")
         self.api_key_entry.grid(row=1, column=1, sticky=tk.EW, padx=5, pady=5)
         
@@ -291,15 +317,32 @@ class BatchRenameGUI:
         
         # 模型选择
         ttk.Label(settings_frame, text="模型:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
-        models = ["qwen-turbo", "qwen-plus", "qwen-v1"]
+        models = ["qwen-turbo", "qwen-plus"]
         model_combo = ttk.Combobox(settings_frame, textvariable=self.model_var, values=models, width=15)
         model_combo.grid(row=0, column=1, sticky=tk.W, padx=5, pady=5)
         
         # 批量大小
-        ttk.Label(settings_frame, text="每批文件数:").grid(row=0, column=2, sticky=tk.W, padx=5, pady=5)
-        batch_spinbox = ttk.Spinbox(settings_frame, from_=1, to=10, textvariable=self.batch_size_var, width=5)
+        ttk.Label(settings_frame, text="每批最多文件数:").grid(row=0, column=2, sticky=tk.W, padx=5, pady=5)
+        batch_spinbox = ttk.Spinbox(settings_frame, from_=1, to=200, textvariable=self.batch_size_var, width=5)
         batch_spinbox.grid(row=0, column=3, sticky=tk.W, padx=5, pady=5)
         
+        # 并发批次数
+        ttk.Label(settings_frame, text="并发数:").grid(row=0, column=4, sticky=tk.W, padx=5, pady=5)
+        concurrency_spinbox = ttk.Spinbox(settings_frame, from_=1, to=16, textvariable=self.concurrency_var, width=5)
+        concurrency_spinbox.grid(row=0, column=5, sticky=tk.W, padx=5, pady=5)
+        
+        # 使用缓存
+        ttk.Checkbutton(settings_frame, text="使用缓存", variable=self.use_cache_var).grid(row=0, column=6, padx=5, pady=5)
+        ttk.Checkbutton(settings_frame, text="JSON模式", variable=self.json_mode_var).grid(row=0, column=7, padx=5, pady=5)
+        ttk.Checkbutton(settings_frame, text="增量扫描", variable=self.incremental_var).grid(row=0, column=8, padx=5, pady=5)
+        ttk.Checkbutton(settings_frame, text="强制重新命名", variable=self.force_var).grid(row=0, column=9, padx=5, pady=5)
+        ttk.Checkbutton(settings_frame, text="监视模式", variable=self.watch_var).grid(row=0, column=10, padx=5, pady=5)
+        
+        # 费用上限：达到后停止发出新批次并保存检查点
+        ttk.Label(settings_frame, text="费用上限(元):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Entry(settings_frame, textvariable=self.budget_var, width=10).grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
+        ttk.Label(settings_frame, text="留空不限制，设置后开始前先估算费用").grid(row=1, column=2, columnspan=4, sticky=tk.W, padx=5, pady=5)
+        
         # 操作按钮
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=10)
@@ -310,6 +353,14 @@ class BatchRenameGUI:
         self.stop_button = ttk.Button(button_frame, text="停止", command=self.stop_processing, state=tk.DISABLED)
         self.stop_button.pack(side=tk.LEFT, padx=5)
         
+        self.undo_button = ttk.Button(button_frame, text="撤销上次重命名", command=self.undo_last_rename)
+        self.undo_button.pack(side=tk.LEFT, padx=5)
+        
+        # 计划模式：先生成计划文件，检查后再执行
+        self.apply_plan_button = ttk.Button(button_frame, text="执行计划...", command=self.apply_plan_file)
+        self.apply_plan_button.pack(side=tk.RIGHT, padx=5)
+        ttk.Checkbutton(button_frame, text="仅生成重命名计划", variable=self.plan_only_var).pack(side=tk.RIGHT, padx=5)
+        
         # 进度条
         self.progress_var = tk.DoubleVar()
         self.progress = ttk.Progressbar(main_frame, orient=tk.HORIZONTAL, variable=self.progress_var, mode='indeterminate')
@@ -322,8 +373,19 @@ class BatchRenameGUI:
         self.log_text = scrolledtext.ScrolledText(log_frame, height=15, wrap=tk.WORD)
         self.log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
+        log_button_frame = ttk.Frame(log_frame)
+        log_button_frame.pack(fill=tk.X)
+        
+        # 日志级别，"详细"时显示发送的提示词和API返回的完整内容
+        ttk.Label(log_button_frame, text="日志级别:").pack(side=tk.LEFT, padx=5)
+        log_level_combo = ttk.Combobox(log_button_frame, textvariable=self.log_level_var, values=list(LOG_LEVELS.keys()),
+                                       width=12, state="readonly")
+        log_level_combo.pack(side=tk.LEFT, padx=5)
+        log_level_combo.bind("<<ComboboxSelected>>",
+                             lambda e: setattr(self.log_sink, "level", LOG_LEVELS[self.log_level_var.get()]))
+        
         # 清除日志按钮
-        ttk.Button(log_frame, text="清除日志", command=lambda: self.log_text.delete(1.0, tk.END)).pack(anchor=tk.E, padx=5, pady=5)
+        ttk.Button(log_button_frame, text="清除日志", command=lambda: self.log_text.delete(1.0, tk.END)).pack(side=tk.RIGHT, padx=5, pady=5)
         
         # 状态栏
         self.status_var = tk.StringVar(value="就绪")
@@ -357,6 +419,12 @@ class BatchRenameGUI:
             messagebox.showerror("错误", "请输入API密钥")
             return
         
+        try:
+            budget = self.get_budget()
+        except ValueError:
+            messagebox.showerror("错误", "费用上限应为数字(元)，留空表示不限制")
+            return
+        
         # 保存API密钥（如果用户选择记住）
         self.save_api_key()
         
@@ -364,18 +432,143 @@ class BatchRenameGUI:
         keyword = self.keyword_var.get().strip() # 新增：获取关键字
         include_subdirs = self.include_subdirs_var.get()  # 获取是否包含子目录的选项
 
+        # 上次处理该文件夹时中断，询问是否继续
+        resume = False
+        if JobCheckpoint(folder_path).exists():
+            answer = messagebox.askyesnocancel(
+                "继续上次的任务",
+                "该文件夹有未完成的重命名任务。\n\n是：从中断处继续(已完成的文件不会再次请求API)\n否：重新开始\n取消：不处理"
+            )
+            if answer is None:
+                return
+            resume = answer
+
+        # 界面上的设置在界面线程中读取，处理线程不访问Tk变量
+        settings = dict(
+            model=self.model_var.get(),
+            batch_size=self.batch_size_var.get(),
+            concurrency=self.concurrency_var.get(),
+            use_cache=self.use_cache_var.get(),
+            json_mode=self.json_mode_var.get(),
+            skip_renamed=not self.force_var.get(),
+            budget=budget,
+            plan_only=self.plan_only_var.get(),
+            incremental=self.incremental_var.get(),
+            watch=self.watch_var.get(),
+        )
+
         # 更新UI状态
         self.is_processing = True
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
+        self.undo_button.config(state=tk.DISABLED)
+        self.apply_plan_button.config(state=tk.DISABLED)
         self.status_var.set("正在处理...")
         self.progress.start()
         
         # 在新线程中执行处理，避免界面卡死
-        thread = threading.Thread(target=self.process_files, args=(folder_path, api_key, keyword, include_subdirs)) # 修改：传递include_subdirs参数
+        thread = threading.Thread(target=self.process_files, args=(folder_path, api_key, keyword, include_subdirs, resume, settings)) # 修改：传递include_subdirs参数
         thread.daemon = True
         thread.start()
     
+    def set_status(self, text):
+        """更新状态栏，可在任意线程调用，由界面线程执行"""
+        self.root.after(0, self.status_var.set, text)
+    
+    def get_budget(self):
+        """返回设置的费用上限(元)，留空时返回None，格式错误时抛出ValueError"""
+        text = self.budget_var.get().strip()
+        return float(text) if text else None
+    
+    def undo_last_rename(self):
+        """撤销当前文件夹最近一次运行的全部重命名"""
+        folder_path = self.folder_path_var.get().strip()
+        journal_path = latest_journal(folder_path=folder_path or None)
+        if not journal_path:
+            messagebox.showinfo("撤销重命名", "没有找到可撤销的重命名记录")
+            return
+        folder, entries = read_journal(journal_path)
+        if not messagebox.askyesno("撤销重命名", f"将把 {folder} 中上次重命名的 {len(entries)} 个文件恢复为原名称，是否继续？"):
+            return
+        
+        self.start_button.config(state=tk.DISABLED)
+        self.undo_button.config(state=tk.DISABLED)
+        self.status_var.set("正在撤销重命名...")
+        thread = threading.Thread(target=self.run_undo, args=(journal_path,))
+        thread.daemon = True
+        thread.start()
+    
+    def run_undo(self, journal_path):
+        """撤销重命名的线程函数"""
+        try:
+            self.log(f"\n开始撤销重命名，日志: {journal_path}")
+            result = undo_journal(journal_path, log=self.log)
+            self.log(f"撤销完成: {result.summary()}")
+            self.set_status("撤销完成")
+        except Exception as e:
+            self.log(f"撤销重命名时出错: {e}", ERROR)
+            self.log(traceback.format_exc(), ERROR)
+            self.set_status("撤销失败")
+        self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.undo_button.config(state=tk.NORMAL))
+    
+    def apply_plan_file(self):
+        """选择重命名计划文件并执行"""
+        plan_path = filedialog.askopenfilename(
+            title="选择重命名计划",
+            initialdir=PLAN_DIR if os.path.isdir(PLAN_DIR) else None,
+            filetypes=[("重命名计划", "*.jsonl *.csv"), ("所有文件", "*.*")],
+        )
+        if not plan_path:
+            return
+        if not messagebox.askyesno("执行计划", f"将按计划文件重命名文件(不调用API):\n{plan_path}\n\n是否继续？"):
+            return
+        
+        self.is_processing = True
+        self.start_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.undo_button.config(state=tk.DISABLED)
+        self.apply_plan_button.config(state=tk.DISABLED)
+        self.status_var.set("正在执行计划...")
+        self.progress.config(mode='determinate', maximum=1)
+        self.progress_var.set(0)
+        default_folder = self.folder_path_var.get().strip()
+        thread = threading.Thread(target=self.run_apply_plan, args=(plan_path, default_folder))
+        thread.daemon = True
+        thread.start()
+    
+    def run_apply_plan(self, plan_path, default_folder=""):
+        """执行重命名计划的线程函数，default_folder为计划中没有记录文件夹时日志使用的文件夹"""
+        journal = None
+        try:
+            self.log(f"\n开始执行重命名计划: {plan_path}")
+            journal = RenameJournal(plan_folder(plan_path) or default_folder or os.path.dirname(plan_path))
+            
+            def progress(done, total):
+                self.root.after(0, lambda: self.progress.config(maximum=max(total, 1)))
+                self.root.after(0, lambda: self.progress_var.set(done))
+                self.set_status(f"正在执行计划... {done}/{total}")
+            
+            result = apply_plan(plan_path, journal=journal, log=self.log, progress=progress,
+                                should_stop=lambda: not self.is_processing)
+            journal.close()
+            self.log(f"计划执行完成: {result.summary()}")
+            if journal.count:
+                self.log("可点击“撤销上次重命名”恢复")
+            self.set_status("计划执行完成")
+        except Exception as e:
+            self.log(f"执行计划时出错: {e}", ERROR)
+            self.log(traceback.format_exc(), ERROR)
+            self.set_status("执行计划失败")
+            if journal:
+                journal.close()
+        
+        self.is_processing = False
+        self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.stop_button.config(state=tk.DISABLED))
+        self.root.after(0, lambda: self.undo_button.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.apply_plan_button.config(state=tk.NORMAL))
+    
     def stop_processing(self):
         """停止处理文件"""
         self.is_processing = False
@@ -387,256 +580,97 @@ class BatchRenameGUI:
         self.start_button.config(state=tk.NORMAL)
         self.progress.stop()
     
-    def process_files(self, folder_path, api_key, keyword, include_subdirs=False): # 修改：接收include_subdirs参数
-        """处理文件的线程函数"""
+    def process_files(self, folder_path, api_key, keyword, include_subdirs=False, resume=False, settings=None): # 修改：接收include_subdirs参数
+        """处理文件的线程函数，resume为True时从上次中断的检查点继续，settings为start_processing读取的界面设置"""
         try:
-            batch_size = self.batch_size_var.get()
-            model = self.model_var.get()
+            model = settings["model"]
             
-            # 清除可能导致问题的环境变量
-            if "SSL_CERT_FILE" in os.environ:
-                self.log(f"发现SSL_CERT_FILE环境变量：{os.environ['SSL_CERT_FILE']}")
-                del os.environ["SSL_CERT_FILE"]
-                self.log("已清除SSL_CERT_FILE环境变量")
-                
-            if "REQUESTS_CA_BUNDLE" in os.environ:
-                self.log(f"发现REQUESTS_CA_BUNDLE环境变量：{os.environ['REQUESTS_CA_BUNDLE']}")
-                del os.environ["REQUESTS_CA_BUNDLE"]
-                self.log("已清除REQUESTS_CA_BUNDLE环境变量")
-                
-            # 初始化OpenAI客户端(通义千问兼容模式) - 禁用SSL验证
+            # 初始化OpenAI客户端(通义千问兼容模式)，填写多个密钥时按各密钥剩余额度分配请求
             try:
-                self.log(f"尝试初始化API客户端 - 模型: {model}, API密钥: {'*'*(len(api_key)-4) + api_key[-4:]}")
-                self.log("SSL验证已禁用")
-                
-                # 使用httpx客户端并禁用SSL验证
-                client = OpenAI(
-                    api_key=api_key,
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                    http_client=httpx.Client(verify=False)  # 禁用SSL验证
-                )
+                api_keys = parse_api_keys(api_key)
+                self.log(f"尝试初始化API客户端 - 模型: {model}, API密钥: {', '.join(mask_key(key) for key in api_keys)}")
+                client = create_key_pool(api_keys, model, settings["concurrency"])
                 self.log("API客户端初始化成功")
             except Exception as e:
                 # 输出完整的错误堆栈
-                self.log(f"初始化API客户端失败: {e}")
-                self.log(traceback.format_exc())
+                self.log(f"初始化API客户端失败: {e}", ERROR)
+                self.log(traceback.format_exc(), ERROR)
                 raise
             
-            # 获取文件列表（支持递归扫描子目录）
-            file_info_list = []
+            def on_progress(finished, total):
+                self.root.after(0, lambda: self.progress.config(maximum=max(total, 1)))
+                self.root.after(0, lambda: self.progress_var.set(finished))
             
-            if include_subdirs:
-                self.log("正在递归扫描所有子目录中的文件...")
-                for root, _, files in os.walk(folder_path):
-                    for file in files:
-                        full_path = os.path.join(root, file)
-                        rel_dir = os.path.relpath(root, folder_path)
-                        # 如果是根目录，rel_dir为"."，我们将其置为空字符串
-                        if rel_dir == ".":
-                            rel_dir = ""
-                        file_info_list.append((full_path, file, rel_dir))
-            else:
-                self.log("仅扫描当前目录中的文件...")
-                for file in os.listdir(folder_path):
-                    full_path = os.path.join(folder_path, file)
-                    if os.path.isfile(full_path):
-                        file_info_list.append((full_path, file, ""))
-            
-            self.log(f"找到{len(file_info_list)}个文件")
+            self.root.after(0, lambda: self.progress.config(mode='determinate', maximum=1))
+            self.root.after(0, self.progress_var.set, 0)
             
-            # 设置进度条最大值
-            total_batches = (len(file_info_list) - 1) // batch_size + 1
-            self.root.after(0, lambda: self.progress.config(mode='determinate', maximum=total_batches))
-            self.progress_var.set(0)
-            
-            # 批量处理文件
-            for i in range(0, len(file_info_list), batch_size):
-                if not self.is_processing:
-                    break
-                    
-                batch_file_info = file_info_list[i:i+batch_size]
-                batch_num = i // batch_size + 1
-                
-                # 提取当前批次的文件名（用于显示）
-                batch_files = [info[1] for info in batch_file_info]
-                
-                self.log(f"\n处理批次 {batch_num}/{total_batches}，共{len(batch_files)}个文件:")
-                
-                # 更新进度条
-                self.root.after(0, lambda v=batch_num: self.progress_var.set(v))
-                
-                # 构建提示
-                file_list_text = "\n".join([f"{idx+1}. {file}" for idx, file in enumerate(batch_files)])
-                
-                # 修改：根据是否有关键字调整提示逻辑
-                if keyword:
-                    primary_instruction = f"请根据关键字 '{keyword}' 来为以下文件命名。"
-                    secondary_instruction = "生成的新文件名应关于此关键字，并保持简洁、吸引人。可以很大程度上忽略原始文件名（除了扩展名）。"
-                else:
-                    primary_instruction = "请帮我优化以下文件名，生成更加简洁、清晰的新文件名。"
-                    secondary_instruction = "每个文件名需要花哨一些，不要过于简单。"
-
-                prompt = f"""{primary_instruction}
-{secondary_instruction}
-保留原文件名的扩展名(.jpg/.mp4等)。
-请严格按照以下格式返回结果，只需返回编号和新文件名，不要包含其他任何说明文字或注释：
-
-原文件列表:
-{file_list_text}
-
-新文件名:
-1. [新文件名1]
-2. [新文件名2]
-... (根据文件数量继续)
-"""
-                
-                try:
-                    # 调用通义千问API
-                    self.log("正在请求通义千问API...")
-                    self.log(f"发送的Prompt:\n{prompt}") # 添加日志输出Prompt内容
-                    response = client.chat.completions.create(
-                        model=model,
-                        messages=[
-                            {"role": "system", "content": "你是一个专业的文件重命名助手，擅长根据用户需求生成文件名。"},
-                            {"role": "user", "content": prompt}
-                        ]
-                    )
-                    
-                    # 提取生成的文件名
-                    content = response.choices[0].message.content
-                    self.log("\nAPI返回内容:")
-                    self.log(content)
-                    
-                    # 解析返回的文件名
-                    new_filenames = []
-                    lines = content.split('\n')
-                    for line in lines:
-                        line = line.strip() # 去除前后空格
-                        if line and line[0].isdigit() and '. ' in line:
-                            parts = line.split('. ', 1)
-                            if len(parts) == 2 and parts[0].isdigit():
-                                try: # 添加try-except以防非数字
-                                    idx = int(parts[0]) - 1
-                                    if 0 <= idx < len(batch_files):
-                                        new_name = parts[1].strip().strip('[]')
-                                        # 进一步清理可能的markdown标记
-                                        new_name = new_name.replace('*', '').replace('`', '') 
-                                        if new_name:
-                                            new_filenames.append((idx, new_name))
-                                except ValueError:
-                                    self.log(f"警告：无法解析行号: {line}")
-                                    continue
-                    
-                    # 直接执行重命名操作，不显示确认对话框
-                    if new_filenames and self.is_processing:
-                        self.log("\n开始执行重命名操作:")
-                        renamed_count = 0 # 记录成功重命名的数量
-                        for idx, new_name in new_filenames:
-                            if not self.is_processing:
-                                break
-                            
-                            # 获取完整信息
-                            old_path, old_name, rel_dir = batch_file_info[idx]
-                            
-                            # 保留原扩展名
-                            name_part, ext = os.path.splitext(old_name)
-                            # 确保新文件名不为空且不包含非法字符 (简单检查)
-                            new_name = "".join(c for c in new_name if c not in '/\\:*?"<>|') 
-                            if not new_name:
-                                self.log(f"警告：生成的新文件名无效或为空，跳过: {old_name}")
-                                continue
-
-                            # 检查新文件名是否与旧扩展名匹配，如果不匹配则添加
-                            new_name_part, new_ext = os.path.splitext(new_name)
-                            if not new_ext: # 如果AI生成的不带扩展名
-                                final_new_name = new_name_part + ext
-                            elif new_ext.lower() != ext.lower(): # 如果AI生成的扩展名不对
-                                self.log(f"警告：AI生成的扩展名 '{new_ext}' 与原扩展名 '{ext}' 不符，将使用原扩展名。")
-                                final_new_name = new_name_part + ext
-                            else: # AI生成的扩展名正确
-                                final_new_name = new_name
-
-                            # 避免重命名为同名文件
-                            if final_new_name == old_name:
-                                self.log(f"跳过重命名，新旧文件名相同: {old_name}")
-                                continue
-
-                            # 确定目标文件路径
-                            parent_dir = os.path.dirname(old_path)
-                            new_path = os.path.join(parent_dir, final_new_name)
-                            
-                            # 处理潜在的文件名冲突
-                            counter = 1
-                            base_name, file_ext = os.path.splitext(final_new_name)
-                            while os.path.exists(new_path):
-                                self.log(f"警告：目标文件 '{final_new_name}' 已存在。尝试添加后缀...")
-                                final_new_name = f"{base_name}_{counter}{file_ext}"
-                                new_path = os.path.join(parent_dir, final_new_name)
-                                counter += 1
-                                if counter > 10: # 防止无限循环
-                                    self.log(f"错误：无法为 '{old_name}' 找到不冲突的新文件名，跳过。")
-                                    final_new_name = None
-                                    break
-                            
-                            if final_new_name is None:
-                                continue # 跳到下一个文件
-
-                            # 显示包含相对路径的日志
-                            path_info = f"[{rel_dir}]" if rel_dir else ""
-                            self.log(f"准备重命名: {path_info}{old_name} -> {final_new_name}")
-                            
-                            try:
-                                os.rename(old_path, new_path)
-                                self.log(f"已重命名: {path_info}{old_name} -> {final_new_name}")
-                                renamed_count += 1
-                            except OSError as e: # 更具体的异常捕获
-                                self.log(f"重命名失败: {path_info}{old_name} -> {final_new_name} - 错误: {e}")
-                            except Exception as e:
-                                self.log(f"重命名时发生未知错误: {path_info}{old_name} - {e}")
-                                self.log(traceback.format_exc()) # 记录完整堆栈
-
-                        if renamed_count > 0:
-                             self.log(f"本批次成功重命名 {renamed_count} 个文件。")
-                        else:
-                             self.log("本批次未能成功重命名任何文件。")
-                             
-                    elif not new_filenames and self.is_processing:
-                        self.log("无法从API响应中提取有效的文件名或格式不符")
-                    elif not self.is_processing:
-                        self.log("处理已停止，未执行重命名。")
-                        
-                except Exception as e:
-                    self.log(f"处理批次 {batch_num} 时出错: {str(e)}")
-                    self.log(traceback.format_exc())  # 添加错误堆栈以便调试
-                    # 考虑是否继续处理下一批
-                
-                # 避免API限流，添加延迟
-                if i + batch_size < len(file_info_list) and self.is_processing:
-                    delay = 2  # 2秒延迟
-                    self.log(f"\n等待{delay}秒，避免API限流...")
-                    time.sleep(delay)
+            # 扫描、请求和重命名流程与命令行共用，监视模式沿用同样的参数
+            options = dict(
+                model=model,
+                keyword=keyword,
+                batch_size=settings["batch_size"],
+                concurrency=settings["concurrency"],
+                use_cache=settings["use_cache"],
+                json_mode=settings["json_mode"],
+                skip_renamed=settings["skip_renamed"],
+                budget=settings["budget"],
+            )
+            job = FolderRenameJob(
+                client,
+                folder_path,
+                include_subdirs=include_subdirs,
+                plan_only=settings["plan_only"],
+                resume=resume,
+                incremental=settings["incremental"],
+                log=self.log,
+                should_stop=lambda: not self.is_processing,
+                on_progress=on_progress,
+                **options
+            )
+            # 设置了费用上限时先估算本次任务的费用
+            if options["budget"] is not None:
+                self.log("正在估算费用...")
+                estimate = job.estimate()
+                self.log(f"费用估算: {estimate.summary()}")
+                if estimate.cost > options["budget"]:
+                    self.log(f"预计费用超过上限 {format_cost(options['budget'])}，达到上限后将停止并保存检查点，"
+                             f"之后提高上限可继续处理", WARNING)
+            job.run()
+            if job.renamed_count:
+                self.log("可点击“撤销上次重命名”恢复")
+            if job.plan_only:
+                self.log("检查无误后可点击“执行计划...”执行")
+            elif settings["watch"] and self.is_processing and not job.completed:
+                self.log("首次处理没有全部完成，不进入监视模式；再次开始处理可从检查点继续", WARNING)
+            elif settings["watch"] and job.completed:
+                self.set_status("正在监视新文件...")
+                if watch_and_rename(client, folder_path, include_subdirs=include_subdirs, log=self.log,
+                                    should_stop=lambda: not self.is_processing, costs=job.costs, **options):
+                    self.log("可点击“撤销上次重命名”撤销监视期间的重命名")
             
             # 完成处理
-            if self.is_processing:
+            if job.budget_exhausted:
+                self.set_status("已达到费用上限，部分文件未处理")
+            elif self.is_processing:
                 self.log("\n所有文件处理完成!")
-                self.status_var.set("处理完成")
+                self.set_status("处理完成")
             
         except Exception as e:
-            self.log(f"发生严重错误: {str(e)}")
-            self.log(traceback.format_exc())
-            self.status_var.set("处理过程中发生严重错误")
+            self.log(f"发生严重错误: {str(e)}", ERROR)
+            self.log(traceback.format_exc(), ERROR)
+            self.set_status("处理过程中发生严重错误")
         
         # 恢复UI状态
         self.is_processing = False
         self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
         self.root.after(0, lambda: self.stop_button.config(state=tk.DISABLED))
+        self.root.after(0, lambda: self.undo_button.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.apply_plan_button.config(state=tk.NORMAL))
         self.root.after(0, lambda: self.progress.stop())
 
-    def log(self, message):
-        """添加消息到日志区域"""
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)  # 滚动到底部
-        self.root.update_idletasks()
+    def log(self, message, level=INFO):
+        """添加消息到日志区域，可在任意线程调用，由界面线程定时批量显示"""
+        self.log_sink.write(message, level)
 
 def main():
     """主函数"""
@@ -646,6 +680,14 @@ def main():
     # 创建配置目录
     os.makedirs('config', exist_ok=True)
     
+    # config.py中配置了METRICS_PORT或METRICS_JSON_PATH时在后台导出运行指标
+    exporter = None
+    if METRICS_PORT is not None or METRICS_JSON_PATH:
+        try:
+            exporter = MetricsExporter(port=METRICS_PORT, json_path=METRICS_JSON_PATH).start()
+        except OSError as e:
+            print(f"无法在端口 {METRICS_PORT} 提供运行指标: {e}")
+    
     try:
         # 直接启动主程序
         root = tk.Tk()
@@ -661,6 +703,9 @@ def main():
             messagebox.showerror("启动错误", f"程序启动失败: {e}\n请联系开发者")
         except:
             pass
+    finally:
+        if exporter:
+            exporter.stop()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+共享HTTP客户端
+进程内的AI请求共用一个长连接池(启用HTTP/2时同一连接可同时承载多个请求)，
+不会每次运行或每个请求都重新建立TCP连接和TLS握手；同时统计新建连接的耗时
+"""
+
+import time
+import threading
+
+import httpx
+
+try:
+    import certifi
+except ImportError:
+    certifi = None
+
+from config import (
+    BATCH_CONCURRENCY, HTTP2_ENABLED, HTTP_POOL_SIZE,
+    HTTP_KEEPALIVE_EXPIRY, HTTP_TIMEOUTS, CA_BUNDLE
+)
+
+# 需要统计耗时的连接阶段：TCP连接、TLS握手
+_TRACE_STAGES = {
+    "connection.connect_tcp": "connect",
+    "connection.start_tls": "tls",
+}
+
+
+class ConnectionStats:
+    """新建连接的次数和耗时统计，所有线程共用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0  # 发出的请求数
+        self.connections = 0  # 新建的连接数
+        self.connect_time = 0.0  # TCP连接总耗时(秒)
+        self.tls_count = 0  # TLS握手次数
+        self.tls_time = 0.0  # TLS握手总耗时(秒)
+        self.failures = 0  # 建立连接或握手失败的次数
+
+    def snapshot(self):
+        """返回当前统计值，用于计算一次运行内的增量"""
+        with self._lock:
+            return (self.requests, self.connections, self.connect_time,
+                    self.tls_count, self.tls_time, self.failures)
+
+    def summary(self, since=None):
+        """
+        返回统计摘要文本
+
+        参数:
+            since: snapshot()的返回值，提供时只统计此后的部分
+        """
+        values = self.snapshot()
+        if since:
+            values = tuple(a - b for a, b in zip(values, since))
+        requests, connections, connect_time, tls_count, tls_time, failures = values
+        text = f"请求 {requests} 次，新建连接 {connections} 次(复用 {max(requests - connections, 0)} 次)"
+        if connections:
+            text += f"，TCP连接平均 {connect_time / connections * 1000:.0f}ms"
+        if tls_count:
+            text += f"，TLS握手平均 {tls_time / tls_count * 1000:.0f}ms"
+        if failures:
+            text += f"，连接失败 {failures} 次"
+        return text
+
+    def on_request(self, request):
+        """httpx请求钩子：计数并为本次请求挂上连接阶段的计时回调"""
+        started = {}
+
+        def trace(event, info):
+            stage, _, phase = event.rpartition(".")
+            kind = _TRACE_STAGES.get(stage)
+            if kind is None:
+                return
+            if phase == "started":
+                started[kind] = time.perf_counter()
+                return
+            elapsed = time.perf_counter() - started.pop(kind, time.perf_counter())
+            with self._lock:
+                if phase != "complete":
+                    self.failures += 1
+                elif kind == "connect":
+                    self.connections += 1
+                    self.connect_time += elapsed
+                else:
+                    self.tls_count += 1
+                    self.tls_time += elapsed
+
+        request.extensions["trace"] = trace
+        with self._lock:
+            self.requests += 1
+
+
+# 进程内共享的连接统计
+connection_stats = ConnectionStats()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def ca_bundle():
+    """返回TLS验证使用的CA证书：配置的CA_BUNDLE，其次是certifi附带的证书，都没有时使用系统证书"""
+    if CA_BUNDLE:
+        return CA_BUNDLE
+    return certifi.where() if certifi else True
+
+
+def get_http_client(pool_size=None):
+    """
+    获取进程内共享的HTTP客户端，所有调用方共用同一个客户端和连接池
+
+    参数:
+        pool_size: 连接池最大连接数，一般等于并发请求数；配置了HTTP_POOL_SIZE时以配置为准，
+                   两者都没有时使用BATCH_CONCURRENCY。只在第一次调用、创建客户端时生效
+
+    返回:
+        httpx.Client，可直接传给OpenAI(http_client=...)；调用方不要关闭它
+    """
+    global _client
+    with _client_lock:
+        client = _client
+        if client is None:
+            pool_size = max(1, HTTP_POOL_SIZE or pool_size or BATCH_CONCURRENCY)
+            options = dict(
+                verify=ca_bundle(),
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(**HTTP_TIMEOUTS),
+                event_hooks={"request": [connection_stats.on_request]},
+            )
+            try:
+                client = httpx.Client(http2=HTTP2_ENABLED, **options)
+            except ImportError:
+                # 未安装h2时退回HTTP/1.1，仍然复用长连接
+                print("提示: 未安装h2，使用HTTP/1.1连接(pip install httpx[http2] 可启用HTTP/2)")
+                client = httpx.Client(**options)
+            _client = client
+        return client
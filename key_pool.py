@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+API密钥池
+配置多个密钥(账号)时，每个密钥有独立的限流器，请求按各密钥剩余额度加权分配；
+认证失败或额度用尽的密钥会被停用，运行结束后可输出每个密钥的用量
+"""
+
+import re
+import time
+import random
+import threading
+
+from rate_limiter import get_rate_limiter, is_rate_limit_error, get_retry_after
+from stage_metrics import stage_metrics
+
+# 表示密钥无效或账号额度用尽的HTTP状态码和错误码，出现时停用该密钥
+KEY_ERROR_STATUS = (401, 403)
+KEY_ERROR_CODES = (
+    "invalid_api_key", "InvalidApiKey", "insufficient_quota",
+    "Arrearage", "AccessDenied", "AccessDenied.Unpurchased",
+)
+
+
+def parse_api_keys(text):
+    """把逗号、分号、空白或换行分隔的密钥文本拆成列表，去掉重复项"""
+    if not text:
+        return []
+    if not isinstance(text, str):
+        text = ",".join(text)
+    return list(dict.fromkeys(key for key in re.split(r'[,;\s]+', text) if key))
+
+
+def mask_key(api_key):
+    """只显示密钥最后4位"""
+    if not api_key:
+        return "默认密钥"
+    return "*" * max(len(api_key) - 4, 0) + api_key[-4:]
+
+
+def is_key_error(error):
+    """判断异常是否表示密钥无效或额度用尽(重试也不会成功)"""
+    if getattr(error, 'status_code', None) in KEY_ERROR_STATUS:
+        return True
+    return getattr(error, 'code', None) in KEY_ERROR_CODES
+
+
+class NoUsableKeyError(Exception):
+    """所有密钥都已停用"""
+
+
+class KeyState:
+    """单个密钥的客户端、限流器和用量"""
+
+    def __init__(self, api_key, client, limiter):
+        self.api_key = api_key
+        self.client = client
+        self.limiter = limiter
+        self.requests = 0  # 成功的请求数
+        self.tokens = 0  # API返回的Token用量
+        self.throttled = 0  # 被限流的次数
+        self.errors = 0  # 其他错误次数
+        self.disabled = None  # 停用原因，为None表示可用
+
+    def summary(self):
+        """返回该密钥的用量摘要文本"""
+        text = (f"{mask_key(self.api_key)}: 请求 {self.requests} 次，Token {self.tokens}，"
+                f"限流 {self.throttled} 次，错误 {self.errors} 次")
+        if self.disabled:
+            text += f"，已停用({self.disabled})"
+        return text
+
+
+class KeyPool:
+    """
+    多个API密钥组成的池，线程安全
+
+    每次请求从未停用的密钥中选择：当前有额度的密钥按剩余额度比例随机选择，
+    都没有额度时选择最先恢复的密钥。被限流(429)时换一个密钥重试，
+    密钥无效或额度用尽时停用该密钥并换用其他密钥，最后一个密钥也停用时抛出原异常。
+    """
+
+    def __init__(self, model, clients):
+        """
+        参数:
+            model: 模型名称，用于选择限流配额
+            clients: [(api_key, client)] 列表；只有一个客户端时api_key可以为None，
+                     此时使用模型共享的限流器
+        """
+        if not clients:
+            raise ValueError("至少需要一个API密钥")
+        self.model = model
+        self.keys = [
+            KeyState(api_key, client, get_rate_limiter(model, api_key if len(clients) > 1 else None))
+            for api_key, client in clients
+        ]
+        self._lock = threading.Lock()
+        self._local = threading.local()  # 各线程最近一次请求的耗时
+
+    def for_model(self, model):
+        """用相同的密钥和客户端为另一个模型创建密钥池(限流按该模型的配额)，已停用的密钥不再使用"""
+        return KeyPool(model, [(state.api_key, state.client) for state in self.active_keys()])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def active_keys(self):
+        """返回未停用的密钥"""
+        return [state for state in self.keys if not state.disabled]
+
+    @property
+    def rpm(self):
+        """未停用密钥的每分钟请求数上限之和"""
+        return sum(state.limiter.rpm for state in self.active_keys())
+
+    @property
+    def tpm(self):
+        """未停用密钥的每分钟Token数上限之和"""
+        return sum(state.limiter.tpm for state in self.active_keys())
+
+    @property
+    def throttled_count(self):
+        """所有密钥被限流的总次数"""
+        return sum(state.throttled for state in self.keys)
+
+    def last_request_seconds(self):
+        """
+        当前线程最近一次call中API请求本身的耗时(秒)，不含限流等待和429后的暂停，
+        用于判断服务是否变慢；还没有发出请求时返回None
+        """
+        return getattr(self._local, 'seconds', None)
+
+    def choose(self, tokens=0):
+        """选择下一次请求使用的密钥，没有可用密钥时抛出NoUsableKeyError"""
+        candidates = []
+        for state in self.active_keys():
+            ratio, wait = state.limiter.headroom(tokens)
+            candidates.append((state, ratio, wait))
+        if not candidates:
+            raise NoUsableKeyError("所有API密钥都已停用")
+        ready = [(state, ratio) for state, ratio, wait in candidates if wait <= 0]
+        if not ready:
+            return min(candidates, key=lambda item: item[2])[0]
+        weights = [max(ratio, 0.01) for _, ratio in ready]
+        return random.choices([state for state, _ in ready], weights=weights)[0]
+
+    def call(self, request, tokens=0, should_stop=None, max_retries=5, log=None):
+        """
+        选择密钥并在其限流器的约束下发起请求
+
+        参数:
+            request: 函数request(client)，用选中密钥的客户端发起请求并返回响应
+            tokens: 预计消耗的Token数
+            should_stop: 无参函数，返回True时放弃请求
+            max_retries: 429时的最大重试次数
+            log: 日志函数
+
+        返回:
+            API响应，被停止时返回None
+        """
+        attempt = 0
+        self._local.seconds = None
+        while True:
+            state = self.choose(tokens)
+            started = time.perf_counter()
+            acquired = state.limiter.acquire(tokens, should_stop)
+            stage_metrics.observe("throttle", time.perf_counter() - started)
+            if not acquired:
+                return None
+            started = time.perf_counter()
+            try:
+                response = request(state.client)
+            except Exception as e:
+                self._local.seconds = time.perf_counter() - started
+                stage_metrics.observe("request", self._local.seconds)
+                stage_metrics.incr("api_throttled" if is_rate_limit_error(e) else "api_errors")
+                if is_key_error(e):
+                    self.disable(state, str(e), log)
+                    if not self.active_keys():
+                        raise
+                    continue
+                if not is_rate_limit_error(e) or attempt >= max_retries:
+                    with self._lock:
+                        state.errors += 1
+                    raise
+                attempt += 1
+                with self._lock:
+                    state.throttled += 1
+                pause = state.limiter.on_throttled(get_retry_after(e))
+                if log:
+                    if len(self.keys) > 1:
+                        log(f"密钥 {mask_key(state.api_key)} 触发API限流(429)，暂停{pause:.1f}秒，换用其他密钥重试")
+                    else:
+                        log(f"触发API限流(429)，{pause:.1f}秒后重试，当前速率 {state.limiter.scale:.0%}")
+                continue
+
+            self._local.seconds = time.perf_counter() - started
+            stage_metrics.observe("request", self._local.seconds)
+            stage_metrics.incr("api_requests")
+            state.limiter.on_success()
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                stage_metrics.incr("prompt_tokens", getattr(usage, 'prompt_tokens', None) or 0)
+                stage_metrics.incr("completion_tokens", getattr(usage, 'completion_tokens', None) or 0)
+            total_tokens = getattr(usage, 'total_tokens', None) if usage is not None else None
+            if total_tokens:
+                state.limiter.settle(tokens, total_tokens)
+            with self._lock:
+                state.requests += 1
+                state.tokens += total_tokens or 0
+            return response
+
+    def disable(self, state, reason, log=None):
+        """停用密钥，之后的请求不再使用它"""
+        with self._lock:
+            if state.disabled:
+                return
+            state.disabled = reason
+        if log:
+            log(f"密钥 {mask_key(state.api_key)} 无效或额度已用尽，已停用: {reason}")
+
+    def summary_lines(self):
+        """返回每个密钥的用量摘要"""
+        return [state.summary() for state in self.keys]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+界面日志输出
+工作线程只把日志放入线程安全的队列，由界面线程每隔约100毫秒批量取出并一次性写入文本框；
+文本框只保留最近的若干行，低于当前日志级别的消息(如完整的提示词和API返回内容)直接丢弃
+"""
+
+import queue
+import logging
+from collections import deque
+
+import tkinter as tk
+
+# 日志级别，沿用logging模块的数值
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+# 界面中可选的日志级别
+LOG_LEVELS = {
+    "详细": DEBUG,  # 包含发送的提示词和API返回的完整内容
+    "普通": INFO,
+    "仅警告和错误": WARNING,
+}
+DEFAULT_LOG_LEVEL = "普通"
+
+# 文本框最多保留的行数
+LOG_MAX_LINES = 5000
+
+# 界面线程取出日志的间隔(毫秒)
+LOG_FLUSH_INTERVAL_MS = 100
+
+
+class LogSink:
+    """
+    基于队列的日志输出
+
+    write()可以在任意线程调用；attach()之后由界面线程通过root.after定时把队列中的日志
+    批量写入文本框，每次只插入一次、滚动一次。
+    """
+
+    def __init__(self, level=INFO, max_lines=LOG_MAX_LINES, interval_ms=LOG_FLUSH_INTERVAL_MS):
+        """
+        参数:
+            level: 日志级别，低于该级别的消息被丢弃
+            max_lines: 文本框最多保留的行数
+            interval_ms: 界面线程取出日志的间隔(毫秒)
+        """
+        self.level = level
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self._queue = queue.SimpleQueue()
+        self._root = None
+        self._widget = None
+
+    def write(self, message, level=INFO):
+        """写入一条日志，线程安全"""
+        if level >= self.level:
+            self._queue.put(message)
+
+    def attach(self, root, widget):
+        """
+        开始把日志定时写入文本框
+
+        参数:
+            root: Tk根窗口
+            widget: 显示日志的Text/ScrolledText控件
+        """
+        self._root = root
+        self._widget = widget
+        self._root.after(self.interval_ms, self._poll)
+
+    def _drain(self):
+        """取出队列中的全部日志，只保留最后max_lines条"""
+        lines = deque(maxlen=self.max_lines)
+        while True:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def flush(self):
+        """把队列中的日志写入文本框，只能在界面线程调用"""
+        lines = self._drain()
+        if not lines or self._widget is None:
+            return
+        self._widget.insert(tk.END, "\n".join(lines) + "\n")
+        # 删除超出上限的最早的行
+        line_count = int(self._widget.index("end-1c").split(".")[0]) - 1
+        if line_count > self.max_lines:
+            self._widget.delete("1.0", f"{line_count - self.max_lines + 1}.0")
+        self._widget.see(tk.END)
+
+    def _poll(self):
+        try:
+            self.flush()
+        finally:
+            self._root.after(self.interval_ms, self._poll)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模型健康状态与故障切换
+每个模型一个熔断器，按最近请求的失败率和平均耗时判断是否健康；
+批次请求失败或所用模型已熔断时，改用FALLBACK_MODELS中配置的下一个模型，
+服务商故障时只降低吞吐量，不会让文件处理失败
+"""
+
+import time
+import threading
+from collections import deque
+
+import httpx
+import openai
+
+from config import (
+    CIRCUIT_WINDOW, CIRCUIT_MIN_REQUESTS, CIRCUIT_ERROR_RATE,
+    CIRCUIT_SLOW_SECONDS, CIRCUIT_COOLDOWN
+)
+from ai_providers import ProviderError
+
+# 连接失败、超时等网络错误
+_NETWORK_ERRORS = (openai.APIConnectionError, httpx.TransportError, ConnectionError, TimeoutError)
+
+# 熔断器状态
+CLOSED = "正常"
+OPEN = "熔断"
+HALF_OPEN = "试探"
+
+
+def is_service_error(error):
+    """
+    判断异常是否来自服务商(网络错误或接口返回的错误)，这类错误可以改用其他模型重试；
+    其他异常(如本地代码错误、所有密钥都已停用)直接抛出，不切换模型
+    """
+    return isinstance(error, _NETWORK_ERRORS + (openai.APIError, httpx.HTTPError, ProviderError))
+
+
+def is_health_error(error):
+    """
+    判断异常是否说明服务本身不健康(计入熔断统计)
+
+    网络错误、超时、限流重试耗尽(429)和5xx属于服务故障；
+    其他4xx通常与请求内容或密钥有关，本地异常与服务无关，都不计入。
+    """
+    if isinstance(error, _NETWORK_ERRORS):
+        return True
+    status = getattr(error, 'status_code', None)
+    return is_service_error(error) and status is not None and (status == 429 or status >= 500)
+
+
+class CircuitBreaker:
+    """
+    单个模型的熔断器，线程安全
+
+    最近CIRCUIT_WINDOW次请求中失败比例达到CIRCUIT_ERROR_RATE，或平均耗时超过CIRCUIT_SLOW_SECONDS时熔断，
+    CIRCUIT_COOLDOWN秒内不再使用该模型；冷却后放行一个试探请求，成功则恢复，失败则继续熔断。
+    """
+
+    def __init__(self, model, window=CIRCUIT_WINDOW, min_requests=CIRCUIT_MIN_REQUESTS,
+                 error_rate=CIRCUIT_ERROR_RATE, slow_seconds=CIRCUIT_SLOW_SECONDS, cooldown=CIRCUIT_COOLDOWN):
+        self.model = model
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)  # 最近请求的 (是否成功, 耗时)
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.trip_count = 0  # 熔断次数
+        self._probing = False
+
+    def allow(self):
+        """当前是否可以向该模型发送请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                # 冷却结束，只放行一个试探请求
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok, latency):
+        """
+        记录一次请求的结果
+
+        参数:
+            ok: 是否成功
+            latency: 耗时(秒)
+
+        返回:
+            本次记录导致熔断时返回熔断原因，否则返回None
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if ok and latency < self.slow_seconds:
+                    self.state = CLOSED
+                    self._results.clear()
+                    self._results.append((ok, latency))
+                    return None
+                return self._trip("试探请求失败" if not ok else f"试探请求耗时 {latency:.1f} 秒")
+            self._results.append((ok, latency))
+            if self.state != CLOSED or len(self._results) < self.min_requests:
+                return None
+            failures = sum(1 for result_ok, _ in self._results if not result_ok)
+            if failures / len(self._results) >= self.error_rate:
+                return self._trip(f"最近 {len(self._results)} 次请求失败 {failures} 次")
+            latencies = [elapsed for result_ok, elapsed in self._results if result_ok]
+            if latencies and sum(latencies) / len(latencies) > self.slow_seconds:
+                return self._trip(f"平均耗时 {sum(latencies) / len(latencies):.1f} 秒")
+            return None
+
+    def release(self):
+        """试探请求被放弃(如任务停止)时调用，允许下一个请求继续试探"""
+        with self._lock:
+            self._probing = False
+
+    def _trip(self, reason):
+        """进入熔断状态(调用方持有锁)"""
+        self.state = OPEN
+        self.open_until = time.monotonic() + self.cooldown
+        self.trip_count += 1
+        self._results.clear()
+        return reason
+
+    def retry_in(self):
+        """熔断状态下距离可以试探还有多少秒"""
+        with self._lock:
+            return max(0.0, self.open_until - time.monotonic()) if self.state == OPEN else 0.0
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model):
+    """获取模型共享的熔断器，同一进程中同一模型的所有任务共用健康状态"""
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(model)
+            _breakers[model] = breaker
+        return breaker
+
+
+class Route:
+    """故障切换链中的一个模型及其本次任务的统计"""
+
+    def __init__(self, model, client):
+        """
+        参数:
+            model: 模型名称
+            client: 该模型使用的客户端(KeyPool)
+        """
+        self.model = model
+        self.client = client
+        self.breaker = get_circuit_breaker(model)
+        self.requests = 0  # 成功的请求数
+        self.failures = 0  # 失败的请求数
+        self.latency = 0.0  # 成功请求的总耗时(秒)
+
+    def summary(self):
+        """返回本次任务中该模型的统计文本"""
+        text = f"{self.model}: 成功 {self.requests} 次，失败 {self.failures} 次"
+        if self.requests:
+            text += f"，平均耗时 {self.latency / self.requests:.1f} 秒"
+        if self.breaker.state != CLOSED:
+            text += f"，当前状态: {self.breaker.state}"
+        return text
+
+
+class FailoverRouter:
+    """
+    按顺序尝试故障切换链中的模型，线程安全
+
+    已熔断的模型直接跳过；全部熔断时使用最先结束冷却的模型。
+    服务商返回错误或网络出错时依次改用下一个模型，最后一个模型也失败时抛出异常；
+    本地代码错误等其他异常直接抛出，不切换模型。
+    """
+
+    def __init__(self, routes, log=None):
+        """
+        参数:
+            routes: [Route]，第一个为首选模型
+            log: 日志函数
+        """
+        self.routes = routes
+        self.log = log or (lambda message: None)
+        self._lock = threading.Lock()
+        self.failovers = 0  # 改用其他模型的次数
+
+    def call(self, request):
+        """
+        发起请求，失败时切换模型
+
+        参数:
+            request: 函数request(route)，使用route.client和route.model发起请求；被停止时返回None
+
+        返回:
+            request的返回值
+        """
+        last_error = None
+        tried = False
+        for route in self.routes:
+            # 逐个检查，只有真正尝试的模型才会占用试探机会
+            if not route.breaker.allow():
+                continue
+            tried = True
+            if last_error is not None:
+                with self._lock:
+                    self.failovers += 1
+                self.log(f"改用模型 {route.model} 重试")
+            try:
+                return self._attempt(route, request)
+            except Exception as e:
+                if not is_service_error(e):
+                    raise
+                self.log(f"模型 {route.model} 请求失败: {e}")
+                last_error = e
+        if not tried:
+            # 全部熔断时使用最先结束冷却的模型
+            return self._attempt(min(self.routes, key=lambda route: route.breaker.retry_in()), request)
+        raise last_error
+
+    def _attempt(self, route, request):
+        """向一个模型发起请求并记录结果"""
+        started = time.monotonic()
+        try:
+            result = request(route)
+        except Exception as e:
+            with self._lock:
+                route.failures += 1
+            if is_health_error(e):
+                self._record(route, False, self._elapsed(route, started))
+            else:
+                route.breaker.release()
+            raise
+        if result is None:
+            route.breaker.release()
+            return None
+        elapsed = self._elapsed(route, started)
+        with self._lock:
+            route.requests += 1
+            route.latency += elapsed
+        self._record(route, True, elapsed)
+        return result
+
+    @staticmethod
+    def _elapsed(route, started):
+        """
+        请求耗时：使用KeyPool记录的API请求本身的耗时，限流等待和429后的暂停不算作服务变慢；
+        客户端没有记录时按整个调用计算
+        """
+        last_request_seconds = getattr(route.client, 'last_request_seconds', None)
+        seconds = last_request_seconds() if last_request_seconds else None
+        return seconds if seconds is not None else time.monotonic() - started
+
+    def _record(self, route, ok, elapsed):
+        """记录请求结果，模型因此熔断时输出日志"""
+        reason = route.breaker.record(ok, elapsed)
+        if reason:
+            self.log(f"模型 {route.model} 已熔断({reason})，{route.breaker.cooldown} 秒内优先使用其他模型")
+
+    def summary_lines(self):
+        """返回每个模型的统计文本"""
+        return [route.summary() for route in self.routes]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+同名文件去重
+包含子目录时，不同目录中常有大量同名文件(cover.jpg、01.mp4、相机默认文件名等)。
+按规范化后的文件名(不含扩展名，可选再加文件内容哈希)分组，每组只请求一次API，
+结果分发给组内所有文件；同一目录中的重名仍由NameIndex追加后缀解决
+"""
+
+import os
+import hashlib
+
+from response_cache import normalize_name
+
+# 计算内容哈希时每次读取的字节数
+_HASH_CHUNK = 1024 * 1024
+
+
+def content_hash(path):
+    """计算文件内容的哈希值"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _Group:
+    """一组同名文件：第一个文件负责请求API，其余文件等待结果"""
+
+    __slots__ = ("leader", "result", "followers")
+
+    def __init__(self, leader):
+        self.leader = leader  # 负责请求API的文件路径
+        self.result = None  # AI返回的新文件名，收到前为None
+        self.followers = []  # 等待结果的文件信息
+
+
+class NameDeduper:
+    """
+    同名文件分组，只在处理线程中使用(不加锁)
+
+    用法：扫描到的文件先调用add，需要请求API的文件照常打包；
+    该文件得到新文件名后调用resolve取出等待中的同组文件，请求失败时调用drop。
+    """
+
+    def __init__(self, by_content=False, on_error=None):
+        """
+        参数:
+            by_content: 为True时只有文件名和内容都相同的文件才合并(需要读取文件内容)
+            on_error: 函数on_error(path, exception)，读取文件失败时调用
+        """
+        self.by_content = by_content
+        self.on_error = on_error
+        self._groups = {}  # 分组键 -> _Group
+        self._leaders = {}  # 负责请求的文件路径 -> 分组键
+        self.shared_count = 0  # 直接使用同组结果、没有单独请求API的文件数
+
+    def key_of(self, info):
+        """返回文件的分组键，无法计算时返回None(该文件单独请求)"""
+        path, name, _ = info
+        stem = normalize_name(os.path.splitext(name)[0])
+        if not self.by_content:
+            return stem
+        try:
+            return stem, content_hash(path)
+        except OSError as e:
+            if self.on_error:
+                self.on_error(path, e)
+            return None
+
+    def add(self, info):
+        """
+        登记扫描到的文件
+
+        参数:
+            info: (路径, 文件名, 相对目录)
+
+        返回:
+            (是否需要请求API, 已有的新文件名)；不需要请求且新文件名为None时，
+            文件已加入等待列表，由之后的resolve返回
+        """
+        key = self.key_of(info)
+        if key is None:
+            return True, None
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = _Group(info[0])
+            self._leaders[info[0]] = key
+            return True, None
+        if group.result is not None:
+            self.shared_count += 1
+            return False, group.result
+        group.followers.append(info)
+        return False, None
+
+    def resolve(self, path, new_name):
+        """
+        负责请求的文件得到了新文件名
+
+        返回:
+            等待该结果的文件信息列表
+        """
+        key = self._leaders.get(path)
+        if key is None:
+            return []
+        group = self._groups[key]
+        group.result = new_name
+        followers, group.followers = group.followers, []
+        self.shared_count += len(followers)
+        return followers
+
+    def drop(self, path):
+        """
+        负责请求的文件最终没有得到结果，解散该组，之后扫描到的同名文件重新单独请求
+
+        返回:
+            等待该结果的文件信息列表
+        """
+        key = self._leaders.pop(path, None)
+        if key is None:
+            return []
+        group = self._groups.pop(key)
+        return group.followers
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+目录文件名索引与不覆盖重命名
+在内存中记录每个目录现有的名称，冲突时按 名称_1、名称_2... 的顺序确定性地追加后缀，
+不再对每个候选名称调用os.path.exists；最终重命名使用原子的"不覆盖"操作兜底
+"""
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import threading
+
+from stage_metrics import stage_metrics
+
+# Windows和macOS的默认文件系统不区分大小写
+_CASE_INSENSITIVE = sys.platform in ('win32', 'darwin')
+
+# renameat2的参数
+_AT_FDCWD = -100
+_RENAME_NOREPLACE = 1
+
+
+def _name_key(name):
+    return name.casefold() if _CASE_INSENSITIVE else name
+
+
+def _load_renameat2():
+    """加载Linux的renameat2，不可用时返回None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        func = libc.renameat2
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    func.restype = ctypes.c_int
+    return func
+
+
+_renameat2 = _load_renameat2()
+
+
+def rename_noreplace(src, dst, src_dir_fd=None, dst_dir_fd=None):
+    """
+    重命名文件，目标已存在时抛出FileExistsError而不是覆盖
+
+    Linux上使用renameat2(RENAME_NOREPLACE)原子完成；Windows的os.rename本身不会覆盖；
+    其他情况(或文件系统不支持该标志时)先建立硬链接再删除原名，最后退回到检查后重命名。
+    大小写不敏感的文件系统上只改大小写(如"photo.JPG"改为"Photo.jpg")时目标就是原文件本身，直接重命名。
+
+    参数:
+        src: 原路径(提供src_dir_fd时为相对该目录的名称)
+        dst: 目标路径(提供dst_dir_fd时为相对该目录的名称)
+        src_dir_fd: 原路径所在目录的文件描述符
+        dst_dir_fd: 目标路径所在目录的文件描述符
+    """
+    if _renameat2 is not None:
+        result = _renameat2(
+            _AT_FDCWD if src_dir_fd is None else src_dir_fd, os.fsencode(src),
+            _AT_FDCWD if dst_dir_fd is None else dst_dir_fd, os.fsencode(dst),
+            _RENAME_NOREPLACE,
+        )
+        if result == 0:
+            return
+        err = ctypes.get_errno()
+        if err == errno.EEXIST and _case_only_rename(src, dst, src_dir_fd, dst_dir_fd):
+            os.rename(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+            return
+        if err not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP):
+            raise OSError(err, os.strerror(err), src, None, dst)
+
+    if os.name == 'nt':
+        os.rename(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+        return
+
+    try:
+        os.link(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd, follow_symlinks=False)
+    except FileExistsError:
+        if not _case_only_rename(src, dst, src_dir_fd, dst_dir_fd):
+            raise
+        os.rename(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+        return
+    except (OSError, NotImplementedError):
+        # 文件系统不支持硬链接(如FAT、部分网络共享)
+        if (os.path.lexists(dst if dst_dir_fd is None else _fd_path(dst_dir_fd, dst))
+                and not _case_only_rename(src, dst, src_dir_fd, dst_dir_fd)):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+        return
+    os.unlink(src, dir_fd=src_dir_fd)
+
+
+def _case_only_rename(src, dst, src_dir_fd=None, dst_dir_fd=None):
+    """原路径和目标只有大小写不同，且指向同一个文件(大小写不敏感的文件系统)"""
+    if src == dst or src.casefold() != dst.casefold():
+        return False
+    try:
+        src_stat = os.stat(src, dir_fd=src_dir_fd, follow_symlinks=False)
+        dst_stat = os.stat(dst, dir_fd=dst_dir_fd, follow_symlinks=False)
+    except OSError:
+        return False
+    return (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino)
+
+
+def _fd_path(dir_fd, name):
+    """把 目录描述符+名称 转成可用于os.path函数的路径"""
+    return os.path.join(f"/proc/self/fd/{dir_fd}", name)
+
+
+class NameIndex:
+    """
+    按目录记录现有名称的索引，线程安全
+
+    目录的名称集合可以由扫描阶段直接登记，未登记的目录在第一次使用时列出一次。
+    """
+
+    def __init__(self):
+        self._dirs = {}
+        self._next_suffix = {}  # (目录, 期望名称) -> 下次尝试的后缀编号，大量同名时不必每次从 _1 开始找
+        self._lock = threading.Lock()
+
+    def add_directory(self, dir_path, names):
+        """登记目录中现有的全部名称(文件和子目录)"""
+        with self._lock:
+            self._dirs[dir_path] = {_name_key(name) for name in names}
+
+    def _names(self, dir_path):
+        names = self._dirs.get(dir_path)
+        if names is None:
+            try:
+                names = {_name_key(name) for name in os.listdir(dir_path)}
+            except OSError:
+                names = set()
+            self._dirs[dir_path] = names
+        return names
+
+    def add(self, dir_path, name):
+        """记录目录中新出现的名称(例如重命名时发现的外部文件)"""
+        with self._lock:
+            self._names(dir_path).add(_name_key(name))
+
+    def resolve(self, dir_path, new_name, old_name=None):
+        """
+        为重命名确定不冲突的目标名称并预留
+
+        参数:
+            dir_path: 文件所在目录
+            new_name: 期望的新名称
+            old_name: 文件当前的名称，新名称与之相同时不需要重命名
+
+        返回:
+            预留的目标名称；与当前名称相同时返回None
+        """
+        with self._lock:
+            names = self._names(dir_path)
+            if new_name == old_name:
+                return None
+            if old_name is not None and _name_key(new_name) == _name_key(old_name):
+                # 不区分大小写的文件系统上仅修改大小写，目标就是文件自身
+                return new_name
+            candidate = new_name
+            if _name_key(candidate) in names:
+                base_name, ext = os.path.splitext(new_name)
+                suffix_key = (dir_path, _name_key(new_name))
+                counter = self._next_suffix.get(suffix_key, 1)
+                while True:
+                    candidate = f"{base_name}_{counter}{ext}"
+                    if _name_key(candidate) not in names:
+                        break
+                    counter += 1
+                self._next_suffix[suffix_key] = counter + 1
+            names.add(_name_key(candidate))
+            return candidate
+
+    def release(self, dir_path, name):
+        """释放预留但未使用的名称"""
+        with self._lock:
+            self._names(dir_path).discard(_name_key(name))
+
+    def commit(self, dir_path, old_name, new_name):
+        """重命名成功后更新索引：移除旧名称(新名称已在resolve时预留)"""
+        with self._lock:
+            names = self._names(dir_path)
+            if _name_key(old_name) != _name_key(new_name):
+                names.discard(_name_key(old_name))
+            names.add(_name_key(new_name))
+
+    def rename(self, old_path, new_name, max_conflicts=10, dir_fd=None):
+        """
+        把文件重命名为不冲突的名称
+
+        参数:
+            old_path: 文件的完整路径
+            new_name: 期望的新名称
+            max_conflicts: 索引之外的文件导致冲突时最多重试的次数
+            dir_fd: 文件所在目录的文件描述符，提供时按目录内的名称重命名，省去路径解析
+
+        返回:
+            实际使用的新名称；与当前名称相同时返回None
+        """
+        dir_path, old_name = os.path.split(old_path)
+        for _ in range(max_conflicts):
+            started = time.perf_counter()
+            final_name = self.resolve(dir_path, new_name, old_name)
+            renaming = time.perf_counter()
+            stage_metrics.observe("collision", renaming - started)
+            if final_name is None:
+                return None
+            try:
+                if dir_fd is None:
+                    rename_noreplace(old_path, os.path.join(dir_path, final_name))
+                else:
+                    rename_noreplace(old_name, final_name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+            except FileExistsError:
+                # 索引之外出现了同名文件(例如其他程序刚创建)，该名称保持占用，换下一个后缀
+                continue
+            except Exception:
+                if _name_key(final_name) != _name_key(old_name):
+                    self.release(dir_path, final_name)
+                raise
+            finally:
+                stage_metrics.observe("rename", time.perf_counter() - renaming)
+            self.commit(dir_path, old_name, final_name)
+            return final_name
+        raise FileExistsError(errno.EEXIST, f"无法为 '{old_name}' 找到不冲突的新文件名", old_path)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+API自适应限流器
+按模型配置每分钟请求数(RPM)和每分钟Token数(TPM)的令牌桶，
+遇到429/Retry-After时自动退避，API恢复正常后逐步提升速率
+"""
+
+import re
+import time
+import threading
+
+from config import RATE_LIMITS, DEFAULT_RATE_LIMIT
+from stage_metrics import stage_metrics
+
+# 令牌桶最多允许积攒多少秒的额度，决定突发请求的上限
+BURST_SECONDS = 10
+
+# 每次被限流后速率缩放系数的变化：乘性减小，加性恢复
+THROTTLE_FACTOR = 0.5
+RAMP_UP_STEP = 0.05
+MIN_SCALE = 0.05
+
+# 没有Retry-After时的退避时间上限(秒)
+MAX_BACKOFF = 60
+
+# 等待额度时的最长单次睡眠，保证"停止"能及时生效
+MAX_SLEEP = 0.5
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的Token数量
+
+    中日韩字符大约每字1个Token，其他字符大约每4个字符1个Token
+
+    参数:
+        text: 文本
+
+    返回:
+        估算的Token数量
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenBucket:
+    """令牌桶，按每分钟的额度匀速补充"""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now, scale):
+        """按经过的时间补充额度，scale为当前的速率缩放系数"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def time_until(self, amount, scale):
+        """返回额度足够取出amount还需等待的秒数"""
+        # 单次需求超过桶容量时只要求桶满，避免永远等不到
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.rate * scale)
+
+
+class RateLimiter:
+    """
+    单个模型的自适应限流器，线程安全
+
+    同时受请求数和Token数两个令牌桶约束。被限流时速率减半并暂停到Retry-After指定的时间，
+    之后每次成功的请求都会把速率往配置值方向恢复一点。
+    """
+
+    def __init__(self, rpm, tpm):
+        """
+        初始化限流器
+
+        参数:
+            rpm: 每分钟请求数上限
+            tpm: 每分钟Token数上限
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.throttled_count = 0
+        self._consecutive_throttles = 0
+
+    def acquire(self, tokens=0, should_stop=None):
+        """
+        阻塞直到可以发起一次请求
+
+        参数:
+            tokens: 本次请求预计消耗的Token数
+            should_stop: 无参函数，返回True时放弃等待
+
+        返回:
+            取得额度返回True，被停止返回False
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    self._requests.refill(now, self.scale)
+                    self._tokens.refill(now, self.scale)
+                    wait = max(self._requests.time_until(1, self.scale),
+                               self._tokens.time_until(tokens, self.scale))
+                    if wait <= 0:
+                        self._requests.level -= 1
+                        self._tokens.level -= tokens
+                        return True
+            if should_stop and should_stop():
+                return False
+            time.sleep(min(wait, MAX_SLEEP))
+
+    def headroom(self, tokens=0):
+        """
+        查看当前剩余额度，不取出
+
+        参数:
+            tokens: 下一次请求预计消耗的Token数
+
+        返回:
+            (剩余额度比例0-1, 取得额度还需等待的秒数)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now, self.scale)
+            self._tokens.refill(now, self.scale)
+            ratio = max(0.0, min(self._requests.level / self._requests.capacity,
+                                 self._tokens.level / self._tokens.capacity)) * self.scale
+            wait = max(self.paused_until - now,
+                       self._requests.time_until(1, self.scale),
+                       self._tokens.time_until(tokens, self.scale))
+            return ratio, max(wait, 0.0)
+
+    def settle(self, estimated, actual):
+        """用API返回的实际Token用量修正预估值"""
+        with self._lock:
+            self._tokens.level -= actual - estimated
+
+    def on_success(self):
+        """请求成功，逐步恢复速率"""
+        with self._lock:
+            self._consecutive_throttles = 0
+            self.scale = min(1.0, self.scale + RAMP_UP_STEP)
+
+    def on_throttled(self, retry_after=None):
+        """
+        请求被限流，降低速率并暂停
+
+        参数:
+            retry_after: 服务端要求的等待秒数，没有时使用指数退避
+
+        返回:
+            本次暂停的秒数
+        """
+        with self._lock:
+            self.throttled_count += 1
+            self._consecutive_throttles += 1
+            self.scale = max(MIN_SCALE, self.scale * THROTTLE_FACTOR)
+            if retry_after is None:
+                retry_after = min(MAX_BACKOFF, 2 ** self._consecutive_throttles)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            return retry_after
+
+
+def is_rate_limit_error(error):
+    """判断异常是否为429限流错误"""
+    return getattr(error, 'status_code', None) == 429
+
+
+def get_retry_after(error):
+    """从异常附带的HTTP响应中读取Retry-After(秒)，没有时返回None"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    for name in ('retry-after-ms', 'retry-after'):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if name == 'retry-after-ms' else seconds
+    return None
+
+
+def call_with_rate_limit(limiter, request, tokens=0, should_stop=None, max_retries=5, log=None):
+    """
+    在限流器的约束下调用API，遇到429时退避重试
+
+    参数:
+        limiter: RateLimiter实例
+        request: 无参函数，实际发起请求并返回响应
+        tokens: 预计消耗的Token数
+        should_stop: 无参函数，返回True时放弃请求
+        max_retries: 429时的最大重试次数
+        log: 日志函数，用于输出限流信息
+
+    返回:
+        API响应，被停止时返回None
+    """
+    for attempt in range(max_retries + 1):
+        started = time.perf_counter()
+        acquired = limiter.acquire(tokens, should_stop)
+        stage_metrics.observe("throttle", time.perf_counter() - started)
+        if not acquired:
+            return None
+        started = time.perf_counter()
+        try:
+            response = request()
+        except Exception as e:
+            stage_metrics.observe("request", time.perf_counter() - started)
+            stage_metrics.incr("api_throttled" if is_rate_limit_error(e) else "api_errors")
+            if not is_rate_limit_error(e) or attempt >= max_retries:
+                raise
+            pause = limiter.on_throttled(get_retry_after(e))
+            if log:
+                log(f"触发API限流(429)，{pause:.1f}秒后重试，当前速率 {limiter.scale:.0%}")
+            continue
+
+        stage_metrics.observe("request", time.perf_counter() - started)
+        stage_metrics.incr("api_requests")
+        limiter.on_success()
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            stage_metrics.incr("prompt_tokens", getattr(usage, 'prompt_tokens', None) or 0)
+            stage_metrics.incr("completion_tokens", getattr(usage, 'completion_tokens', None) or 0)
+        if usage is not None and getattr(usage, 'total_tokens', None):
+            limiter.settle(tokens, usage.total_tokens)
+        return response
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model, api_key=None):
+    """
+    获取模型共享的限流器，同一进程中同一模型(和密钥)的所有调用共用一个实例
+
+    参数:
+        model: 模型名称
+        api_key: 使用多个密钥时传入，每个密钥(账号)有独立的配额和限流器
+
+    返回:
+        RateLimiter实例
+    """
+    key = model if api_key is None else (model, api_key)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limits = RATE_LIMITS.get(model, DEFAULT_RATE_LIMIT)
+            limiter = RateLimiter(limits["rpm"], limits["tpm"])
+            _limiters[key] = limiter
+        return limiter
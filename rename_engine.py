@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量重命名并发执行引擎
+同时保持多个批次的API请求在途，按完成顺序把结果交给重命名步骤
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 默认同时在途的批次数量
+DEFAULT_CONCURRENCY = 4
+
+# 等待结果时的轮询间隔(秒)，决定了响应"停止"的及时程度
+POLL_INTERVAL = 0.2
+
+
+class BatchEngine:
+    """
+    并发批处理引擎
+
+    request_fn在线程池中执行(通常是调用API)，on_result/on_error始终在调用run()的线程中
+    依次执行，因此重命名等文件操作不需要额外加锁。
+    """
+
+    def __init__(self, request_fn, concurrency=DEFAULT_CONCURRENCY, dispatch_interval=0, should_stop=None):
+        """
+        初始化引擎
+
+        参数:
+            request_fn: 处理单个批次的函数 request_fn(batch) -> result，在工作线程中执行
+            concurrency: 同时在途的最大批次数量
+            dispatch_interval: 相邻两次发起请求之间的最小间隔(秒)
+            should_stop: 无参函数，返回True时停止调度新批次并丢弃未处理的结果
+        """
+        self.request_fn = request_fn
+        self.concurrency = max(1, int(concurrency))
+        self.dispatch_interval = dispatch_interval
+        self.should_stop = should_stop or (lambda: False)
+        self._requeued = deque()
+
+    def requeue(self, batch):
+        """
+        把批次重新放回调度队列，优先于批次来源中的新批次发出
+
+        只能在on_result/on_error回调中调用，例如把解析失败的文件单独重新请求。
+        """
+        self._requeued.append(batch)
+
+    def run(self, batches, on_result, on_error=None):
+        """
+        执行所有批次
+
+        参数:
+            batches: 批次的可迭代对象，可以是生成器，引擎只在有空闲名额时才取下一个批次；
+                     产出None表示暂时没有可用批次，引擎会稍后再取
+            on_result: 批次成功时的回调 on_result(batch, result)
+            on_error: 批次失败时的回调 on_error(batch, exception)，为None时直接抛出异常
+
+        返回:
+            成功完成的批次数量
+        """
+        batch_iter = iter(batches)
+        in_flight = {}
+        completed = 0
+        exhausted = False
+        next_dispatch = 0.0
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="rename-batch")
+        try:
+            while True:
+                # 补满在途名额
+                timeout = POLL_INTERVAL
+                while len(in_flight) < self.concurrency and not self.should_stop():
+                    now = time.monotonic()
+                    if now < next_dispatch:
+                        timeout = min(timeout, next_dispatch - now)
+                        break
+                    if self._requeued:
+                        batch = self._requeued.popleft()
+                    elif exhausted:
+                        break
+                    else:
+                        try:
+                            batch = next(batch_iter)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        if batch is None:
+                            # 批次来源暂时没有新批次(例如目录仍在扫描)，先去处理已完成的结果；
+                            # 来源本身已等待过，没有在途批次时不再额外睡眠
+                            if not in_flight:
+                                timeout = 0
+                            break
+                    in_flight[executor.submit(self.request_fn, batch)] = batch
+                    next_dispatch = now + self.dispatch_interval
+
+                if self.should_stop() or (exhausted and not in_flight and not self._requeued):
+                    break
+                if not in_flight:
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    if self.should_stop():
+                        continue
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if on_error is None:
+                            raise
+                        on_error(batch, e)
+                        continue
+                    on_result(batch, result)
+                    completed += 1
+        finally:
+            # 停止时取消尚未开始的请求，不等待正在进行的请求
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return completed
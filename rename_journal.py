@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+重命名日志与批量撤销
+每次运行把 原路径 -> 新路径 逐条追加到JSONL日志中(按批写入磁盘)，
+撤销时倒序重放日志，一次遍历完成，遇到冲突的文件跳过并报告，不会覆盖任何文件
+"""
+
+import os
+import json
+import time
+
+from config import JOURNAL_DIR, JOURNAL_SYNC_EVERY, TRACK_RENAMED_FILES
+from name_index import rename_noreplace
+from rename_ledger import RenameLedger
+
+# 已撤销的日志追加此后缀，避免重复撤销
+UNDONE_SUFFIX = ".undone"
+
+
+class RenameJournal:
+    """
+    单次运行的重命名日志
+
+    每条记录写入文件缓冲区，每JOURNAL_SYNC_EVERY条或调用sync()时flush并fsync，
+    调用方通常在每个批次重命名完成后调用一次sync()。
+    track_renamed为True时同时把新文件记入已改名文件记录(RenameLedger)，之后扫描时跳过。
+    """
+
+    def __init__(self, folder_path, directory=JOURNAL_DIR, sync_every=JOURNAL_SYNC_EVERY,
+                 track_renamed=TRACK_RENAMED_FILES):
+        """
+        参数:
+            folder_path: 本次处理的文件夹，记录在日志头部
+            directory: 日志文件所在目录
+            sync_every: 每记录多少条强制写入磁盘一次
+            track_renamed: 是否把重命名产生的文件记入已改名文件记录
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(directory, f"rename_{stamp}_{os.getpid()}.jsonl")
+        self.sync_every = max(1, sync_every)
+        self.count = 0  # 已记录的重命名数
+        self._unsynced = 0
+        self.ledger = RenameLedger() if track_renamed else None
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps({"t": "job", "folder": os.path.abspath(folder_path), "time": time.time()},
+                                    ensure_ascii=False) + "\n")
+
+    def record(self, old_path, new_path):
+        """记录一次成功的重命名"""
+        if self._file is None:
+            return
+        self._file.write(json.dumps({"old": old_path, "new": new_path}, ensure_ascii=False) + "\n")
+        if self.ledger:
+            self.ledger.record(new_path)
+        self.count += 1
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """把已记录的内容写入磁盘"""
+        if self._file is None or not self._unsynced:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if self.ledger:
+            self.ledger.sync()
+        self._unsynced = 0
+
+    def close(self):
+        """写入磁盘并关闭；没有任何重命名时删除空日志"""
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+        if self.ledger:
+            self.ledger.close()
+        if not self.count:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def read_journal(path):
+    """
+    读取日志
+
+    返回:
+        (文件夹路径, [(原路径, 新路径), ...])；中断时写了一半的最后一行会被忽略
+    """
+    folder = None
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("t") == "job":
+                folder = record.get("folder")
+            elif "old" in record and "new" in record:
+                entries.append((record["old"], record["new"]))
+    return folder, entries
+
+
+def list_journals(directory=JOURNAL_DIR, folder_path=None):
+    """
+    列出尚未撤销的日志，按时间从新到旧排列
+
+    参数:
+        directory: 日志文件所在目录
+        folder_path: 只返回处理该文件夹的日志，为None时返回全部
+    """
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(".jsonl")]
+    except FileNotFoundError:
+        return []
+    paths = sorted((os.path.join(directory, name) for name in names), key=os.path.getmtime, reverse=True)
+    if folder_path is None:
+        return paths
+    folder_path = os.path.abspath(folder_path)
+    return [path for path in paths if read_journal(path)[0] == folder_path]
+
+
+def latest_journal(directory=JOURNAL_DIR, folder_path=None):
+    """返回最近一次未撤销的日志路径，没有时返回None"""
+    journals = list_journals(directory, folder_path)
+    return journals[0] if journals else None
+
+
+class UndoResult:
+    """撤销结果统计"""
+
+    def __init__(self):
+        self.restored = 0  # 成功恢复的文件数
+        self.missing = []  # 新路径已不存在的文件(已被移动或删除)
+        self.conflicts = []  # 原路径已被其他文件占用的文件
+        self.failed = []  # 其他错误 (新路径, 错误信息)
+
+    def summary(self):
+        """返回统计摘要文本"""
+        text = (f"已恢复 {self.restored} 个文件，找不到 {len(self.missing)} 个，"
+                f"原名称被占用 {len(self.conflicts)} 个，失败 {len(self.failed)} 个")
+        if self.missing or self.conflicts or self.failed:
+            text += "；未恢复的文件保留在日志中，处理后可以再次撤销"
+        return text
+
+
+def undo_journal(path, log=None, track_renamed=TRACK_RENAMED_FILES):
+    """
+    倒序重放日志，把文件改回原名称
+
+    每个文件只调用一次不覆盖的重命名，由系统调用的错误码区分冲突和缺失，
+    不必事先逐个检查路径。全部恢复后日志改名为 *.undone，避免重复撤销；
+    有文件未能恢复时日志只保留这些文件，处理冲突后可以再次撤销。
+
+    参数:
+        path: 日志文件路径
+        log: 输出进度信息的函数
+        track_renamed: 是否从已改名文件记录中删除恢复的文件，之后扫描时重新处理
+
+    返回:
+        UndoResult
+    """
+    log = log or (lambda message: None)
+    folder, entries = read_journal(path)
+    result = UndoResult()
+    restored = set()  # 已恢复的记录序号
+    ledger = RenameLedger() if track_renamed else None
+    try:
+        _undo_entries(entries, result, log, ledger, restored)
+    finally:
+        if ledger:
+            ledger.close()
+        remaining = [entry for index, entry in enumerate(entries) if index not in restored]
+        if remaining:
+            _rewrite_journal(path, folder, remaining)
+        else:
+            os.replace(path, path + UNDONE_SUFFIX)
+    return result
+
+
+def _rewrite_journal(path, folder, entries):
+    """只保留尚未恢复的记录(先写临时文件再替换)"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"t": "job", "folder": folder, "time": time.time()}, ensure_ascii=False) + "\n")
+        for old_path, new_path in entries:
+            f.write(json.dumps({"old": old_path, "new": new_path}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _undo_entries(entries, result, log, ledger, restored):
+    """倒序恢复每个文件的原名称，把恢复成功的记录序号加入restored"""
+    for index in range(len(entries) - 1, -1, -1):
+        old_path, new_path = entries[index]
+        try:
+            rename_noreplace(new_path, old_path)
+        except FileExistsError:
+            result.conflicts.append(new_path)
+            log(f"冲突：原名称已被占用，跳过: {old_path}")
+            continue
+        except FileNotFoundError:
+            result.missing.append(new_path)
+            log(f"找不到文件，跳过: {new_path}")
+            continue
+        except OSError as e:
+            result.failed.append((new_path, str(e)))
+            log(f"恢复失败: {new_path} - {e}")
+            continue
+        restored.add(index)
+        if ledger:
+            ledger.forget(old_path)
+        result.restored += 1
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+已改名文件记录
+记录本工具重命名产生的每个文件(设备号+inode，以及大小和修改时间)，扫描时跳过这些文件，
+重复处理同一文件夹不会把已经改好的名称再改一遍；文件被移动到同一文件系统的其他目录后仍能识别。
+可选在文件上写入扩展属性(xattr)标记，复制到其他磁盘(保留扩展属性)后也能识别
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from config import RENAMED_LEDGER_PATH, RENAMED_XATTR
+
+# 扩展属性标记的名称
+XATTR_NAME = "user.ali_ai.renamed"
+
+# SQLite单条语句的参数个数有上限，批量查询时分段进行
+_QUERY_CHUNK = 500
+
+
+def _xattr_supported():
+    return hasattr(os, 'setxattr') and hasattr(os, 'getxattr')
+
+
+def has_xattr_tag(path):
+    """文件是否带有本工具写入的扩展属性标记"""
+    try:
+        return os.getxattr(path, XATTR_NAME) == b"1"
+    except OSError:
+        return False
+
+
+class RenameLedger:
+    """
+    基于SQLite的已改名文件记录，线程安全
+
+    重命名后调用record，撤销后调用forget，扫描时用renamed_names筛掉已改名的文件。
+    """
+
+    def __init__(self, path=RENAMED_LEDGER_PATH, use_xattr=RENAMED_XATTR):
+        """
+        打开(或创建)记录数据库
+
+        参数:
+            path: 数据库文件路径
+            use_xattr: 是否同时在文件上写入扩展属性标记(仅Linux等支持xattr的系统)
+        """
+        self.path = path
+        self.use_xattr = use_xattr and _xattr_supported()
+        self._lock = threading.Lock()
+        self.skipped = 0  # 扫描时跳过的已改名文件数
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS renamed (
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (dev, inode)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_renamed_inode ON renamed(inode)")
+        self._conn.commit()
+
+    def record(self, path):
+        """记录重命名产生的文件(在sync或close时写入磁盘)"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO renamed (dev, inode, size, mtime, path, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, path, time.time())
+            )
+        if self.use_xattr:
+            try:
+                os.setxattr(path, XATTR_NAME, b"1")
+            except OSError:
+                pass
+
+    def forget(self, path):
+        """文件已改回原名称(撤销)，删除其记录和标记"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute("DELETE FROM renamed WHERE dev = ? AND inode = ?", (st.st_dev, st.st_ino))
+        if self.use_xattr:
+            try:
+                os.removexattr(path, XATTR_NAME)
+            except OSError:
+                pass
+
+    def renamed_names(self, dir_path, inodes):
+        """
+        找出目录中由本工具重命名产生的文件
+
+        参数:
+            dir_path: 目录路径
+            inodes: 文件名 -> inode(来自os.scandir，Linux上不需要额外的系统调用)
+
+        返回:
+            已改名文件的名称集合；只有inode命中记录的文件才会调用stat核对设备号、大小和修改时间
+        """
+        by_inode = {}
+        for name, inode in inodes.items():
+            by_inode.setdefault(inode, []).append(name)
+        keys = list(by_inode)
+        rows = []
+        with self._lock:
+            if self._conn is None:
+                return set()
+            for start in range(0, len(keys), _QUERY_CHUNK):
+                part = keys[start:start + _QUERY_CHUNK]
+                rows.extend(self._conn.execute(
+                    f"SELECT dev, inode, size, mtime FROM renamed WHERE inode IN ({','.join('?' * len(part))})", part
+                ))
+        renamed = set()
+        for dev, inode, size, mtime in rows:
+            for name in by_inode.get(inode, ()):
+                try:
+                    st = os.stat(os.path.join(dir_path, name))
+                except OSError:
+                    continue
+                if (st.st_dev, st.st_size, st.st_mtime_ns) == (dev, size, mtime):
+                    renamed.add(name)
+        if self.use_xattr:
+            # 记录中没有的文件再检查扩展属性(如从其他磁盘复制过来的文件)
+            for name in inodes:
+                if name not in renamed and has_xattr_tag(os.path.join(dir_path, name)):
+                    renamed.add(name)
+        with self._lock:
+            self.skipped += len(renamed)
+        return renamed
+
+    def sync(self):
+        """把已记录的内容写入磁盘"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+
+    def close(self):
+        """写入磁盘并关闭数据库"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+重命名计划
+计划模式下把AI生成的 原路径 -> 新文件名 流式写入JSONL或CSV计划文件，不修改任何文件；
+之后可以在任意时间(或另一台机器上)不调用API直接执行计划：按目录分组，
+每个目录只打开一次并列出一次现有名称，通过目录文件描述符完成该目录内的全部重命名
+"""
+
+import os
+import csv
+import json
+import time
+from collections import defaultdict
+
+from config import PLAN_DIR
+from name_index import NameIndex
+
+# CSV计划文件的表头
+CSV_HEADER = ["old_path", "new_name"]
+
+
+def default_plan_path(directory=PLAN_DIR, ext=".jsonl"):
+    """生成按时间命名的计划文件路径"""
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"plan_{time.strftime('%Y%m%d_%H%M%S')}{ext}")
+
+
+def _is_csv(path):
+    return path.lower().endswith(".csv")
+
+
+class PlanWriter:
+    """
+    流式写入重命名计划
+
+    文件扩展名为.csv时写CSV(old_path,new_name)，否则写JSONL。每个批次写完后调用flush()，
+    中断时已写入的计划仍然可用。
+    """
+
+    def __init__(self, path, folder_path=None, append=False):
+        """
+        参数:
+            path: 计划文件路径
+            folder_path: 计划针对的文件夹，仅记录在JSONL计划头部
+            append: 为True时在已有计划后继续写入(用于中断后继续生成计划)
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.count = 0  # 本次写入的条目数
+        self._csv = _is_csv(path)
+        has_header = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8', newline='' if self._csv else None)
+        if self._csv:
+            self._writer = csv.writer(self._file)
+            if not has_header:
+                self._writer.writerow(CSV_HEADER)
+        elif not has_header:
+            header = {"t": "plan", "time": time.time()}
+            if folder_path:
+                header["folder"] = os.path.abspath(folder_path)
+            self._file.write(json.dumps(header, ensure_ascii=False) + "\n")
+
+    def add(self, old_path, new_name):
+        """写入一条计划"""
+        if self._csv:
+            self._writer.writerow([old_path, new_name])
+        else:
+            self._file.write(json.dumps({"old": old_path, "new": new_name}, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def flush(self):
+        """把已写入的计划写入磁盘"""
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        """关闭计划文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def plan_folder(path):
+    """返回JSONL计划头部记录的文件夹，没有时返回None"""
+    if _is_csv(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            return json.loads(f.readline()).get("folder")
+        except ValueError:
+            return None
+
+
+def read_plan(path):
+    """
+    读取计划文件
+
+    生成:
+        (原路径, 新文件名)；无法解析的行被忽略
+    """
+    with open(path, 'r', encoding='utf-8', newline='' if _is_csv(path) else None) as f:
+        if _is_csv(path):
+            for row in csv.reader(f):
+                if len(row) >= 2 and row[:2] != CSV_HEADER and row[1]:
+                    yield row[0], row[1]
+            return
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("old") and record.get("new"):
+                yield record["old"], record["new"]
+
+
+class ApplyResult:
+    """执行计划的结果统计"""
+
+    def __init__(self):
+        self.total = 0  # 计划中的条目数
+        self.renamed = 0  # 成功重命名的文件数
+        self.unchanged = 0  # 新旧名称相同而跳过的文件数
+        self.missing = 0  # 原文件已不存在的文件数
+        self.failed = []  # 失败的 (原路径, 错误信息)
+
+    def summary(self):
+        """返回统计摘要文本"""
+        return (f"计划 {self.total} 个文件：已重命名 {self.renamed} 个，无需修改 {self.unchanged} 个，"
+                f"找不到 {self.missing} 个，失败 {len(self.failed)} 个")
+
+
+def _open_dir(dir_path):
+    """打开目录文件描述符，平台不支持按目录描述符重命名时返回None"""
+    if os.rename not in os.supports_dir_fd or not hasattr(os, 'O_DIRECTORY'):
+        return None
+    return os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+
+
+def apply_plan(path, journal=None, log=None, progress=None, should_stop=None):
+    """
+    执行重命名计划，不调用API
+
+    参数:
+        path: 计划文件路径
+        journal: RenameJournal，提供时记录每次重命名以便撤销
+        log: 输出信息的函数
+        progress: 进度回调 progress(已处理数, 总数)，每个目录完成时调用
+        should_stop: 无参函数，返回True时停止执行
+
+    返回:
+        ApplyResult
+    """
+    log = log or (lambda message: None)
+    should_stop = should_stop or (lambda: False)
+    result = ApplyResult()
+
+    # 按目录分组，同一目录的文件连续处理
+    groups = defaultdict(list)
+    for old_path, new_name in read_plan(path):
+        dir_path, old_name = os.path.split(os.path.abspath(old_path))
+        groups[dir_path].append((old_name, os.path.basename(new_name)))
+        result.total += 1
+
+    name_index = NameIndex()
+    done = 0
+    for dir_path in sorted(groups):
+        if should_stop():
+            log("已停止执行计划")
+            break
+        items = groups[dir_path]
+        dir_fd = None
+        try:
+            dir_fd = _open_dir(dir_path)
+            name_index.add_directory(dir_path, os.listdir(dir_fd if dir_fd is not None else dir_path))
+        except OSError as e:
+            if dir_fd is not None:
+                os.close(dir_fd)
+            log(f"无法打开目录，跳过 {len(items)} 个文件: {dir_path} - {e}")
+            result.missing += len(items)
+            done += len(items)
+            if progress:
+                progress(done, result.total)
+            continue
+        try:
+            for old_name, new_name in items:
+                old_path = os.path.join(dir_path, old_name)
+                try:
+                    final_name = name_index.rename(old_path, new_name, dir_fd=dir_fd)
+                except FileNotFoundError:
+                    result.missing += 1
+                    log(f"找不到文件，跳过: {old_path}")
+                    continue
+                except OSError as e:
+                    result.failed.append((old_path, str(e)))
+                    log(f"重命名失败: {old_path} -> {new_name} - {e}")
+                    continue
+                if final_name is None:
+                    result.unchanged += 1
+                    continue
+                result.renamed += 1
+                if journal:
+                    journal.record(old_path, os.path.join(dir_path, final_name))
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+        if journal:
+            journal.sync()
+        done += len(items)
+        if progress:
+            progress(done, result.total)
+    return result
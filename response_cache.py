@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI结果持久化缓存
+以(模型, 关键字/风格, 随机性, 规范化后的原名称)为键，把每个文件/标题的AI结果保存在SQLite中，
+重新运行时只有未命中缓存的部分才需要调用API
+"""
+
+import os
+import time
+import sqlite3
+import threading
+import unicodedata
+
+from config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_AGE_DAYS
+
+# 每写入多少条记录执行一次淘汰
+EVICT_EVERY = 1000
+
+# SQLite单条语句的参数个数有上限，批量查询时分段进行
+_QUERY_CHUNK = 500
+
+
+def normalize_name(name):
+    """规范化原名称：统一Unicode形式、去除首尾空白并忽略大小写"""
+    return unicodedata.normalize('NFC', name).strip().casefold()
+
+
+class ResponseCache:
+    """
+    基于SQLite的AI结果缓存，线程安全
+
+    超过max_age_days未使用的记录会被删除，记录数超过max_entries时按最近使用时间淘汰最旧的记录。
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 max_age_days=RESPONSE_CACHE_MAX_AGE_DAYS):
+        """
+        打开(或创建)缓存数据库
+
+        参数:
+            path: 数据库文件路径
+            max_entries: 最多保留的记录数
+            max_age_days: 记录未被使用的最长保留天数
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                model TEXT NOT NULL,
+                style TEXT NOT NULL,
+                temperature TEXT NOT NULL,
+                name TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, style, temperature, name)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def _scope(model, style, temperature):
+        return (model or "", style or "", "" if temperature is None else f"{float(temperature):g}")
+
+    def get_many(self, model, style, temperature, names):
+        """
+        批量查询缓存
+
+        参数:
+            model: 模型名称
+            style: 关键字或风格等影响输出的提示参数
+            temperature: 随机性，未设置时为None
+            names: 原名称列表
+
+        返回:
+            命中的 {原名称: 结果} 字典
+        """
+        scope = self._scope(model, style, temperature)
+        by_key = {}
+        for name in names:
+            by_key.setdefault(normalize_name(name), []).append(name)
+        keys = list(by_key)
+
+        hits = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _QUERY_CHUNK):
+                chunk = keys[start:start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT name, result FROM responses WHERE model=? AND style=? AND temperature=? "
+                    f"AND name IN ({placeholders})",
+                    (*scope, *chunk),
+                ).fetchall()
+                for key, result in rows:
+                    for name in by_key[key]:
+                        hits[name] = result
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE responses SET last_used=? WHERE model=? AND style=? AND temperature=? AND name=?",
+                        [(now, *scope, key) for key, _ in rows],
+                    )
+            self._conn.commit()
+        return hits
+
+    def get(self, model, style, temperature, name):
+        """查询单个名称的缓存结果，未命中返回None"""
+        return self.get_many(model, style, temperature, [name]).get(name)
+
+    def put_many(self, model, style, temperature, items):
+        """
+        批量写入缓存
+
+        参数:
+            model: 模型名称
+            style: 关键字或风格等影响输出的提示参数
+            temperature: 随机性，未设置时为None
+            items: (原名称, 结果) 的可迭代对象
+        """
+        scope = self._scope(model, style, temperature)
+        now = time.time()
+        rows = [(*scope, normalize_name(name), result, now, now) for name, result in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO responses (model, style, temperature, name, result, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._writes += len(rows)
+            need_evict = self._writes >= EVICT_EVERY
+        if need_evict:
+            self.evict()
+
+    def put(self, model, style, temperature, name, result):
+        """写入单个名称的结果"""
+        self.put_many(model, style, temperature, [(name, result)])
+
+    def evict(self):
+        """删除过期记录，并把记录数控制在max_entries以内"""
+        with self._lock:
+            self._writes = 0
+            self._conn.execute("DELETE FROM responses WHERE last_used < ?", (time.time() - self.max_age,))
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE rowid IN "
+                    "(SELECT rowid FROM responses ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
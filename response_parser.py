@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI返回内容解析
+JSON模式下要求模型返回 {编号: 新文件名} 对象并严格校验，同时保留旧的按行编号格式解析；
+解析不出的编号单独返回，由调用方重新排队，不会因为个别条目拖累整个批次
+"""
+
+import json
+
+# OpenAI兼容接口的JSON输出模式
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# 文件名中不允许出现的字符
+INVALID_NAME_CHARS = '/\\:*?"<>|'
+
+# 单个文件最多请求的次数(含首次)，超过后放弃该文件
+MAX_ITEM_ATTEMPTS = 2
+
+
+def clean_name(name):
+    """去除模型输出中常见的包裹符号、markdown标记和非法字符，无效时返回空字符串"""
+    if not isinstance(name, str):
+        return ""
+    name = name.strip().strip('[]').replace('*', '').replace('`', '')
+    return "".join(c for c in name if c not in INVALID_NAME_CHARS and c >= ' ').strip()
+
+
+def _strip_code_fence(content):
+    """去掉模型有时包裹在JSON外面的```json代码块标记"""
+    content = content.strip()
+    if content.startswith("```"):
+        first_newline = content.find("\n")
+        content = content[first_newline + 1:] if first_newline != -1 else ""
+        if content.rstrip().endswith("```"):
+            content = content.rstrip()[:-3]
+    return content
+
+
+def parse_json_response(content, count):
+    """
+    解析JSON模式的返回内容
+
+    参数:
+        content: 模型输出的文本，应为 {"1": "新文件名1", "2": "新文件名2"} 形式的JSON对象
+        count: 批次中的文件数量
+
+    返回:
+        (结果列表[(批次内序号, 新文件名)], 缺失或无效的批次内序号列表)
+    """
+    try:
+        data = json.loads(_strip_code_fence(content or ""))
+    except ValueError:
+        return [], list(range(count))
+    if not isinstance(data, dict):
+        return [], list(range(count))
+
+    names = {}
+    for key, value in data.items():
+        try:
+            idx = int(key) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= idx < count and idx not in names:
+            name = clean_name(value)
+            if name:
+                names[idx] = name
+
+    results = sorted(names.items())
+    missing = [idx for idx in range(count) if idx not in names]
+    return results, missing
+
+
+def parse_line_response(content, count):
+    """
+    解析按行编号格式的返回内容，如 "1. 新文件名"
+
+    参数:
+        content: 模型输出的文本
+        count: 批次中的文件数量
+
+    返回:
+        (结果列表[(批次内序号, 新文件名)], 缺失或无效的批次内序号列表)
+    """
+    names = {}
+    for line in (content or "").split('\n'):
+        line = line.strip()
+        if not line or not line[0].isdigit() or '. ' not in line:
+            continue
+        number, name = line.split('. ', 1)
+        if not number.isdigit():
+            continue
+        idx = int(number) - 1
+        if 0 <= idx < count and idx not in names:
+            name = clean_name(name)
+            if name:
+                names[idx] = name
+
+    results = sorted(names.items())
+    missing = [idx for idx in range(count) if idx not in names]
+    return results, missing
+
+
+def parse_response(content, count, json_mode=True):
+    """按输出模式解析返回内容，返回值同parse_json_response"""
+    if json_mode:
+        return parse_json_response(content, count)
+    return parse_line_response(content, count)
+
+
+class ResponseStats:
+    """统计请求与解析结果，用于计算浪费的请求比例"""
+
+    def __init__(self):
+        self.requests = 0  # 完成的请求数
+        self.wasted_requests = 0  # 没有解析出任何有效文件名的请求数
+        self.items_requested = 0  # 请求中包含的文件总数
+        self.items_parsed = 0  # 成功解析出新文件名的文件数
+        self.items_requeued = 0  # 重新排队的文件数
+        self.items_dropped = 0  # 多次请求仍失败而放弃的文件数
+        self.prompt_tokens = 0  # API返回的输入Token数
+        self.completion_tokens = 0  # API返回的输出Token数
+
+    def record(self, count, parsed, usage=None):
+        """
+        记录一次请求的解析结果
+
+        参数:
+            count: 请求中的文件数
+            parsed: 解析出新文件名的文件数
+            usage: 响应中的Token用量(response.usage)，没有时为None
+        """
+        self.requests += 1
+        self.items_requested += count
+        self.items_parsed += parsed
+        if parsed == 0:
+            self.wasted_requests += 1
+        if usage is not None:
+            self.prompt_tokens += getattr(usage, 'prompt_tokens', None) or 0
+            self.completion_tokens += getattr(usage, 'completion_tokens', None) or 0
+
+    @property
+    def wasted_rate(self):
+        """浪费的请求比例"""
+        return self.wasted_requests / self.requests if self.requests else 0.0
+
+    @property
+    def tokens_per_file(self):
+        """平均每个请求文件消耗的Token数(输入加输出)"""
+        total = self.prompt_tokens + self.completion_tokens
+        return total / self.items_requested if self.items_requested else 0.0
+
+    def summary(self):
+        """返回统计摘要文本"""
+        text = (f"请求 {self.requests} 次，无效请求 {self.wasted_requests} 次({self.wasted_rate:.1%})，"
+                f"解析成功 {self.items_parsed}/{self.items_requested} 个文件，"
+                f"重新排队 {self.items_requeued} 个，放弃 {self.items_dropped} 个")
+        if self.prompt_tokens or self.completion_tokens:
+            text += (f"，Token 输入 {self.prompt_tokens} / 输出 {self.completion_tokens}，"
+                     f"平均每个文件 {self.tokens_per_file:.1f}")
+        return text
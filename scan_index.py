@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+增量扫描索引
+在SQLite中记录每个目录的inode、修改时间和子目录，以及已处理文件的大小和修改时间。
+再次处理同一目录树时，修改时间没有变化的目录不再列出内容，只按记录的子目录继续向下检查；
+有变化的目录只交出新增或修改过的文件。每晚处理一遍基本不变的大型归档时，只需对每个目录调用一次stat
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from config import SCAN_INDEX_PATH
+
+# 修改时间距今不足此秒数的目录不记录其修改时间(FAT等文件系统的时间精度为2秒，
+# 同一时间刻度内的后续修改无法通过修改时间发现)，下次仍会重新列出
+MTIME_SETTLE_SECONDS = 2
+
+# 时间精度高于1秒的文件系统(ext4、NTFS、APFS等)上，重命名后重新记录修改时间前最多等待的秒数
+FINE_MTIME_SETTLE_SECONDS = 0.02
+
+# 每写入多少个目录提交一次
+COMMIT_EVERY = 200
+
+# 目录没有完全处理时记录的修改时间，下次一定会重新列出
+_UNCONFIRMED = -1
+
+
+class _PendingDirectory:
+    """本次列出、文件尚未全部处理完的目录"""
+
+    __slots__ = ("inode", "mtime", "subdirs", "known", "outstanding", "names", "renamed")
+
+    def __init__(self, inode, mtime, subdirs, known, outstanding, names=None):
+        self.inode = inode
+        self.mtime = mtime
+        self.subdirs = subdirs
+        self.known = known  # 已处理的文件: 文件名 -> (大小, 修改时间)
+        self.outstanding = outstanding  # 交出后尚未处理的文件: 文件名 -> (大小, 修改时间)
+        self.names = names  # 目录中全部条目的名称(按重命名结果更新)，为None时不核对
+        self.renamed = False  # 是否有文件被重命名(目录的修改时间因此改变)
+
+
+class ScanIndex:
+    """
+    基于SQLite的增量扫描索引，线程安全
+
+    扫描线程调用unchanged_subdirs和begin_directory，处理线程对处理完的文件调用mark_done；
+    一个目录交出的文件全部处理完后才记录该目录的修改时间，中途停止的目录下次会重新列出。
+    重命名会改变目录的修改时间，这些目录在close时重新取得修改时间并核对内容，下次运行即可跳过。
+    """
+
+    def __init__(self, path=SCAN_INDEX_PATH):
+        """
+        打开(或创建)索引数据库
+
+        参数:
+            path: 数据库文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}  # 目录路径 -> _PendingDirectory
+        self._renamed = {}  # 处理完、有文件被重命名的目录: 目录路径 -> _PendingDirectory
+        self._writes = 0
+        self.skipped_dirs = 0  # 没有变化、未列出内容的目录数
+        self.listed_dirs = 0  # 列出内容的目录数
+        self.skipped_files = 0  # 列出的目录中没有变化、不再交出的文件数
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                subdirs TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                PRIMARY KEY (dir, name)
+            )
+        """)
+        self._conn.commit()
+
+    def unchanged_subdirs(self, dir_path, st):
+        """
+        检查目录自上次处理后是否有变化
+
+        参数:
+            dir_path: 目录路径(按绝对路径记录)
+            st: 目录的os.stat结果
+
+        返回:
+            没有变化时返回记录的子目录名称列表(已排序)，有变化或没有记录时返回None
+        """
+        dir_path = os.path.abspath(dir_path)
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT inode, mtime, subdirs FROM dirs WHERE path = ?", (dir_path,)
+            ).fetchone()
+            if row is None or row[0] != st.st_ino or row[1] != st.st_mtime_ns:
+                return None
+            self.skipped_dirs += 1
+            return json.loads(row[2])
+
+    def begin_directory(self, dir_path, st, subdirs, files, names=None):
+        """
+        记录列出的目录，筛选出需要处理的文件
+
+        参数:
+            dir_path: 目录路径
+            st: 列出目录之前取得的os.stat结果
+            subdirs: 子目录名称列表
+            files: 文件名 -> (大小, 修改时间)
+            names: 目录中全部条目的名称，提供时有文件被重命名的目录在close时核对内容后记录新的修改时间
+
+        返回:
+            新增或大小、修改时间有变化的文件名列表
+        """
+        dir_path = os.path.abspath(dir_path)
+        subdirs = sorted(subdirs)
+        with self._lock:
+            if self._conn is None:
+                return sorted(files)
+            self.listed_dirs += 1
+            row = self._conn.execute("SELECT subdirs FROM dirs WHERE path = ?", (dir_path,)).fetchone()
+            if row:
+                # 已删除或改名的子目录，连同其下所有记录一起清除
+                for name in set(json.loads(row[0])) - set(subdirs):
+                    self._delete_tree(os.path.join(dir_path, name))
+            stored = {name: (size, mtime) for name, size, mtime in self._conn.execute(
+                "SELECT name, size, mtime FROM files WHERE dir = ?", (dir_path,))}
+            known = {}
+            outstanding = {}
+            for name, stat in files.items():
+                if stored.get(name) == stat:
+                    known[name] = stat
+                else:
+                    outstanding[name] = stat
+            self.skipped_files += len(known)
+            mtime = st.st_mtime_ns
+            if mtime > (time.time() - MTIME_SETTLE_SECONDS) * 1e9:
+                mtime = _UNCONFIRMED
+            pending = _PendingDirectory(st.st_ino, mtime, subdirs, known, outstanding,
+                                        set(names) if names is not None else None)
+            if outstanding:
+                self._pending[dir_path] = pending
+            else:
+                self._write(dir_path, pending)
+        return sorted(outstanding)
+
+    def mark_done(self, old_path, new_path=None):
+        """
+        记录处理完的文件
+
+        参数:
+            old_path: 交出时的文件路径
+            new_path: 重命名后的路径，未重命名时为None
+        """
+        dir_path, name = os.path.split(os.path.abspath(old_path))
+        with self._lock:
+            pending = self._pending.get(dir_path) if self._conn is not None else None
+            if pending is None:
+                return
+            stat = pending.outstanding.pop(name, None)
+            if stat is None:
+                return
+            new_name = os.path.basename(new_path) if new_path else name
+            pending.known[new_name] = stat
+            if new_name != name:
+                pending.renamed = True
+                if pending.names is not None:
+                    pending.names.discard(name)
+                    pending.names.add(new_name)
+            if not pending.outstanding:
+                del self._pending[dir_path]
+                self._write(dir_path, pending)
+                if pending.renamed and pending.names is not None:
+                    self._renamed[dir_path] = pending
+
+    def _write(self, dir_path, pending):
+        """写入目录记录(调用方持有锁)"""
+        self._conn.execute("DELETE FROM files WHERE dir = ?", (dir_path,))
+        self._conn.executemany(
+            "INSERT INTO files (dir, name, size, mtime) VALUES (?, ?, ?, ?)",
+            [(dir_path, name, size, mtime) for name, (size, mtime) in pending.known.items()]
+        )
+        mtime = pending.mtime if not pending.outstanding else _UNCONFIRMED
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, inode, mtime, subdirs) VALUES (?, ?, ?, ?)",
+            (dir_path, pending.inode, mtime, json.dumps(pending.subdirs, ensure_ascii=False))
+        )
+        self._writes += 1
+        if self._writes % COMMIT_EVERY == 0:
+            self._conn.commit()
+
+    def _refresh_mtimes(self):
+        """
+        重新记录有文件被重命名的目录的修改时间(调用方持有锁)
+
+        目录内容与处理结果一致(没有其他程序的改动)时才记录，否则保留列出前的修改时间，下次重新列出
+        """
+        for dir_path, pending in self._renamed.items():
+            try:
+                st = os.stat(dir_path)
+                if st.st_ino != pending.inode:
+                    continue
+                # 时间精度高的文件系统只需稍等片刻，保证之后的改动会得到不同的修改时间
+                fine = st.st_mtime_ns % 1000000000 != 0
+                wait = st.st_mtime_ns / 1e9 + FINE_MTIME_SETTLE_SECONDS - time.time()
+                if fine and 0 < wait <= FINE_MTIME_SETTLE_SECONDS:
+                    time.sleep(wait)
+                settle = FINE_MTIME_SETTLE_SECONDS if fine else MTIME_SETTLE_SECONDS
+                if st.st_mtime_ns > (time.time() - settle) * 1e9:
+                    continue
+                if set(os.listdir(dir_path)) != pending.names:
+                    continue
+                if os.stat(dir_path).st_mtime_ns != st.st_mtime_ns:
+                    continue
+            except OSError:
+                continue
+            self._conn.execute("UPDATE dirs SET mtime = ? WHERE path = ? AND inode = ?",
+                               (st.st_mtime_ns, dir_path, pending.inode))
+        self._renamed.clear()
+
+    def _delete_tree(self, dir_path):
+        """删除目录及其所有子目录的记录(调用方持有锁)"""
+        # 按路径范围删除，避免LIKE对文件名中的%和_做通配匹配
+        low = dir_path + os.sep
+        high = dir_path + chr(ord(os.sep) + 1)
+        for table, column in (("dirs", "path"), ("files", "dir")):
+            self._conn.execute(f"DELETE FROM {table} WHERE {column} = ? OR ({column} >= ? AND {column} < ?)",
+                               (dir_path, low, high))
+
+    def close(self):
+        """写入未处理完的目录(下次重新列出，只交出尚未处理的文件)，重新记录有文件被重命名的目录的修改时间，并关闭数据库"""
+        with self._lock:
+            if self._conn is None:
+                return
+            for dir_path, pending in self._pending.items():
+                self._write(dir_path, pending)
+            self._pending.clear()
+            self._refresh_mtimes()
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
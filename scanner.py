@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+流式目录扫描器
+基于os.scandir在后台线程中扫描目录，通过有界队列把文件分块交给请求流水线，
+第一批请求不必等待整个目录树扫描完成，内存占用也不随文件总数增长
+"""
+
+import os
+import time
+import queue
+import threading
+
+from stage_metrics import stage_metrics
+
+# 每个分块最多包含的文件数
+SCAN_CHUNK_SIZE = 256
+
+# 队列中最多积压的分块数，队列满时扫描线程暂停(背压)
+SCAN_QUEUE_SIZE = 64
+
+# 消费者等待分块、扫描线程等待队列空位时的轮询间隔(秒)
+POLL_INTERVAL = 0.2
+
+_DONE = object()
+
+
+def iter_directories(folder_path, include_subdirs=True, on_error=None, scan_index=None, ledger=None):
+    """
+    逐个目录列出文件
+
+    每个目录的文件列表在产出前已完整读取，因此调用方在处理这些文件(例如重命名)时
+    不会影响同一目录的扫描结果。
+
+    参数:
+        folder_path: 根目录
+        include_subdirs: 是否递归扫描子目录
+        on_error: 目录无法读取时的回调 on_error(path, exception)
+        scan_index: 增量扫描索引(ScanIndex)，指定时跳过没有变化的目录，只产出新增或修改过的文件
+        ledger: 已改名文件记录(RenameLedger)，指定时不产出本工具重命名产生的文件
+
+    生成:
+        (目录路径, 相对根目录的路径, 文件名列表, 目录中全部条目的名称列表)，根目录的相对路径为空字符串
+    """
+    stack = [(folder_path, "")]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        files = []
+        subdirs = []
+        names = []
+        stats = {}
+        inodes = {}
+        try:
+            if scan_index is not None:
+                # 先取得目录的修改时间再列出内容，列出期间的改动下次仍能发现
+                dir_stat = os.stat(dir_path)
+                stored_subdirs = scan_index.unchanged_subdirs(dir_path, dir_stat)
+                if stored_subdirs is not None:
+                    if include_subdirs:
+                        _push_subdirs(stack, dir_path, rel_dir, stored_subdirs)
+                    continue
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    names.append(entry.name)
+                    try:
+                        if entry.is_file():
+                            if scan_index is not None:
+                                file_stat = entry.stat()
+                                stats[entry.name] = (file_stat.st_size, file_stat.st_mtime_ns)
+                            if ledger is not None:
+                                inodes[entry.name] = entry.inode()
+                            files.append(entry.name)
+                        elif (include_subdirs or scan_index is not None) and entry.is_dir(follow_symlinks=False):
+                            # 使用索引时总是记录子目录，之后递归处理时可以直接使用
+                            subdirs.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError as e:
+            if on_error:
+                on_error(dir_path, e)
+            continue
+
+        if scan_index is not None:
+            files = scan_index.begin_directory(dir_path, dir_stat, subdirs, stats, names)
+        if ledger is not None and files:
+            renamed = ledger.renamed_names(dir_path, {name: inodes[name] for name in files if name in inodes})
+            if renamed:
+                files = [name for name in files if name not in renamed]
+                if scan_index is not None:
+                    # 跳过的文件视为已处理，目录的修改时间照常记录
+                    for name in renamed:
+                        scan_index.mark_done(os.path.join(dir_path, name))
+        if include_subdirs:
+            _push_subdirs(stack, dir_path, rel_dir, subdirs)
+        if files:
+            yield dir_path, rel_dir, files, names
+
+
+def _push_subdirs(stack, dir_path, rel_dir, subdirs):
+    """倒序入栈，使子目录按名称顺序出栈"""
+    for name in sorted(subdirs, reverse=True):
+        stack.append((os.path.join(dir_path, name), os.path.join(rel_dir, name) if rel_dir else name))
+
+
+class DirectoryScanner:
+    """
+    后台目录扫描器
+
+    扫描线程产出 (完整路径, 文件名, 相对目录) 的分块，消费者通过chunks()取出。
+    """
+
+    def __init__(self, folder_path, include_subdirs=True, chunk_size=SCAN_CHUNK_SIZE,
+                 queue_size=SCAN_QUEUE_SIZE, should_stop=None, on_error=None, on_directory=None, scan_index=None,
+                 ledger=None):
+        """
+        初始化扫描器
+
+        参数:
+            folder_path: 根目录
+            include_subdirs: 是否递归扫描子目录
+            chunk_size: 每个分块最多包含的文件数
+            queue_size: 队列中最多积压的分块数
+            should_stop: 无参函数，返回True时停止扫描
+            on_error: 目录无法读取时的回调 on_error(path, exception)
+            on_directory: 每列出一个包含文件的目录时的回调 on_directory(path, names)，
+                          names为目录中全部条目的名称，在扫描线程中调用
+            scan_index: 增量扫描索引(ScanIndex)，指定时跳过上次处理后没有变化的目录
+            ledger: 已改名文件记录(RenameLedger)，指定时跳过本工具重命名产生的文件
+        """
+        self.folder_path = folder_path
+        self.include_subdirs = include_subdirs
+        self.chunk_size = chunk_size
+        self.should_stop = should_stop or (lambda: False)
+        self.on_error = on_error
+        self.on_directory = on_directory
+        self.scan_index = scan_index
+        self.ledger = ledger
+        self.count = 0  # 已扫描到的文件数
+        self.finished = False  # 扫描是否已完成
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    def start(self):
+        """启动后台扫描线程"""
+        self._thread = threading.Thread(target=self._run, name="directory-scanner", daemon=True)
+        self._thread.start()
+        return self
+
+    def _put(self, item):
+        """放入队列，队列满时等待，停止时放弃；返回是否成功放入"""
+        while not self.should_stop():
+            try:
+                self._queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            chunk = []
+            # 扫描耗时只统计列出目录的时间，不包括等待队列空位的时间
+            started = time.perf_counter()
+            for dir_path, rel_dir, files, names in iter_directories(self.folder_path, self.include_subdirs,
+                                                                     self.on_error, self.scan_index, self.ledger):
+                stage_metrics.observe("scan", time.perf_counter() - started, len(files))
+                stage_metrics.incr("files_scanned", len(files))
+                if self.on_directory:
+                    self.on_directory(dir_path, names)
+                for name in files:
+                    chunk.append((os.path.join(dir_path, name), name, rel_dir))
+                    if len(chunk) >= self.chunk_size:
+                        self.count += len(chunk)
+                        if not self._put(chunk):
+                            return
+                        chunk = []
+                # 每个目录结束时也交出当前分块，避免小目录的文件长时间积压
+                if chunk:
+                    self.count += len(chunk)
+                    if not self._put(chunk):
+                        return
+                    chunk = []
+                started = time.perf_counter()
+        finally:
+            self.finished = True
+            self._put(_DONE)
+
+    def chunks(self):
+        """
+        逐块取出扫描结果
+
+        生成:
+            文件信息列表；暂时没有新分块时产出None，便于调用方在等待期间处理其他事情
+        """
+        while True:
+            try:
+                item = self._queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self.should_stop() or (self.finished and self._thread and not self._thread.is_alive()
+                                          and self._queue.empty()):
+                    return
+                yield None
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+
+class PathListScanner:
+    """
+    与DirectoryScanner接口相同，但只处理给定的文件(监视模式下新到达的文件)
+
+    按目录分组产出分块，不启动后台线程；已不存在的文件和已改名的文件被跳过。
+    """
+
+    def __init__(self, folder_path, paths, chunk_size=SCAN_CHUNK_SIZE, should_stop=None, on_error=None,
+                 on_directory=None, ledger=None):
+        """
+        参数:
+            folder_path: 根目录，用于计算相对目录
+            paths: 要处理的文件路径列表
+            其他参数同DirectoryScanner
+        """
+        self.folder_path = folder_path
+        self.paths = paths
+        self.chunk_size = chunk_size
+        self.should_stop = should_stop or (lambda: False)
+        self.on_error = on_error
+        self.on_directory = on_directory
+        self.ledger = ledger
+        self.count = 0
+        self.finished = False
+
+    def start(self):
+        return self
+
+    def chunks(self):
+        """逐块产出文件信息列表"""
+        groups = {}
+        for path in self.paths:
+            dir_path, name = os.path.split(path)
+            groups.setdefault(dir_path, []).append(name)
+        try:
+            for dir_path, names in groups.items():
+                if self.should_stop():
+                    return
+                started = time.perf_counter()
+                try:
+                    entries = os.listdir(dir_path)
+                except OSError as e:
+                    if self.on_error:
+                        self.on_error(dir_path, e)
+                    continue
+                existing = set(entries)
+                inodes = {}
+                for name in names:
+                    if name in existing:
+                        try:
+                            inodes[name] = os.stat(os.path.join(dir_path, name)).st_ino
+                        except OSError:
+                            continue
+                files = list(inodes)
+                if self.ledger is not None and files:
+                    renamed = self.ledger.renamed_names(dir_path, inodes)
+                    files = [name for name in files if name not in renamed]
+                stage_metrics.observe("scan", time.perf_counter() - started, len(files))
+                stage_metrics.incr("files_scanned", len(files))
+                if not files:
+                    continue
+                if self.on_directory:
+                    self.on_directory(dir_path, entries)
+                rel_dir = os.path.relpath(dir_path, self.folder_path)
+                rel_dir = "" if rel_dir == "." else rel_dir
+                for start in range(0, len(files), self.chunk_size):
+                    chunk = [(os.path.join(dir_path, name), name, rel_dir) for name in files[start:start + self.chunk_size]]
+                    self.count += len(chunk)
+                    yield chunk
+        finally:
+            self.finished = True
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+运行指标
+统计扫描、构建提示词、限流等待、API请求、解析、冲突处理、重命名各阶段的耗时分布和处理数量，
+以及请求、错误等计数。每次运行结束时输出各阶段摘要，长时间运行的任务(如监视模式)
+还可以通过本地HTTP服务提供Prometheus格式的指标，或定时写入JSON文件
+"""
+
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_BUCKETS, METRICS_HOST, METRICS_JSON_INTERVAL
+
+# 各阶段名称，按处理顺序
+STAGES = ("scan", "prompt", "throttle", "request", "parse", "collision", "rename")
+
+# 摘要中显示的阶段名称
+STAGE_LABELS = {
+    "scan": "扫描目录",
+    "prompt": "构建提示词",
+    "throttle": "限流等待",
+    "request": "API请求",
+    "parse": "解析返回",
+    "collision": "冲突处理",
+    "rename": "重命名",
+}
+
+# 计数器名称和说明
+COUNTERS = {
+    "files_scanned": "扫描到的文件数",
+    "files_renamed": "重命名的文件数",
+    "rename_errors": "重命名失败的文件数",
+    "cache_hits": "命中缓存的文件数",
+    "api_requests": "成功的API请求数",
+    "api_errors": "失败的API请求数",
+    "api_throttled": "被限流(429)的API请求数",
+    "prompt_tokens": "输入Token数",
+    "completion_tokens": "输出Token数",
+    "cost_yuan": "按价格表计算的费用(元)",
+}
+
+# Prometheus指标名称前缀
+METRIC_PREFIX = "ali_ai_rename"
+
+
+class _Histogram:
+    """一个阶段的耗时分布"""
+
+    __slots__ = ("buckets", "count", "sum", "items")
+
+    def __init__(self, size):
+        self.buckets = [0] * size  # 各分桶的次数(不累计)，最后一个为超过最大上限的次数
+        self.count = 0  # 次数
+        self.sum = 0.0  # 总耗时(秒)
+        self.items = 0  # 处理的文件数
+
+
+def quantile(bounds, buckets, q):
+    """
+    按分桶估算分位数(在分桶内线性插值)
+
+    参数:
+        bounds: 分桶上限
+        buckets: 各分桶的次数，比bounds多一个(超过最大上限的次数)
+        q: 分位，如0.95
+
+    返回:
+        估算的耗时(秒)，没有数据时返回None；落在最后一个分桶时返回最大上限
+    """
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(bounds, buckets):
+        if count and seen + count >= rank:
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return bounds[-1]
+
+
+def _format_seconds(seconds):
+    if seconds < 0.001:
+        return f"{seconds * 1000000:.0f}µs"
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.2f}秒"
+
+
+class StageMetrics:
+    """各阶段的耗时分布和计数，所有线程共用"""
+
+    def __init__(self, bounds=METRICS_BUCKETS):
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self._stages = {stage: _Histogram(len(self.bounds) + 1) for stage in STAGES}
+        self._counters = dict.fromkeys(COUNTERS, 0)
+        self.started = time.time()
+
+    def observe(self, stage, seconds, items=1):
+        """
+        记录一次阶段耗时
+
+        参数:
+            stage: 阶段名称(STAGES之一)
+            seconds: 耗时(秒)
+            items: 本次处理的文件数
+        """
+        index = bisect_left(self.bounds, seconds)  # 第一个不小于耗时的上限
+        with self._lock:
+            histogram = self._stages[stage]
+            histogram.buckets[index] += 1
+            histogram.count += 1
+            histogram.sum += seconds
+            histogram.items += items
+
+    @contextmanager
+    def timer(self, stage, items=1):
+        """计时代码块，用法: with stage_metrics.timer("parse", len(batch)): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, items)
+
+    def incr(self, counter, amount=1):
+        """计数器增加amount"""
+        if amount:
+            with self._lock:
+                self._counters[counter] += amount
+
+    def snapshot(self):
+        """返回当前统计值的副本，用于计算一次运行内的增量或导出"""
+        with self._lock:
+            stages = {stage: {"count": h.count, "sum": h.sum, "items": h.items, "buckets": list(h.buckets)}
+                      for stage, h in self._stages.items()}
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def _delta(self, since):
+        values = self.snapshot()
+        if since:
+            for stage, item in values["stages"].items():
+                before = since["stages"][stage]
+                for key in ("count", "sum", "items"):
+                    item[key] -= before[key]
+                item["buckets"] = [a - b for a, b in zip(item["buckets"], before["buckets"])]
+            for name in values["counters"]:
+                values["counters"][name] -= since["counters"][name]
+        return values
+
+    def summary_lines(self, since=None):
+        """
+        返回各阶段的摘要文本
+
+        参数:
+            since: snapshot()的返回值，提供时只统计此后的部分
+        """
+        values = self._delta(since)
+        lines = []
+        for stage in STAGES:
+            item = values["stages"][stage]
+            if not item["count"]:
+                continue
+            text = (f"{STAGE_LABELS[stage]}: {item['count']} 次，共 {_format_seconds(item['sum'])}，"
+                    f"平均 {_format_seconds(item['sum'] / item['count'])}，"
+                    f"P95 {_format_seconds(quantile(self.bounds, item['buckets'], 0.95))}")
+            if item["items"] != item["count"] and item["sum"] > 0:
+                text += f"，{item['items']} 个文件(每秒 {item['items'] / item['sum']:.0f} 个)"
+            lines.append(text)
+        return lines
+
+    def to_dict(self):
+        """返回可写入JSON的全部统计值"""
+        values = self.snapshot()
+        for item in values["stages"].values():
+            item["p50"] = quantile(self.bounds, item["buckets"], 0.5)
+            item["p95"] = quantile(self.bounds, item["buckets"], 0.95)
+        values["bounds"] = list(self.bounds)
+        values["started"] = self.started
+        values["updated"] = time.time()
+        return values
+
+    def prometheus_text(self):
+        """返回Prometheus文本格式的指标"""
+        values = self.snapshot()
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} 各处理阶段的耗时", f"# TYPE {name} histogram"]
+        for stage in STAGES:
+            item = values["stages"][stage]
+            cumulative = 0
+            for bound, count in zip(self.bounds, item["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {item["count"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {item["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {item["count"]}')
+        name = f"{METRIC_PREFIX}_stage_items_total"
+        lines += [f"# HELP {name} 各处理阶段处理的文件数", f"# TYPE {name} counter"]
+        lines += [f'{name}{{stage="{stage}"}} {values["stages"][stage]["items"]}' for stage in STAGES]
+        for counter, description in COUNTERS.items():
+            name = f"{METRIC_PREFIX}_{counter}_total"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter",
+                      f"{name} {values['counters'][counter]}"]
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        """把统计值写入JSON文件(先写临时文件再替换，读取方不会读到写了一半的内容)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+
+# 进程内共享的运行指标
+stage_metrics = StageMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """提供 /metrics(Prometheus文本格式) 和 /metrics.json"""
+
+    metrics = stage_metrics
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.metrics.prometheus_text().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(self.metrics.to_dict(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """
+    在后台导出运行指标：本地HTTP服务和/或定时写入JSON文件
+
+    用法: exporter = MetricsExporter(port=9108, json_path="logs/metrics.json").start()，结束时调用stop()
+    """
+
+    def __init__(self, metrics=stage_metrics, port=None, json_path=None, host=METRICS_HOST,
+                 interval=METRICS_JSON_INTERVAL):
+        """
+        参数:
+            metrics: 要导出的StageMetrics
+            port: HTTP服务端口，为None时不开启(为0时由系统分配，实际端口见self.port)
+            json_path: JSON文件路径，为None时不写入
+            host: HTTP服务监听的地址
+            interval: 写入JSON文件的间隔(秒)
+        """
+        self.metrics = metrics
+        self.port = port
+        self.json_path = json_path
+        self.host = host
+        self.interval = interval
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """启动HTTP服务和写入线程，端口被占用等错误直接抛出OSError"""
+        if self.port is not None:
+            handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": self.metrics})
+            self._server = ThreadingHTTPServer((self.host, self.port), handler)
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+            self._threads.append(threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True))
+        if self.json_path:
+            self._threads.append(threading.Thread(target=self._write_loop, name="metrics-json", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.metrics.write_json(self.json_path)
+            except OSError:
+                pass
+
+    def stop(self):
+        """停止导出，JSON文件最后写入一次"""
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        if self.json_path:
+            try:
+                self.metrics.write_json(self.json_path)
+            except OSError:
+                pass